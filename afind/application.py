@@ -1,10 +1,15 @@
 from __future__ import unicode_literals, print_function
 import os
+import re
 import sys
 from collections import OrderedDict
 from afind.utils.filenames_collector import FilenamesCollector
 from afind.utils.result_formatters import TtyFormatter, PipeFormatter, PatchFormatter
-from afind.backends.ag import BackendParser
+from afind.backends.registry import BACKENDS, PARAM_BACKENDS, get_backend_parser, import_parser_class
+from afind.backends._base import ParseResult
+from afind.utils.search_options import SearchOptions
+from afind.utils.output_sink import OutputSink
+from afind.utils.profiler import Profiler, NULL_PROFILER
 
 
 class Application(object):
@@ -15,27 +20,112 @@ class Application(object):
         ('--atom',         {'args_count': 0, 'description': 'Open files in Atom'}),
         ('--make-patch',   {'args_count': 0, 'description': 'Generate patch for bulk file editing'}),
         ('--apply-patch',  {'args_count': 1, 'description': 'Apply previously generated patch'}),
+        ('--replace',      {'args_count': 1, 'description': 'TEXT Replace matches in files, \\1 refers regex group'}),
+        ('--replace-diff', {'args_count': 0, 'description': 'Print patch of changes made by --replace'}),
+        ('--dry-run',      {'args_count': 0,
+                            'description': 'Only check that patch or replace applies, don\'t change files'}),
         ('--force-colors', {'args_count': 0, 'description': 'Preserve colors while piping'}),
+        ('--json',         {'args_count': 0, 'description': 'Print results as JSON object per line'}),
+        ('--backend',      {'args_count': 1, 'description': 'NAME Search backend: ' + ', '.join(BACKENDS) +
+                                                           ' (default: first installed)'}),
+        ('--native',       {'args_count': 0, 'description': 'Same as --backend native'}),
+        ('--jobs',         {'args_count': 1, 'description': 'N Split native search between N processes'}),
+        ('--rev',          {'args_count': 1, 'is_repeatable': True,
+                            'description': 'REV Search files of git revision instead of working tree, '
+                                           'can be repeated'}),
+        ('--patterns-file', {'args_count': 1,
+                             'description': 'FILE Search all literals of FILE, one per line, in one pass'}),
+        ('--patterns-summary', {'args_count': 0,
+                                'description': 'Print amount of matches of every --patterns-file literal'}),
+        ('--max-results',  {'args_count': 1, 'description': 'N Stop search after N matched lines'}),
+        ('--max-files',    {'args_count': 1, 'description': 'N Stop search after N files with matches'}),
+        ('--deadline',     {'args_count': 1, 'description': 'SECONDS Stop search after SECONDS, print what is found'}),
+        ('--watch',        {'args_count': 0,
+                            'description': 'Search changed files again after every change, print added/removed lines'}),
+        ('--index-build',  {'args_count': 0, 'description': 'Build search index of current directory'}),
+        ('--index-update', {'args_count': 0, 'description': 'Re-index files changed since index was built'}),
+        ('--use-index',    {'args_count': 0, 'description': 'Search only files which index considers as matching'}),
+        ('--cache',        {'args_count': 0,
+                            'description': 'Reuse results of identical search made within AFIND_CACHE_TTL '
+                                           'seconds (300), in-place edits of files are seen only after it '
+                                           '(or set AFIND_CACHE=1)'}),
+        ('--no-cache',     {'args_count': 0, 'description': 'Don\'t use results cache'}),
+        ('--daemon',       {'args_count': 0,
+                            'description': 'Serve searches of --use-daemon clients, keeping everything warm'}),
+        ('--use-daemon',   {'args_count': 0,
+                            'description': 'Run search in daemon if it is running (or set AFIND_DAEMON=1)'}),
+        ('--afind-profile', {'args_count': 0, 'description': 'Print time and counters of search stages to stderr'}),
+        ('--afind-profile-json', {'args_count': 1, 'description': 'FILE Save --afind-profile stats to FILE as JSON'}),
         ('--afind-dbg',    {'args_count': 0, 'is_hidden': True}),
     ])
 
+    # params which don't affect results stream, so they aren't part of cache key.
+    # Limits are applied to stream read from cache, which is always complete
+    OUTPUT_PARAMS = [
+        '--subl', '--atom', '--make-patch', '--force-colors', '--json', '--afind-dbg', '--cache', '--no-cache',
+        '--replace', '--replace-diff', '--dry-run', '--afind-profile', '--afind-profile-json',
+        '--use-daemon', '--max-results', '--max-files', '--deadline', '--patterns-summary',
+    ]
+
+    LIMIT_PARAMS = ['--max-results', '--max-files', '--deadline']
+
+    # params which don't make sense for results changing over time
+    WATCH_INCOMPATIBLE_PARAMS = [
+        '--replace', '--make-patch', '--subl', '--atom', '--rev', '--json',
+        '--max-results', '--max-files', '--deadline',
+    ]
+
+    # params which need files of working tree, so they can't be used with --rev
+    WORKTREE_PARAMS = ['--replace', '--make-patch', '--jobs', '--use-index', '--subl', '--atom']
+
     PARAMS_FIELD_LENGTH = 24
 
+    # with more candidates from index, search of whole tree is not slower than passing them all
+    INDEX_MAX_CANDIDATES = 5000
+
+    # options which make backend report what doesn't match, index can't narrow such search
+    INVERTING_OPTIONS = ('-v', '--invert-match', '-L', '--files-without-matches')
+
     def __init__(self):
-        self.parser = BackendParser()
+        # backend has to be known before argv is split, as it brings own params
+        self.parser = self._get_backend_parser(sys.argv[1:])
         self.custom_params = OrderedDict()
         self.custom_params.update(self.parser.CUSTOM_PARAMS)
         self.custom_params.update(self.CUSTOM_PARAMS)
 
+    def _get_backend_parser(self, argv):
+        for param_name, parser_class in PARAM_BACKENDS.items():
+            if param_name in argv:
+                return import_parser_class(parser_class)()
+
+        name = os.environ.get('AFIND_BACKEND')
+
+        if '--native' in argv:
+            name = 'native'
+        if '--backend' in argv[:-1]:
+            name = argv[argv.index('--backend') + 1].decode('utf-8')
+
+        if name and name not in BACKENDS:
+            sys.stderr.write(b'Error: Unknown backend {}, use one of: {}\n'.format(name, ', '.join(BACKENDS)))
+            sys.exit(1)
+
+        return get_backend_parser(name)
+
     def run(self):
         self.parser_params, self.afind_params = self.split_argv()
 
+        self.patterns = None
+        if '--patterns-file' in self.afind_params:
+            self.parser_params = self._get_patterns_params(self.parser_params)
+
         show_usage = False
 
         if  ('-h' in self.parser_params) or ('--help' in self.parser_params):
             show_usage = True
         elif '--apply-patch' in self.afind_params:
             show_usage = False
+        elif ('--index-build' in self.afind_params) or ('--index-update' in self.afind_params):
+            show_usage = False
         elif not self.parser_params:
             show_usage = True
 
@@ -47,35 +137,389 @@ class Application(object):
 
         if '--apply-patch' in self.afind_params:
             self._run_patch_apply()
+        elif '--index-build' in self.afind_params:
+            self._run_index_build()
+        elif '--index-update' in self.afind_params:
+            self._run_index_update()
         else:
             self._run_search()
 
     def _run_search(self):
         self.actions_pre()
 
-        results_stream = self.parser.get_results(self.parser_params, self.afind_params)
-        formatter = self._get_output_formatter(results_stream)
+        if '--rev' in self.afind_params:
+            for param_name in self.WORKTREE_PARAMS:
+                if param_name in self.afind_params:
+                    sys.stderr.write('Error: {} can\'t be used with --rev\n'.format(param_name))
+                    sys.exit(1)
+
+        if '--watch' in self.afind_params:
+            for param_name in self.WATCH_INCOMPATIBLE_PARAMS:
+                if param_name in self.afind_params:
+                    sys.stderr.write('Error: {} can\'t be used with --watch\n'.format(param_name))
+                    sys.exit(1)
+
+        # wrong -nG patterns are reported before backend gets them
+        self._get_path_excluder()
+
+        if '--jobs' in self.afind_params:
+            from afind.backends.native import NativeParser
+            from afind.backends.sharded import ShardedParser
+            jobs = self._get_positive_param('--jobs')
+            # ag and rg would skip their own ignore rules for files listed for them
+            if not isinstance(self.parser, NativeParser):
+                sys.stderr.write('Error: --jobs can be used only with native backend\n')
+                sys.exit(1)
+            self.parser = ShardedParser(NativeParser, jobs)
+
+        if ('--afind-profile' in self.afind_params) or ('--afind-profile-json' in self.afind_params):
+            self.profiler = Profiler()
+        else:
+            self.profiler = NULL_PROFILER
+        self.parser.profiler = self.profiler
+
+        # tree is watched before initial search, so changes made during it aren't missed
+        self.watch_session = None
+        if '--watch' in self.afind_params:
+            from afind.utils.watch_session import WatchSession
+            include_rx, excluder = self._get_path_filters(SearchOptions(self.parser_params))
+            self.watch_session = WatchSession(
+                self.parser, self.parser_params, self.afind_params, include_rx, excluder,
+                is_tty=sys.stdout.isatty() or '--force-colors' in self.afind_params,
+            )
+            self.watch_session.start()
+
+        self.result_cache = self._get_result_cache()
+        results_stream = None
+
+        if self.result_cache:
+            cache_key = self._get_cache_key()
+            results_stream = self.result_cache.get(cache_key)
+
+        if results_stream is None:
+            results_stream = self._get_results_stream()
+            # search stopped by deadline has only a part of results
+            if self.result_cache and '--deadline' not in self.afind_params:
+                results_stream = self.result_cache.record(cache_key, results_stream)
+
+        self.patterns_tagger = None
+        if self.patterns is not None:
+            from afind.utils.patterns_file import PatternsTagger
+            ignore_case = SearchOptions(self.parser_params).ignore_case
+            self.patterns_tagger = PatternsTagger(results_stream, self.patterns, ignore_case=ignore_case)
+            results_stream = self.patterns_tagger
+
+        self.results_limiter = None
+        if any(param in self.afind_params for param in self.LIMIT_PARAMS):
+            self.results_limiter = self._get_results_limiter(results_stream)
+            results_stream = self.results_limiter
+
+        results_stream = self.profiler.wrap('parse', results_stream)
+
+        self.replacer = None
+        if '--replace' in self.afind_params:
+            from afind.utils.replacer import Replacer
+            options = SearchOptions(self.parser_params)
+            self.replacer = Replacer(
+                results_stream, options.compile_pattern(), self.afind_params['--replace'][0],
+                is_literal=options.has('--literal'),
+            )
+            results_stream = self.replacer
+
+        if self.watch_session:
+            results_stream = self.watch_session.record(results_stream)
+
+        sink = OutputSink(sys.stdout)
+        formatter = self.profiler.wrap('format', self._get_output_formatter(results_stream, sink))
         self.filenames_collector = FilenamesCollector(formatter)
 
         # Run stream
-        for _ in self.filenames_collector: pass
+        for _ in self.profiler.wrap('collect', self.filenames_collector): pass
+        self.profiler.add('format', bytes_written=sink.bytes_written)
+
+        if self.results_limiter and self.results_limiter.reached_limit:
+            reached_limit = self.results_limiter.reached_limit
+            sys.stderr.write('@afind: results are truncated, {} is reached\n'.format(reached_limit))
+        if self.patterns_tagger and '--patterns-summary' in self.afind_params:
+            sys.stderr.write(self.patterns_tagger.format_summary())
+
+        if self.replacer:
+            with self.profiler.measure('post'):
+                is_replaced = self.replacer.apply(dry_run='--dry-run' in self.afind_params)
+            if not is_replaced:
+                self._report_profile()
+                sys.exit(1)
 
         if '--afind-dbg' in self.afind_params:
-            sys.stdout.write('\n@afind cmd: ' + self.parser.cmd_search + '\n')
+            sys.stdout.write(b'\n@afind cmd: ' + self.parser.cmd_search + b'\n')
+            if self.parser.time_first_result is not None:
+                sys.stdout.write('@afind first result: {:.3f}s\n'.format(self.parser.time_first_result))
+            if self.result_cache:
+                stats = self.result_cache.stats()
+                sys.stdout.write('@afind cache: {} (hits {}, misses {})\n'.format(
+                    self.result_cache.last_status, stats['hits'], stats['misses']))
+
+        with self.profiler.measure('post'):
+            self.actions_post()
+
+        self._report_profile()
+
+        if self.watch_session:
+            self.watch_session.run()
+
+    def _get_patterns_params(self, parser_params):
+        """
+        Return parser params searching all literals of --patterns-file with one regex
+        """
+        from afind.utils.patterns_file import load_patterns, literals_regex
+
+        filename = self.afind_params['--patterns-file'][0]
+        options = SearchOptions(parser_params)
+        if options.has('--literal'):
+            sys.stderr.write('Error: --patterns-file can\'t be used with --literal, patterns are literals anyway\n')
+            sys.exit(1)
+
+        try:
+            self.patterns = load_patterns(filename)
+        except (IOError, OSError, UnicodeDecodeError) as e:
+            error = getattr(e, 'strerror', None) or e
+            sys.stderr.write('Error: Can\'t read patterns file {}: {}\n'.format(filename, error))
+            sys.exit(1)
+
+        if not self.patterns:
+            sys.stderr.write('Error: No patterns in {}\n'.format(filename))
+            sys.exit(1)
+
+        return options.with_pattern(literals_regex(self.patterns))
+
+    def _get_results_limiter(self, results_stream):
+        from afind.utils.results_limiter import ResultsLimiter
+
+        def get_limit(param_name, param_type=int):
+            if param_name not in self.afind_params:
+                return None
+            return self._get_positive_param(param_name, param_type)
+
+        return ResultsLimiter(
+            results_stream, self.parser,
+            max_results=get_limit('--max-results'),
+            max_files=get_limit('--max-files'),
+            deadline=get_limit('--deadline', float),
+        )
+
+    def _report_profile(self):
+        if self.profiler is NULL_PROFILER:
+            return
 
-        self.actions_post()
+        if '--afind-profile-json' in self.afind_params:
+            filename = self.afind_params['--afind-profile-json'][0]
+            try:
+                self.profiler.save_report(filename)
+            except (IOError, OSError) as e:
+                sys.stderr.write('@afind profile: can\'t save {}: {}\n'.format(filename, e.strerror or e))
+
+        if '--afind-profile' in self.afind_params:
+            sys.stderr.write(self.profiler.format_report())
+
+    def _get_results_stream(self):
+        parser_params = self.parser_params
+        if '--use-index' in self.afind_params:
+            parser_params = self._narrow_by_index(parser_params)
+
+        if parser_params is None:
+            return iter([ParseResult.RESULTS_FINISHED])
+        return self.parser.get_results(parser_params, self.afind_params)
+
+    def _get_result_cache(self):
+        if '--no-cache' in self.afind_params:
+            return None
+        if ('--cache' in self.afind_params) or os.environ.get('AFIND_CACHE') == '1':
+            from afind.utils.result_cache import ResultCache
+            return ResultCache()
+        return None
+
+    def _get_cache_key(self):
+        """
+        Key of search: normalized params and fingerprint of searched tree
+        """
+        from afind.utils.result_cache import ResultCache
+
+        options = SearchOptions(self.parser_params)
+        afind_params = dict((k, v) for k, v in self.afind_params.items() if k not in self.OUTPUT_PARAMS)
+
+        if '--use-index' in afind_params:
+            from afind.utils.trigram_index import TrigramIndex, INDEX_DIR_NAME
+            fingerprint = TrigramIndex(INDEX_DIR_NAME).generation
+        elif '--rev' in afind_params:
+            fingerprint = self.parser.resolve_revs(afind_params['--rev'])
+        else:
+            hidden = options.has('--hidden') or options.has('--unrestricted')
+            fingerprint = ResultCache.tree_fingerprint(options.paths, hidden)
 
-    def _run_patch_apply(self):
-        cmd = 'patch --unified --strip=1 --force --input ' + self.afind_params['--apply-patch'][0]
-        os.system(cmd)
+        return ResultCache.make_key(
+            os.getcwd(), self.parser.__class__.__name__,
+            sorted(options.options), options.pattern, sorted(options.paths),
+            afind_params, fingerprint,
+        )
 
-    def _get_output_formatter(self, results_stream):
-        if '--make-patch' in self.afind_params:
-            return PatchFormatter(results_stream)
+    def _run_patch_apply(self):
+        from afind.utils.patch_applier import PatchApplier
+        applier = PatchApplier(strip=1)
+        success = applier.apply(self.afind_params['--apply-patch'][0], dry_run='--dry-run' in self.afind_params)
+        if not success:
+            sys.exit(1)
+
+    def _run_index_build(self):
+        from afind.utils.trigram_index import TrigramIndex, INDEX_DIR_NAME
+        index = TrigramIndex(INDEX_DIR_NAME)
+        files_count, trigrams_count = index.build(*self._walk_index_files())
+        sys.stdout.write('@afind index: {} files, {} trigrams\n'.format(files_count, trigrams_count))
+
+    def _run_index_update(self):
+        from afind.utils.trigram_index import TrigramIndex, INDEX_DIR_NAME
+        index = TrigramIndex(INDEX_DIR_NAME)
+        added, changed, deleted = index.update(*self._walk_index_files())
+        sys.stdout.write('@afind index: {} added, {} changed, {} deleted\n'.format(added, changed, deleted))
+
+    def _walk_index_files(self):
+        """
+        Return (files, directories, walk options) of current directory for index
+        """
+        from afind.utils.files_walker import TreeWalker
+        from afind.utils.trigram_index import INDEX_DIR_NAME
+
+        options = SearchOptions(self.parser_params)
+        include_rx, excluder = self._get_path_filters(options)
+        walker = TreeWalker.from_options(options, include_rx, excluder, paths=[], keep_dirs=True)
+
+        # with --hidden index would see its own files changing
+        index_dir = INDEX_DIR_NAME.encode('utf-8')
+        files = [path for path in walker if not path.startswith(index_dir + b'/')]
+        dirs = [walker.display(path) for path in walker.dirs]
+        dirs = [path for path in dirs if path != index_dir and not path.startswith(index_dir + b'/')]
+        return files, dirs, self._get_index_walk_options(options)
+
+    def _get_index_walk_options(self, options):
+        """
+        Options which decide what files are walked, index can serve searches of the same files or fewer
+        """
+        from afind.utils.files_walker import TreeWalker
+        walker = TreeWalker.from_options(options)
+        return {
+            'hidden': walker.hidden,
+            'ignore_files': [name.decode('utf-8') for name in walker.ignore_files],
+            'include': options.get('--file-search-regex'),
+            'exclude': self.afind_params.get('-nG', []),
+        }
+
+    def _is_index_usable(self, index_walk, walk):
+        if index_walk is None:
+            return False
+        return (
+            index_walk['hidden'] == walk['hidden'] and index_walk['ignore_files'] == walk['ignore_files'] and
+            index_walk['include'] in (None, walk['include']) and set(index_walk['exclude']) <= set(walk['exclude'])
+        )
+
+    def _get_path_filters(self, options):
+        """
+        Return compiled regex of -G and PathExcluder of -nG params
+        """
+        include_rx = options.get('--file-search-regex')
+        include_rx = re.compile(include_rx.encode('utf-8')) if include_rx else None
+        return include_rx, self._get_path_excluder()
+
+    def _get_path_excluder(self):
+        if '-nG' not in self.afind_params:
+            return None
+
+        from afind.utils.path_excluder import PathExcluder
+        try:
+            return PathExcluder.from_params(self.afind_params)
+        except re.error as e:
+            sys.stderr.write('Error: Wrong -nG pattern: {}\n'.format(e))
+            sys.exit(1)
+
+    def _narrow_by_index(self, parser_params):
+        """
+        Return parser params with search limited to files which can match according to index,
+        None if there are no such files. Search isn't narrowed if index doesn't cover its files
+        as they are now: paths outside of current directory, other walk options, changed tree
+        """
+        from afind.utils.files_walker import filter_paths
+        from afind.utils.trigram_index import open_index, required_literals
+
+        index = open_index()
+        if not index.exists():
+            sys.stderr.write('@afind index: not found, run with --index-build first\n')
+            return parser_params
+
+        options = SearchOptions(parser_params)
+        if options.pattern is None:
+            return parser_params
+
+        # inverted searches report files and lines without the pattern, they can't be skipped
+        if options.has(*self.INVERTING_OPTIONS):
+            return parser_params
+
+        literals = required_literals(options.pattern.encode('utf-8'), options.has('--literal'))
+        if literals is None:
+            return parser_params
+
+        # paths of index are relative to current directory, search paths are given as user typed them
+        roots = [(root.encode('utf-8'), os.path.normpath(os.path.relpath(root.encode('utf-8'))))
+                 for root in options.paths]
+        if any(rel_root == b'..' or rel_root.startswith(b'../') for _, rel_root in roots):
+            sys.stderr.write('@afind index: search paths are outside of indexed directory, searching without index\n')
+            return parser_params
+
+        if not self._is_index_usable(index.walk_options, self._get_index_walk_options(options)):
+            sys.stderr.write('@afind index: it was built with other --hidden, -u, -U, -G or -nG options, '
+                             'searching without index\n')
+            return parser_params
+
+        rel_roots = [rel_root for _, rel_root in roots]
+        changed_path = index.find_changed(rel_roots)
+        if changed_path is not None:
+            sys.stderr.write(b'@afind index: ' + changed_path + b' changed since index was built, '
+                             b'searching without index (run --index-update)\n')
+            return parser_params
+
+        include_rx, excluder = self._get_path_filters(options)
+        paths = filter_paths(index.candidates(literals), rel_roots, include_rx, excluder)
+
+        if not paths:
+            return None
+        if len(paths) > self.INDEX_MAX_CANDIDATES:
+            return parser_params
+        if roots:
+            paths = [self._path_under_root(path, roots) for path in paths]
+        return options.with_paths(paths)
+
+    def _path_under_root(self, path, roots):
+        """
+        Return path of index the way backend shows it for search path which contains it
+        """
+        for root, rel_root in roots:
+            if rel_root == b'.':
+                return os.path.join(root, path)
+            if path == rel_root:
+                return root
+            if path.startswith(rel_root + b'/'):
+                return os.path.join(root, path[len(rel_root) + 1:])
+        return path
+
+    def _get_output_formatter(self, results_stream, sink=None):
+        if self.replacer and ('--make-patch' in self.afind_params or '--replace-diff' in self.afind_params):
+            return PatchFormatter(results_stream, line_transform=self.replacer.preview_line, sink=sink)
+        elif '--make-patch' in self.afind_params:
+            return PatchFormatter(results_stream, sink=sink)
+        elif '--json' in self.afind_params:
+            from afind.utils.json_formatter import JsonFormatter
+            return JsonFormatter(results_stream, sink=sink)
         elif sys.stdout.isatty() or ('--force-colors' in self.afind_params):
-            return TtyFormatter(results_stream)
+            return TtyFormatter(results_stream, sink=sink)
         else:
-            return PipeFormatter(results_stream)
+            return PipeFormatter(results_stream, sink=sink)
 
     def split_argv(self):
         all_args = sys.argv[1:]
@@ -87,6 +531,8 @@ class Application(object):
 
         parser_params = []
         afind_params = {}
+        # repeatable params collect arguments of every occurrence
+        occurrences = {}
 
         while all_args:
             param_name = all_args.pop(0).decode('utf-8')
@@ -94,7 +540,11 @@ class Application(object):
             if param_name in self.custom_params:
                 afind_curr_param = param_name
                 afind_args_count = self.custom_params[param_name]['args_count']
-                afind_params[afind_curr_param] = []
+                if self.custom_params[param_name].get('is_repeatable') and param_name in afind_params:
+                    occurrences[param_name] += 1
+                else:
+                    afind_params[afind_curr_param] = []
+                    occurrences[param_name] = 1
 
             elif afind_args_count:
                 afind_params[afind_curr_param].append(param_name)
@@ -106,13 +556,31 @@ class Application(object):
         for param_name in afind_params:
             args_count = self.custom_params[param_name]['args_count']
 
-            if len(afind_params[param_name]) < args_count:
+            if len(afind_params[param_name]) < args_count * occurrences[param_name]:
                 err = b"Error: Parameter {} requires {} following arguments\n".format(param_name, args_count)
                 sys.stderr.write(err)
                 sys.exit(1)
 
         return parser_params, afind_params
 
+    def _get_int_param(self, param_name):
+        return self._get_number_param(param_name, int)
+
+    def _get_positive_param(self, param_name, param_type=int):
+        value = self._get_number_param(param_name, param_type)
+        if value <= 0:
+            sys.stderr.write(b"Error: Parameter {} requires positive argument\n".format(param_name))
+            sys.exit(1)
+        return value
+
+    def _get_number_param(self, param_name, param_type):
+        try:
+            return param_type(self.afind_params[param_name][0])
+        except ValueError:
+            sys.stderr.write(b"Error: Parameter {} requires {} argument\n".format(
+                param_name, 'integer' if param_type is int else 'numeric'))
+            sys.exit(1)
+
     def add_afind_usage(self):
         usage = ''
         for param in self.custom_params:
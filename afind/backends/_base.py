@@ -1,29 +1,128 @@
 from __future__ import unicode_literals, print_function
+import os
 import sys
+import time
+import errno
+import signal
+from threading import Thread
 from subprocess import Popen, PIPE
 from collections import OrderedDict
+from afind.utils.shell_quote import quote
+from afind.utils.profiler import NULL_PROFILER
 
 
 class ParseResult(object):
+    '''
+    Event of results stream, kind tells what it is.
+    filename, line_text and line_num are bytes exactly as backend reported them,
+    decoded_* properties give text for consumers which need it.
+    Events without data are shared: FILE_FINISHED, GROUP_DELIMITER, RESULTS_FINISHED.
+    Columns of matches can be given as backend reported them, eg: b'4 23,30 5',
+    they are parsed only when line_cols is read.
+    pattern_ids are set for search of --patterns-file: id of pattern for every column
+    '''
 
-    def __init__(
-        self, filename=None, line_text=None, line_num=None, line_cols=None,
-        is_title=False, is_group_delimiter=False, is_file_finished=False, is_results_finished=False
-    ):
+    __slots__ = ('kind', 'filename', 'line_text', 'line_num', '_line_cols', '_raw_cols', 'pattern_ids')
+
+    KIND_LINE             = 0
+    KIND_TITLE            = 1
+    KIND_GROUP_DELIMITER  = 2
+    KIND_FILE_FINISHED    = 3
+    KIND_RESULTS_FINISHED = 4
+
+    def __init__(self, kind, filename=None, line_text=None, line_num=None, line_cols=None, raw_cols=None):
+        self.kind = kind
         self.filename = filename
         self.line_text = line_text
         self.line_num = line_num
-        self.line_cols = line_cols
-        self.is_title = is_title
-        self.is_group_delimiter = is_group_delimiter
-        self.is_file_finished = is_file_finished
-        self.is_results_finished = is_results_finished
+        self._line_cols = line_cols
+        self._raw_cols = raw_cols
+        self.pattern_ids = None
+
+    @property
+    def line_cols(self):
+        if self._line_cols is None and self._raw_cols is not None:
+            self._line_cols = [
+                (int(start), int(length))
+                for start, length in (col.split(b' ') for col in self._raw_cols.split(b','))
+            ]
+        return self._line_cols
+
+    @property
+    def is_match(self):
+        """
+        Line with matches, unlike context line. Columns aren't parsed for it
+        """
+        return self.kind == ParseResult.KIND_LINE and bool(self._raw_cols or self._line_cols)
+
+    @property
+    def is_title(self):
+        return self.kind == ParseResult.KIND_TITLE
+
+    @property
+    def is_group_delimiter(self):
+        return self.kind == ParseResult.KIND_GROUP_DELIMITER
+
+    @property
+    def is_file_finished(self):
+        return self.kind == ParseResult.KIND_FILE_FINISHED
+
+    @property
+    def is_results_finished(self):
+        return self.kind == ParseResult.KIND_RESULTS_FINISHED
+
+    @property
+    def decoded_filename(self):
+        return self.filename.decode('utf-8', 'replace') if self.filename is not None else None
+
+    @property
+    def decoded_line_text(self):
+        return self.line_text.decode('utf-8', 'replace') if self.line_text is not None else None
+
+ParseResult.FILE_FINISHED    = ParseResult(ParseResult.KIND_FILE_FINISHED)
+ParseResult.GROUP_DELIMITER  = ParseResult(ParseResult.KIND_GROUP_DELIMITER)
+ParseResult.RESULTS_FINISHED = ParseResult(ParseResult.KIND_RESULTS_FINISHED)
+
+
+# process groups of running backends, every backend is leader of own group
+_running_groups = set()
+
+
+def _kill_group(pgid):
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+
+
+def kill_running_backends():
+    """
+    Kill all backend processes started by this process, they aren't in its process group
+    """
+    for pgid in list(_running_groups):
+        _kill_group(pgid)
 
 
 class ParserBase(object):
     cmd_search = ''
     cmd_usage  = ''
 
+    # size of one read from backend stdout
+    READ_CHUNK_SIZE = 64 * 1024
+
+    # seconds from backend spawn till first line of output, None if there was no output
+    time_first_result = None
+
+    # collects time and counters of stages, measures nothing unless application sets real one
+    profiler = NULL_PROFILER
+
+    # set by terminate(), results stream ends as soon as possible after it
+    is_terminated = False
+
+    # running backend process
+    _proc = None
+
     # params with amount of following arguments
     CUSTOM_PARAMS = OrderedDict()
 
@@ -36,6 +135,16 @@ class ParserBase(object):
     def actions_post(self, afind_params):
         pass
 
+    def terminate(self):
+        """
+        Stop search, can be called from other thread: backend with all its children is killed,
+        so results stream gets end of output
+        """
+        self.is_terminated = True
+        proc = self._proc
+        if proc is not None and proc.returncode is None:
+            _kill_group(proc.pid)
+
     def print_usage(self):
         out, err = Popen(self.cmd_usage, stdout=PIPE, stderr=PIPE, shell=True).communicate()
         sys.stdout.write(out)
@@ -45,24 +154,98 @@ class ParserBase(object):
         return True
 
     def _get_cmd_output(self, command):
-        proc = Popen(command, stdout=PIPE, stderr=PIPE, shell=True)
-        out, err = proc.communicate()
+        """
+        Run command and yield lines of its stdout as bytes as soon as they arrive
+        """
+        for chunk in self._get_cmd_chunks(command):
+            lines = chunk.split(b'\n')
+            if not lines[-1]:
+                lines.pop()
+            for line in lines:
+                yield line
 
-        if err:
-            sys.stderr.write(err)
-            raise StopIteration
+    def _get_cmd_chunks(self, command):
+        """
+        Run command and yield its stdout as soon as it arrives, in chunks of whole lines ending with newline.
+        Only the last chunk may end without newline, if output does.
+        Stderr is drained by separate thread, so process can't block on full pipe.
+        Backend is started in own session, so shell and everything it runs can be killed at once
+        when results stream is closed before the end of output
+        """
+        time_started = time.time()
+        self.time_first_result = None
+        if self.is_terminated:
+            return
+
+        with self.profiler.measure('spawn'):
+            proc = Popen(command, stdout=PIPE, stderr=PIPE, shell=True, bufsize=0, preexec_fn=os.setsid)
+        self.profiler.add('spawn', events=1)
+        self._proc = proc
+        _running_groups.add(proc.pid)
 
-        for line in out.splitlines():
-            try:
-                yield line.decode('utf-8')
-            except UnicodeDecodeError as e:
-                sys.stderr.write(b'@afind decode-error: ' + line + b'\n')
+        stderr_drain = Thread(target=self._drain_stderr, args=(proc.stderr,))
+        stderr_drain.daemon = True
+        stderr_drain.start()
+
+        is_output_finished = False
+        try:
+            for chunk in self.profiler.wrap('read', self._read_chunks(proc.stdout)):
+                if self.time_first_result is None:
+                    self.time_first_result = time.time() - time_started
+                    self.profiler.add('first_byte', wall=self.time_first_result, events=1)
+                self.profiler.add('read', bytes_read=len(chunk))
+                yield chunk
+            is_output_finished = True
+        finally:
+            proc.stdout.close()
+            if not is_output_finished:
+                _kill_group(proc.pid)
+            proc.wait()
+            _running_groups.discard(proc.pid)
+            stderr_drain.join()
+
+    def _read_chunks(self, stream):
+        fd = stream.fileno()
+        tail = b''
+
+        while True:
+            chunk = os.read(fd, self.READ_CHUNK_SIZE)
+            if not chunk:
+                break
+
+            end = chunk.rfind(b'\n') + 1
+            if not end:
+                tail += chunk
                 continue
 
+            yield tail + chunk[:end]
+            tail = chunk[end:]
+
+        # output of killed backend can end in the middle of line
+        if tail and not self.is_terminated:
+            yield tail
+
+    def _drain_stderr(self, stream):
+        for line in iter(stream.readline, b''):
+            sys.stderr.write(line)
+        stream.close()
+
+    def _get_search_roots(self, options, excluder):
+        """
+        Return (paths, is_complete): search paths of options where directories with excluded prefixes
+        of -nG inside are replaced by their entries, None if every path is excluded.
+        is_complete is False if prefixes still have to be filtered out of results
+        """
+        paths = [path if isinstance(path, bytes) else path.encode('utf-8') for path in options.paths]
+        roots, is_complete = excluder.split_roots(paths, hidden=options.has('--hidden'))
+        if not roots:
+            return None, True
+        if roots == (paths or [b'.']):
+            return options.paths, is_complete
+        return roots, is_complete
+
     def _join_args(self, arguments):
-        cmd = ''
-        for arg in arguments:
-            if ' ' in arg:
-                arg = "'{}'".format(arg)
-            cmd += ' ' + arg
-        return cmd
+        """
+        Return arguments quoted for shell as bytes, paths given as bytes are kept even if they aren't utf-8
+        """
+        return b''.join(b' ' + quote(arg if isinstance(arg, bytes) else arg.encode('utf-8')) for arg in arguments)
@@ -3,6 +3,7 @@ import re
 import sys
 from collections import OrderedDict
 from afind.backends._base import ParserBase, ParseResult 
+from afind.utils.search_options import SearchOptions
 from afind.utils.term_colors import TermColors
 from afind.utils.result_formatters import FormatterBase
 
@@ -12,65 +13,109 @@ class AgParser(ParserBase):
 
     # params specefic for ag utility
     CUSTOM_PARAMS = OrderedDict([
-        ('-nG',    {'args_count': 1, 'description': 'PATTERN Limit search to filenames NOT matching PATTERN'}),
+        ('-nG',    {'args_count': 1, 'is_repeatable': True,
+                    'description': 'PATTERN Skip paths matching regex, re:REGEX or glob:GLOB, can be repeated'}),
     ])
 
-    # 160:                 line_data - before/after lines
-    # 160;17 7:            line_data - with one match in line
-    # 175;10 8,23 8:       line_data - with several matches in one line
-    MATCH_STR_RE = re.compile(r'^(\d+)(?:;(\d+[ ]\d+(?:,\d+[ ]\d+)*))?:(.*)$')
+    # one line of --ackmate output, groups are set by its type:
+    # :filename                            - title: (filename)
+    # 160:line_data                        - context line: (line number, None, line data)
+    # 160;17 7:line_data                   - line with one match: (line number, columns, line data)
+    # 175;10 8,23 8:line_data              - line with several matches
+    # --                                   - group delimiter: (delimiter)
+    # empty line                           - file content finished, all groups are None
+    # anything else                        - (unparsed line)
+    ACKMATE_LINE_RE = re.compile(
+        br'^(?:'
+        br':(.*)|'
+        br'(\d+)(?:;(\d+[ ]\d+(?:,\d+[ ]\d+)*))?:(.*)|'
+        br'[ \t]*(--)[ \t]*|'
+        br'(.+)|'
+        br')$',
+        re.MULTILINE,
+    )
 
     def get_results(self, parser_params, afind_params):
         self.run_params = ['ag', '--ackmate'] + parser_params
         self.actions_pre(afind_params)
+
+        if self.run_params is None:
+            self.cmd_search = 'ag: every search path is excluded'
+            yield ParseResult.RESULTS_FINISHED
+            return
+
         self.cmd_search = self._join_args(self.run_params)
+        current_filename = b''
 
-        current_filename = ''
+        for chunk in self._get_cmd_chunks(self.cmd_search):
+            # newline of the last line would make one more empty line for regex
+            if chunk.endswith(b'\n'):
+                chunk = chunk[:-1]
 
-        for line in self._get_cmd_output(self.cmd_search):
-            # file content finished
-            if not line:
-                current_filename = ''
-                yield ParseResult(is_file_finished=True)
+            for parsed in self.ACKMATE_LINE_RE.finditer(chunk):
+                title, line_num, line_cols, line_text, delimiter, unparsed = parsed.groups()
 
-            # is filename
-            elif line.startswith(':'):
-                current_filename = line[1:]
-                yield ParseResult(filename=current_filename, is_title=True)
+                # file content
+                if line_num is not None:
+                    if line_cols is None:
+                        yield ParseResult(ParseResult.KIND_LINE, current_filename, line_text, line_num, [])
+                    else:
+                        yield ParseResult(ParseResult.KIND_LINE, current_filename, line_text, line_num, None, line_cols)
 
-            # is group delimiter
-            elif line.strip() == '--':
-                yield ParseResult(is_group_delimiter=True)
+                # is filename
+                elif title is not None:
+                    current_filename = title
+                    yield ParseResult(ParseResult.KIND_TITLE, current_filename)
 
-            # file content
-            else:
-                parsed = self.MATCH_STR_RE.match(line)
+                # is group delimiter
+                elif delimiter is not None:
+                    yield ParseResult.GROUP_DELIMITER
 
-                if not parsed:
-                    sys.stderr.write('@afind parse-error: ' + line + '\n')
-                    continue
+                elif unparsed is not None:
+                    sys.stderr.write(b'@afind parse-error: ' + unparsed + b'\n')
+                    self.profiler.add('parse', errors=1)
 
-                line_num, line_cols, line_text = parsed.groups()
-                if line_cols:
-                    line_cols = [map(int, c.split(' ')) for c in line_cols.split(',')]
+                # file content finished
                 else:
-                    line_cols = []
-
-                yield ParseResult(
-                    filename=current_filename,
-                    line_text=line_text,
-                    line_num=line_num,
-                    line_cols=line_cols,
-                )
+                    current_filename = b''
+                    yield ParseResult.FILE_FINISHED
 
-        yield ParseResult(is_results_finished=True)
+        yield ParseResult.RESULTS_FINISHED
 
         self.actions_post(afind_params)
 
     def actions_pre(self, afind_params):
-        nG = afind_params.get('-nG', None)
-        if nG:
-            self.run_params += ['-G', self._rxno(nG[0])]
+        """
+        Apply -nG: ag skips names of glob rules by itself and doesn't enter directories matched by them,
+        search roots are split around excluded prefixes, the rest of rules goes to -G as negative regex.
+        run_params are None if nothing is left to search
+        """
+        if '-nG' not in afind_params:
+            return
+
+        from afind.utils.path_excluder import PathExcluder
+        excluder = PathExcluder.from_params(afind_params)
+        parser_params = self.run_params[2:]
+        options = SearchOptions(parser_params)
+
+        exclude_params = []
+        for name in excluder.glob_names:
+            exclude_params += ['--ignore', name]
+
+        is_complete = False
+        if options.pattern is not None:
+            paths, is_complete = self._get_search_roots(options, excluder)
+            if paths is None:
+                self.run_params = None
+                return
+            if paths is not options.paths:
+                parser_params = options.with_paths(paths)
+
+        rx = excluder.get_regex(with_glob_names=False, with_prefixes=not is_complete)
+        if rx:
+            exclude_params += ['-G', self._rxno(rx.decode('utf-8'))]
+
+        self.run_params = ['ag', '--ackmate'] + exclude_params + parser_params
 
     def actions_post(self, afind_params):
         pass
@@ -80,7 +125,7 @@ class AgParser(ParserBase):
         Return regexp means that line does't containt patterns
         """
         patterns = r'|'.join(patterns)
-        patterns = r"'^((?!" + patterns + r").)*$'"
+        patterns = r"^((?!" + patterns + r").)*$"
         return patterns
 
 BackendParser = AgParser
@@ -98,30 +143,37 @@ class AgFormatter(FormatterBase):
 
     def __iter__(self):
         c = self._colors
+        out = self._sink
 
         for res in self._results_stream:
             if res.is_file_finished:
-                sys.stdout.write(b'\n')
+                out.write(b'\n')
+                out.end_file()
 
             elif res.is_title:
-                sys.stdout.write(c.FILENAME + res.filename.encode('utf-8') + c.RESET + b'\n')
+                out.write(c.FILENAME, res.filename, c.RESET, b'\n')
 
             elif res.is_group_delimiter:
-                sys.stdout.write(b'--\n')
+                out.write(b'--\n')
+
+            elif res.is_results_finished:
+                out.flush()
 
             elif res.line_text is not None:
-                suffix = b':' if res.line_cols else b'-'
-                sys.stdout.write(c.LINENUM + res.line_num.encode('utf-8') + suffix + c.RESET)
+                suffix = b':' if res.is_match else b'-'
+                out.write(c.LINENUM, res.line_num, suffix, c.RESET)
 
-                line_text = res.line_text.encode('utf-8')
+                line_text = res.line_text
                 cursor = 0
                 for start, length in res.line_cols:
                     end = start + length
-                    sys.stdout.write(line_text[cursor:start])
-                    sys.stdout.write(c.MATCH + line_text[start:end] + c.RESET)
+                    out.write(line_text[cursor:start], c.MATCH, line_text[start:end], c.RESET)
                     cursor = end
-                sys.stdout.write(line_text[cursor:] + b'\n')
+                out.write(line_text[cursor:], b'\n')
+                out.end_line()
 
             yield res
 
+        out.flush()
+
 BackendFormatter = AgFormatter
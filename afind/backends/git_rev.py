@@ -0,0 +1,310 @@
+from __future__ import unicode_literals, print_function
+import os
+import re
+import sys
+import marshal
+import hashlib
+from threading import Thread
+from subprocess import Popen, PIPE
+from collections import OrderedDict
+from afind.backends._base import ParserBase, ParseResult, _running_groups, _kill_group
+from afind.backends.native import NativeParser, search_buffer, GROUP_DELIMITER
+from afind.utils.files_walker import BINARY_CHECK_SIZE
+from afind.utils.search_options import SearchOptions
+
+
+# mode of symlinks and submodules in git trees, they have no text to search
+SYMLINK_MODE   = b'120000'
+SUBMODULE_MODE = b'160000'
+
+
+class BlobResultsCache(object):
+    '''
+    Search records of blobs by SHA, one file per search (pattern, options and context).
+    Blobs are immutable, so records never get outdated: files unchanged between revisions
+    and between runs aren't read and searched again. File mtime is time of last use, which drives LRU eviction
+    '''
+
+    DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'afind', 'blobs')
+
+    # above it, only blobs used by the last search are kept
+    MAX_BLOBS = 200000
+
+    # total size of files, least recently used searches are removed above it
+    MAX_SIZE = 256 * 1024 * 1024
+
+    # bumped when layout of stored records changes, so older files are never read
+    RECORDS_VERSION = 1
+
+    def __init__(self, search_key, cache_dir=None):
+        cache_dir = cache_dir or os.environ.get('AFIND_CACHE_DIR')
+        self.cache_dir = os.path.join(cache_dir, 'blobs') if cache_dir else self.DEFAULT_DIR
+        key = hashlib.sha1(repr((self.RECORDS_VERSION, search_key)).encode('utf-8')).hexdigest()
+        self.path = os.path.join(self.cache_dir, key)
+
+        try:
+            with open(self.path, 'rb') as f:
+                self._records = marshal.load(f)
+            # mark search as recently used
+            os.utime(self.path, None)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            self._records = {}
+
+        self._used = set()
+        self._is_changed = False
+
+    def get(self, sha):
+        records = self._records.get(sha)
+        if records is not None:
+            self._used.add(sha)
+        return records
+
+    def set(self, sha, records):
+        self._records[sha] = records
+        self._used.add(sha)
+        self._is_changed = True
+
+    def save(self):
+        if not self._is_changed:
+            return
+
+        records = self._records
+        if len(records) > self.MAX_BLOBS:
+            records = dict((sha, records[sha]) for sha in self._used)
+
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                marshal.dump(records, f)
+            os.rename(tmp_path, self.path)
+
+            self._evict()
+        except (IOError, OSError):
+            pass
+
+    def _evict(self):
+        """
+        Remove least recently used files of other searches while total size is above MAX_SIZE
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp') or path == self.path:
+                continue
+            st = os.stat(path)
+            entries.append((st.st_mtime, st.st_size, path))
+
+        total_size = os.path.getsize(self.path) + sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.MAX_SIZE:
+                break
+            os.remove(path)
+            total_size -= size
+
+
+class GitRevParser(ParserBase):
+    '''
+    Searches files of git revision without checking it out: tree is listed by git ls-tree,
+    contents of blobs are read through one git cat-file --batch process and searched in memory.
+    Filenames are prefixed by revision like in git grep: REV:path
+    '''
+
+    CUSTOM_PARAMS = OrderedDict([
+        ('-nG',    {'args_count': 1, 'is_repeatable': True,
+                    'description': 'PATTERN Skip paths matching regex, re:REGEX or glob:GLOB, can be repeated'}),
+    ])
+
+    SUPPORTED_OPTIONS = OrderedDict(
+        (name, description) for name, description in NativeParser.SUPPORTED_OPTIONS.items()
+        if name not in ('--skip-vcs-ignores', '--unrestricted')
+    )
+
+    # "<sha> <type> <size>" or "<object> missing" line of git cat-file --batch
+    BATCH_HEADER_RE = re.compile(br'^(\S+) (?:(\S+) (\d+)|missing)$')
+
+    def get_results(self, parser_params, afind_params):
+        options = SearchOptions(parser_params)
+        revs = afind_params['--rev']
+        self.cmd_search = b'git-rev' + self._join_args(revs) + self._join_args(parser_params)
+
+        unsupported = [name for name, _ in options.options if name not in self.SUPPORTED_OPTIONS]
+        if unsupported or options.pattern is None:
+            msg = 'unrecognized option: ' + unsupported[0] if unsupported else 'search pattern is required'
+            sys.stderr.write('@afind git-rev: ' + msg + '\n')
+            yield ParseResult.RESULTS_FINISHED
+            return
+
+        rx = options.compile_pattern()
+        before, after = options.context_before, options.context_after
+
+        file_rx = options.get('--file-search-regex')
+        file_rx = re.compile(file_rx.encode('utf-8')) if file_rx else None
+        excluder = None
+        if '-nG' in afind_params:
+            from afind.utils.path_excluder import PathExcluder
+            excluder = PathExcluder.from_params(afind_params)
+
+        entries = []
+        for rev in revs:
+            prefix = rev.encode('utf-8') + b':'
+            for sha, path in self._list_tree(rev, options.paths):
+                if not self._accept_path(path, file_rx, excluder, options.has('--hidden')):
+                    continue
+                entries.append((prefix + path, sha))
+
+        cache = BlobResultsCache((rx.pattern, rx.flags, before, after))
+
+        # like ag, files are separated with empty line, there is no one after the last file
+        is_first_file = True
+
+        try:
+            for filename, records in self._search_blobs(entries, cache, rx, before, after):
+                if self.is_terminated:
+                    break
+                if not records:
+                    continue
+
+                if not is_first_file:
+                    yield ParseResult.FILE_FINISHED
+                is_first_file = False
+
+                yield ParseResult(ParseResult.KIND_TITLE, filename)
+
+                for record in records:
+                    if record is GROUP_DELIMITER:
+                        yield ParseResult.GROUP_DELIMITER
+                        continue
+
+                    line_num, line_text, line_cols = record
+                    yield ParseResult(
+                        ParseResult.KIND_LINE,
+                        filename=filename,
+                        line_text=line_text,
+                        line_num=b'%d' % line_num,
+                        line_cols=line_cols,
+                    )
+        finally:
+            # records of blobs are complete even if search is stopped
+            cache.save()
+
+        yield ParseResult.RESULTS_FINISHED
+
+    def _accept_path(self, path, file_rx, excluder, hidden):
+        if not hidden and (path.startswith(b'.') or b'/.' in path):
+            return False
+        if file_rx and not file_rx.search(path):
+            return False
+        if excluder and excluder.is_excluded(path):
+            return False
+        return True
+
+    def _list_tree(self, rev, paths):
+        """
+        Return [(blob sha, path)] of files of revision in paths, paths are relative to current directory
+        """
+        command = b'git ls-tree -r -z' + self._join_args([rev, '--'] + list(paths))
+        output = b''.join(self._get_cmd_chunks(command))
+
+        entries = []
+        for entry in output.split(b'\0'):
+            if not entry:
+                continue
+            info, _, path = entry.partition(b'\t')
+            mode, kind, sha = info.split(b' ')
+            if kind != b'blob' or mode in (SYMLINK_MODE, SUBMODULE_MODE):
+                continue
+            entries.append((sha, path))
+        return entries
+
+    def _search_blobs(self, entries, cache, rx, before, after):
+        """
+        Yield (filename, records) in order of entries, blobs without cached records are read
+        through one git cat-file --batch process: requests are written by separate thread,
+        so git can't block on full stdout while this one waits to write
+        """
+        missing, missing_set = [], set()
+        for _, sha in entries:
+            if cache.get(sha) is None and sha not in missing_set:
+                missing.append(sha)
+                missing_set.add(sha)
+        self.profiler.add('read', events=len(entries) - len(missing))
+
+        proc = None
+        if missing:
+            with self.profiler.measure('spawn'):
+                proc = Popen(['git', 'cat-file', '--batch'], stdin=PIPE, stdout=PIPE, preexec_fn=os.setsid)
+            self.profiler.add('spawn', events=1)
+            self._proc = proc
+            _running_groups.add(proc.pid)
+
+            writer = Thread(target=self._write_requests, args=(proc.stdin, missing))
+            writer.daemon = True
+            writer.start()
+
+        is_output_finished = False
+        try:
+            for filename, sha in entries:
+                records = cache.get(sha)
+                if records is None:
+                    records = self._read_blob_records(proc.stdout, sha, rx, before, after)
+                    if records is None:
+                        break
+                    cache.set(sha, records)
+                yield filename, records
+            is_output_finished = True
+        finally:
+            if proc is not None:
+                if not is_output_finished or self.is_terminated:
+                    _kill_group(proc.pid)
+                proc.stdout.close()
+                proc.wait()
+                _running_groups.discard(proc.pid)
+
+    def _write_requests(self, stream, shas):
+        try:
+            for sha in shas:
+                stream.write(sha + b'\n')
+            stream.close()
+        except (IOError, OSError, ValueError):
+            # git is killed when search is stopped
+            pass
+
+    def _read_blob_records(self, stream, sha, rx, before, after):
+        """
+        Return search records of next blob of cat-file output, empty list for binary blobs,
+        None if output ended
+        """
+        header = stream.readline()
+        parsed = self.BATCH_HEADER_RE.match(header.rstrip(b'\n'))
+        if not parsed:
+            return None
+
+        _, kind, size = parsed.groups()
+        if size is None:
+            sys.stderr.write(b'@afind git-rev: blob ' + sha + b' is missing\n')
+            return []
+
+        data = stream.read(int(size) + 1)[:-1]
+        self.profiler.add('read', bytes_read=len(data), events=1)
+        if kind != b'blob' or b'\0' in data[:BINARY_CHECK_SIZE]:
+            return []
+        return search_buffer(data, rx, before, after)
+
+    def resolve_revs(self, revs):
+        """
+        Return SHAs of trees of revisions, the same content gives the same SHA.
+        Names are returned as they are if some revision is unknown
+        """
+        proc = Popen(['git', 'rev-parse'] + [rev + '^{tree}' for rev in revs],
+                     stdout=PIPE, stderr=PIPE)
+        out, _ = proc.communicate()
+        return out.split() if proc.returncode == 0 else list(revs)
+
+    def print_usage(self):
+        usage = 'Usage: af --rev REV [OPTIONS] PATTERN [PATH]\n\nSearch options (git revision):\n'
+        for description in self.SUPPORTED_OPTIONS.values():
+            usage += '  ' + description + '\n'
+        sys.stdout.write(usage + '\n')
+        return True
@@ -0,0 +1,259 @@
+from __future__ import unicode_literals, print_function
+import os
+import re
+import sys
+import mmap
+from itertools import islice
+from collections import OrderedDict
+from afind.backends._base import ParserBase, ParseResult
+from afind.utils.files_walker import TreeWalker, BINARY_CHECK_SIZE
+from afind.utils.search_options import SearchOptions
+
+
+# marker of non-adjacent groups of lines in search records
+GROUP_DELIMITER = None
+
+
+def search_buffer(data, rx, before=0, after=0):
+    """
+    Search compiled bytes regex in buffer (bytes or mmap)
+    Return records: (line_num, line_text, line_cols) - line_cols are empty for context lines,
+                    GROUP_DELIMITER - between groups of lines which are not adjacent
+    """
+    records = []
+    size = len(data)
+
+    # number of line which starts at offset count_pos
+    count_pos, count_num = 0, 1
+
+    # last emitted line: number and offset of next line start
+    last_num, last_end = 0, 0
+    after_left = 0
+
+    for line_start, line_end, line_cols in _iter_match_lines(data, rx):
+        line_num = count_num + data[count_pos:line_start].count(b'\n')
+        count_pos, count_num = line_start, line_num
+
+        # after-context of previous match
+        while after_left and last_num < line_num - 1:
+            last_end = _add_line(records, data, last_num + 1, last_end, size)
+            last_num += 1
+            after_left -= 1
+
+        # before-context of current match
+        first_num = max(line_num - before, last_num + 1)
+        if last_num and (before or after) and first_num > last_num + 1:
+            records.append(GROUP_DELIMITER)
+
+        if first_num < line_num:
+            pos = line_start
+            for _ in range(line_num - first_num):
+                pos = data.rfind(b'\n', 0, pos - 1) + 1
+            for num in range(first_num, line_num):
+                pos = _add_line(records, data, num, pos, size)
+
+        records.append((line_num, data[line_start:line_end], line_cols))
+        last_num, last_end = line_num, line_end + 1
+        after_left = after
+
+    while after_left and last_end < size:
+        last_end = _add_line(records, data, last_num + 1, last_end, size)
+        last_num += 1
+        after_left -= 1
+
+    return records
+
+
+def _add_line(records, data, line_num, line_start, size):
+    line_end = data.find(b'\n', line_start)
+    if line_end < 0:
+        line_end = size
+    records.append((line_num, data[line_start:line_end], []))
+    return line_end + 1
+
+
+def _iter_match_lines(data, rx):
+    """
+    Yield (line_start, line_end, line_cols) for every line with matches
+    """
+    line_start, line_end, line_cols = -1, -1, []
+
+    for match in rx.finditer(data):
+        start, end = match.span()
+
+        if start > line_end:
+            if line_cols:
+                yield line_start, line_end, line_cols
+
+            line_start = data.rfind(b'\n', 0, start) + 1
+            line_end = data.find(b'\n', start)
+            if line_end < 0:
+                line_end = len(data)
+            line_cols = []
+
+        length = min(end, line_end) - start
+        if length > 0:
+            line_cols.append((start - line_start, length))
+
+    if line_cols:
+        yield line_start, line_end, line_cols
+
+
+def search_file(path, rx, before=0, after=0):
+    """
+    Return search records of file, empty list for empty and binary files
+    """
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return []
+
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if data[:BINARY_CHECK_SIZE].find(b'\0') >= 0:
+                return []
+            return search_buffer(data, rx, before, after)
+        finally:
+            data.close()
+
+
+# Search params of worker process, set by _init_worker
+_worker_params = None
+
+
+def _init_worker(pattern, flags, before, after):
+    global _worker_params
+    _worker_params = (re.compile(pattern, flags), before, after)
+
+
+def _search_worker(path):
+    rx, before, after = _worker_params
+    try:
+        return path, search_file(path, rx, before, after), None
+    except (IOError, OSError, ValueError) as e:
+        return path, [], str(e)
+
+
+class NativeParser(ParserBase):
+    '''
+    Built-in search engine, doesn't require any external utility
+    '''
+
+    # params specefic for native search
+    CUSTOM_PARAMS = OrderedDict([
+        ('-nG',    {'args_count': 1, 'is_repeatable': True,
+                    'description': 'PATTERN Skip paths matching regex, re:REGEX or glob:GLOB, can be repeated'}),
+    ])
+
+    SUPPORTED_OPTIONS = OrderedDict([
+        ('--after',             '-A --after LINES           Print lines after match'),
+        ('--before',            '-B --before LINES          Print lines before match'),
+        ('--context',           '-C --context LINES         Print lines before and after matches'),
+        ('--file-search-regex', '-G --file-search-regex PATTERN Limit search to filenames matching PATTERN'),
+        ('--hidden',            '   --hidden                Search hidden files'),
+        ('--ignore-case',       '-i --ignore-case           Match case insensitively'),
+        ('--case-sensitive',    '-s --case-sensitive        Match case sensitively'),
+        ('--smart-case',        '-S --smart-case            Match case insensitively unless PATTERN has uppercase'),
+        ('--literal',           '-Q --literal               Don\'t parse PATTERN as a regular expression'),
+        ('--skip-vcs-ignores',  '-U --skip-vcs-ignores      Ignore .gitignore files, but obey .ignore and .agignore'),
+        ('--unrestricted',      '-u --unrestricted          Search hidden files and ignore all ignore files'),
+        ('--word-regexp',       '-w --word-regexp           Only match whole words'),
+    ])
+
+    # amount of files searched in-process before process pool is started
+    POOL_THRESHOLD = 64
+    POOL_CHUNK_SIZE = 8
+
+    def __init__(self, workers=None):
+        """
+        :param: workers - processes of pool, cpu_count by default, 1 searches every file in-process
+        """
+        self.workers = workers
+
+    def get_results(self, parser_params, afind_params):
+        options = SearchOptions(parser_params)
+        self.cmd_search = b'native' + self._join_args(parser_params)
+
+        unsupported = [name for name, _ in options.options if name not in self.SUPPORTED_OPTIONS]
+        if unsupported or options.pattern is None:
+            msg = 'unrecognized option: ' + unsupported[0] if unsupported else 'search pattern is required'
+            sys.stderr.write('@afind native: ' + msg + '\n')
+            yield ParseResult.RESULTS_FINISHED
+            return
+
+        rx = options.compile_pattern()
+        before, after = options.context_before, options.context_after
+
+        file_rx = options.get('--file-search-regex')
+        file_rx = re.compile(file_rx.encode('utf-8')) if file_rx else None
+        excluder = None
+        if '-nG' in afind_params:
+            from afind.utils.path_excluder import PathExcluder
+            excluder = PathExcluder.from_params(afind_params)
+
+        files = iter(TreeWalker.from_options(options, file_rx, excluder))
+
+        # like ag, files are separated with empty line, there is no one after the last file
+        is_first_file = True
+
+        for path, records, error in self._search_files(files, rx, before, after):
+            if self.is_terminated:
+                break
+            if error:
+                sys.stderr.write(b'@afind read-error: ' + path + b': ' + error + b'\n')
+                self.profiler.add('read', errors=1)
+            if not records:
+                continue
+
+            if not is_first_file:
+                yield ParseResult.FILE_FINISHED
+            is_first_file = False
+
+            yield ParseResult(ParseResult.KIND_TITLE, path)
+
+            for record in records:
+                if record is GROUP_DELIMITER:
+                    yield ParseResult.GROUP_DELIMITER
+                    continue
+
+                line_num, line_text, line_cols = record
+                yield ParseResult(
+                    ParseResult.KIND_LINE,
+                    filename=path,
+                    line_text=line_text,
+                    line_num=b'%d' % line_num,
+                    line_cols=line_cols,
+                )
+
+        yield ParseResult.RESULTS_FINISHED
+
+    def _search_files(self, files, rx, before, after):
+        """
+        Yield (path, records, error) in order of files.
+        Small searches are done in-process, the rest of files is spread across process pool
+        """
+        worker_params = (rx.pattern, rx.flags, before, after)
+        _init_worker(*worker_params)
+
+        head = files if self.workers == 1 else list(islice(files, self.POOL_THRESHOLD))
+        for path in head:
+            yield _search_worker(path)
+
+        if self.workers == 1 or len(head) < self.POOL_THRESHOLD:
+            return
+
+        # multiprocessing takes a while to import, small searches don't need it
+        from multiprocessing import Pool, cpu_count
+        pool = Pool(self.workers or cpu_count(), initializer=_init_worker, initargs=worker_params)
+        try:
+            for result in pool.imap(_search_worker, files, self.POOL_CHUNK_SIZE):
+                yield result
+            pool.close()
+        finally:
+            pool.terminate()
+
+    def print_usage(self):
+        usage = 'Usage: af [OPTIONS] PATTERN [PATH]\n\nSearch options (native backend):\n'
+        for description in self.SUPPORTED_OPTIONS.values():
+            usage += '  ' + description + '\n'
+        sys.stdout.write(usage + '\n')
+        return True
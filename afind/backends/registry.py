@@ -0,0 +1,96 @@
+from __future__ import unicode_literals, print_function
+import os
+from importlib import import_module
+from collections import OrderedDict
+
+
+# known backends in order of preference, parser module is imported only when backend is used
+BACKENDS = OrderedDict([
+    ('rg',     {'parser': 'afind.backends.rg.RgParser',         'executable': 'rg'}),
+    ('ag',     {'parser': 'afind.backends.ag.AgParser',         'executable': 'ag'}),
+    ('native', {'parser': 'afind.backends.native.NativeParser', 'executable': None}),
+])
+
+# backends chosen by their own param instead of --backend
+PARAM_BACKENDS = OrderedDict([
+    ('--rev', 'afind.backends.git_rev.GitRevParser'),
+])
+
+PROBE_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'afind', 'backend.json')
+
+
+def find_executable(name):
+    for dirname in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(dirname, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def _get_dirs_mtimes(search_path):
+    """
+    Installed and removed executables change mtime of their directory
+    """
+    mtimes = []
+    for dirname in search_path.split(os.pathsep):
+        try:
+            mtimes.append(os.stat(dirname).st_mtime)
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+
+def probe_backend():
+    """
+    Return name of the first installed backend in order of preference: rg, ag, native
+    Result is cached while PATH and mtimes of its directories stay the same
+    """
+    import json
+    search_path = os.environ.get('PATH', '')
+    mtimes = _get_dirs_mtimes(search_path)
+
+    cache_dir = os.environ.get('AFIND_CACHE_DIR')
+    cache_path = os.path.join(cache_dir, 'backend.json') if cache_dir else PROBE_CACHE_PATH
+
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached['path'] == search_path and cached['mtimes'] == mtimes and cached['backend'] in BACKENDS:
+            return cached['backend']
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    for name, backend in BACKENDS.items():
+        executable = backend['executable'] and find_executable(backend['executable'])
+        if executable or not backend['executable']:
+            break
+
+    try:
+        if not os.path.isdir(os.path.dirname(cache_path)):
+            os.makedirs(os.path.dirname(cache_path))
+        with open(cache_path, 'w') as f:
+            json.dump({'path': search_path, 'mtimes': mtimes, 'backend': name, 'executable': executable}, f)
+    except (IOError, OSError):
+        pass
+
+    return name
+
+
+def import_parser_class(dotted_name):
+    module_name, class_name = dotted_name.rsplit('.', 1)
+    return getattr(import_module(module_name), class_name)
+
+
+def get_parser_class(name):
+    """
+    Return parser class of backend, raise KeyError for unknown names
+    """
+    return import_parser_class(BACKENDS[name]['parser'])
+
+
+def get_backend_parser(name=None):
+    """
+    Return parser instance of backend with given name, of the preferred installed one if name is empty
+    Raise KeyError for unknown names
+    """
+    return get_parser_class(name or probe_backend())()
@@ -0,0 +1,203 @@
+from __future__ import unicode_literals, print_function
+import re
+import sys
+import json
+import base64
+from collections import OrderedDict
+from afind.backends._base import ParserBase, ParseResult
+from afind.utils.search_options import SearchOptions
+
+
+class RgParser(ParserBase):
+    cmd_usage = 'rg --help'
+
+    # params specefic for ripgrep backend
+    CUSTOM_PARAMS = OrderedDict([
+        ('-nG',    {'args_count': 1, 'is_repeatable': True,
+                    'description': 'PATTERN Skip paths matching regex, re:REGEX or glob:GLOB, can be repeated'}),
+    ])
+
+    # rg params of supported ag options, {} is replaced by argument of option, None - option is dropped:
+    # rg output is --json anyway, -G is applied to reported files. Other options are reported as unsupported,
+    # as rg either doesn't have them or has short ones with other meaning (-f, -g, -p, -n)
+    OPTIONS_MAP = {
+        '--after': '--after-context={}',
+        '--before': '--before-context={}',
+        '--context': '--context={}',
+        '--ignore-case': '--ignore-case',
+        '--case-sensitive': '--case-sensitive',
+        '--smart-case': '--smart-case',
+        '--literal': '--fixed-strings',
+        '-F': '--fixed-strings',
+        '--fixed-strings': '--fixed-strings',
+        '--word-regexp': '--word-regexp',
+        '-v': '--invert-match',
+        '--invert-match': '--invert-match',
+        '--max-count': '--max-count={}',
+        '--depth': '--max-depth={}',
+        '-n': '--max-depth=1',
+        '--norecurse': '--max-depth=1',
+        '-f': '--follow',
+        '--follow': '--follow',
+        '--hidden': '--hidden',
+        '--skip-vcs-ignores': '--no-ignore-vcs',
+        '--unrestricted': '-uuu',
+        '--all-types': '--no-ignore',
+        '--all-text': '--no-ignore',
+        '--search-binary': '--binary',
+        '-z': '--search-zip',
+        '--search-zip': '--search-zip',
+        '-p': '--ignore-file={}',
+        '--path-to-ignore': '--ignore-file={}',
+        '--ignore': '--glob=!{}',
+        '--ignore-dir': '--glob=!{}',
+        '--one-device': '--one-file-system',
+        '--workers': '--threads={}',
+        '--silent': '--no-messages',
+        '--passthrough': '--passthru',
+        '--file-search-regex': None,
+        '-r': None,
+        '--recurse': None,
+        '--multiline': None,
+        '--color': None,
+        '--nocolor': None,
+        '--color-line-number': None,
+        '--color-match': None,
+        '--color-path': None,
+        '--column': None,
+        '--group': None,
+        '--nogroup': None,
+        '--heading': None,
+        '--noheading': None,
+        '--break': None,
+        '--nobreak': None,
+        '--numbers': None,
+        '--nonumbers': None,
+        '--filename': None,
+        '--nofilename': None,
+        '--pager': None,
+        '--nopager': None,
+        '--print-long-lines': None,
+        '--affinity': None,
+        '--noaffinity': None,
+    }
+
+    def get_results(self, parser_params, afind_params):
+        options = SearchOptions(parser_params)
+        paths = options.paths
+
+        unsupported = [name for name, _ in options.options if name not in self.OPTIONS_MAP]
+        if unsupported:
+            self.cmd_search = 'rg: unsupported option ' + unsupported[0]
+            sys.stderr.write('@afind rg: unsupported option: ' + unsupported[0] + '\n')
+            yield ParseResult.RESULTS_FINISHED
+            return
+
+        self.run_params = ['rg', '--json'] + self._translate_options(options)
+
+        # rg skips names of -nG glob rules by itself, search roots are split around excluded prefixes
+        excluder = None
+        if '-nG' in afind_params:
+            from afind.utils.path_excluder import PathExcluder
+            excluder = PathExcluder.from_params(afind_params)
+            for name in excluder.glob_names:
+                self.run_params += ['--glob', '!' + name]
+            if options.pattern is not None:
+                paths, _ = self._get_search_roots(options, excluder)
+
+        if paths is None:
+            self.cmd_search = 'rg: every search path is excluded'
+            yield ParseResult.RESULTS_FINISHED
+            return
+
+        self.run_params += ['--', options.pattern] + paths if options.pattern is not None else []
+        self.actions_pre(afind_params)
+        self.cmd_search = self._join_args(self.run_params)
+
+        # rg can't filter files by regex, results of files not matching -G / excluded by -nG are skipped
+        include_rx = options.get('--file-search-regex')
+        include_rx = re.compile(include_rx.encode('utf-8')) if include_rx else None
+
+        has_context = bool(options.context_before or options.context_after)
+
+        current_filename = b''
+        is_skipped_file = False
+        last_line_num = 0
+
+        for line in self._get_cmd_output(self.cmd_search):
+            try:
+                event = json.loads(line)
+            except ValueError:
+                sys.stderr.write(b'@afind parse-error: ' + line + b'\n')
+                self.profiler.add('parse', errors=1)
+                continue
+
+            event_type = event.get('type')
+            data = event.get('data', {})
+
+            if event_type == 'begin':
+                filename = self._get_bytes(data['path'])
+                is_skipped_file = (
+                    (include_rx is not None and not include_rx.search(filename)) or
+                    (excluder is not None and excluder.is_excluded(filename))
+                )
+                if is_skipped_file:
+                    continue
+
+                # like ag output, files are separated with empty line
+                if current_filename:
+                    yield ParseResult.FILE_FINISHED
+
+                current_filename = filename
+                last_line_num = 0
+                yield ParseResult(ParseResult.KIND_TITLE, current_filename)
+
+            elif event_type in ('match', 'context') and not is_skipped_file:
+                line_text = self._get_bytes(data['lines']).rstrip(b'\r\n')
+
+                line_num = data['line_number']
+                if has_context and last_line_num and line_num > last_line_num + 1:
+                    yield ParseResult.GROUP_DELIMITER
+                last_line_num = line_num
+
+                line_cols = []
+                if event_type == 'match':
+                    line_cols = [(m['start'], m['end'] - m['start']) for m in data['submatches']]
+
+                yield ParseResult(
+                    ParseResult.KIND_LINE,
+                    filename=current_filename,
+                    line_text=line_text,
+                    line_num=b'%d' % line_num,
+                    line_cols=line_cols,
+                )
+
+        yield ParseResult.RESULTS_FINISHED
+
+        self.actions_post(afind_params)
+
+    def _translate_options(self, options):
+        params = []
+
+        # ag uses smart case by default, rg doesn't
+        if not options.has('--ignore-case', '--case-sensitive'):
+            params.append('--smart-case')
+
+        for name, value in options.options:
+            rg_param = self.OPTIONS_MAP[name]
+            if rg_param is None:
+                continue
+            if name == '--context' and not value:
+                # ag's context length is optional
+                value = '2'
+            params.append(rg_param.format(value))
+
+        return params
+
+    def _get_bytes(self, data):
+        """
+        rg reports non-utf8 data base64 encoded
+        """
+        if 'text' in data:
+            return data['text'].encode('utf-8')
+        return base64.b64decode(data.get('bytes', ''))
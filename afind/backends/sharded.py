@@ -0,0 +1,275 @@
+from __future__ import unicode_literals, print_function
+import os
+import re
+import sys
+import time
+import signal
+import traceback
+from Queue import Empty
+from afind.backends._base import ParserBase, ParseResult, kill_running_backends
+from afind.utils.files_walker import TreeWalker
+from afind.utils.search_options import SearchOptions
+
+
+# every file costs open and read besides its size
+FILE_COST = 4096
+
+# results of shard are sent to main process in batches of this size, or once the oldest one waits that long
+BATCH_SIZE = 256
+BATCH_SECONDS = 0.05
+
+# seconds main process waits for results before it checks whether search is terminated
+POLL_SECONDS = 0.1
+
+
+def make_shards(files, shards_count):
+    """
+    Split [(path, size)] in walk order into at most shards_count contiguous lists of paths of about equal size,
+    so results of shards one after another are in walk order too
+    """
+    total_size = sum(size + FILE_COST for _, size in files)
+    shards, shard, shard_size = [], [], 0
+
+    for path, size in files:
+        shard.append(path)
+        shard_size += size + FILE_COST
+        if len(shards) < shards_count - 1 and shard_size * shards_count >= total_size * (len(shards) + 1):
+            shards.append(shard)
+            shard = []
+    if shard:
+        shards.append(shard)
+
+    return shards
+
+
+def _dump(res):
+    if res.is_file_finished or res.is_group_delimiter:
+        return res.kind
+    return (res.kind, res.filename, res.line_text, res.line_num, res._line_cols, res._raw_cols)
+
+
+def _load(record):
+    if record == ParseResult.KIND_FILE_FINISHED:
+        return ParseResult.FILE_FINISHED
+    if record == ParseResult.KIND_GROUP_DELIMITER:
+        return ParseResult.GROUP_DELIMITER
+    return ParseResult(*record)
+
+
+def _stop_shard(signum, frame):
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise SystemExit(1)
+
+
+def _search_shard(parser_class, parser_params, afind_params, shard_index, queue):
+    """
+    Search files of one shard in child process: (shard_index, [dumped results]) batches are sent to queue,
+    then (shard_index, None, cmd_search). Files are searched in this process, shards are the pool already
+    """
+    # Ctrl-C stops main process, which terminates shards
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _stop_shard)
+
+    parser = parser_class(workers=1)
+    try:
+        try:
+            batch, time_flush = [], 0
+            results = parser.get_results(parser_params, afind_params)
+            try:
+                for res in results:
+                    if res.is_results_finished:
+                        continue
+                    batch.append(_dump(res))
+                    if len(batch) >= BATCH_SIZE or time.time() >= time_flush:
+                        queue.put((shard_index, batch))
+                        batch, time_flush = [], time.time() + BATCH_SECONDS
+            finally:
+                results.close()
+
+            if batch:
+                queue.put((shard_index, batch))
+        except Exception:
+            traceback.print_exc()
+
+        queue.put((shard_index, None, parser.cmd_search))
+        queue.close()
+        queue.join_thread()
+    except SystemExit:
+        # main process doesn't read results anymore
+        queue.cancel_join_thread()
+    finally:
+        kill_running_backends()
+        sys.stderr.flush()
+        os._exit(0)
+
+
+def _join_files(results):
+    """
+    Yield results of shards one after another as stream of one backend: files are separated by FILE_FINISHED
+    """
+    is_file_open = False
+
+    for res in results:
+        if res.is_file_finished:
+            if not is_file_open:
+                continue
+            is_file_open = False
+        elif res.is_title:
+            if is_file_open:
+                yield ParseResult.FILE_FINISHED
+            is_file_open = True
+        yield res
+
+    yield ParseResult.RESULTS_FINISHED
+
+
+class ShardedParser(ParserBase):
+    '''
+    Splits files of native search into shards of about equal size and searches every shard in own process.
+    Files are listed by TreeWalker the way native backend lists them, shards are contiguous parts
+    of walk order, so results of shards put one after another are in the same order as results of
+    one native search. Results of the first unfinished shard are yielded as soon as they arrive,
+    the later shards are kept in memory till the ones before them are finished.
+    ag and rg aren't sharded: given lists of files, they would skip their own ignore rules
+    (.git/info/exclude, global gitignore, .rgignore), so they would search other files than alone
+    '''
+
+    def __init__(self, parser_class, jobs):
+        self.parser_class = parser_class
+        self.jobs = jobs
+        self.CUSTOM_PARAMS = parser_class.CUSTOM_PARAMS
+        self.cmd_usage = parser_class.cmd_usage
+        self._parsers = []
+        self._processes = []
+
+    def print_usage(self):
+        return self.parser_class().print_usage()
+
+    def terminate(self):
+        self.is_terminated = True
+        for parser in self._parsers:
+            parser.terminate()
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+
+    def get_results(self, parser_params, afind_params):
+        options = SearchOptions(parser_params)
+
+        # wrong options are reported by one parser
+        shards = []
+        supported = self.parser_class.SUPPORTED_OPTIONS
+        if options.pattern is not None and all(name in supported for name, _ in options.options):
+            with self.profiler.measure('spawn'):
+                shards = make_shards(self._walk_sizes(options, afind_params), self.jobs)
+
+        if len(shards) < 2:
+            parser = self.parser_class()
+            self._parsers = [parser]
+            parser.is_terminated = self.is_terminated
+            parser.profiler = self.profiler
+            for res in parser.get_results(parser_params, afind_params):
+                yield res
+            self.cmd_search = parser.cmd_search
+            self.time_first_result = parser.time_first_result
+            return
+
+        # multiprocessing takes a while to import, searches which aren't sharded don't need it
+        from multiprocessing import Process, Queue
+
+        time_started = time.time()
+        self.time_first_result = None
+        self.cmd_search = ''
+        queue = Queue()
+        commands = [b''] * len(shards)
+
+        with self.profiler.measure('spawn'):
+            self._processes = [
+                Process(target=_search_shard,
+                        args=(self.parser_class, options.with_paths(shard), afind_params, i, queue))
+                for i, shard in enumerate(shards)
+            ]
+            for process in self._processes:
+                process.start()
+        self.profiler.add('spawn', events=len(shards))
+
+        try:
+            for res in _join_files(self._iter_shards(queue, commands)):
+                if self.time_first_result is None and res.kind == ParseResult.KIND_LINE:
+                    self.time_first_result = time.time() - time_started
+                    self.profiler.add('first_byte', wall=self.time_first_result, events=1)
+                yield res
+        finally:
+            # shards are still running if results stream is closed before its end
+            for process in self._processes:
+                if process.is_alive():
+                    process.terminate()
+            for process in self._processes:
+                process.join()
+            self._processes = []
+            queue.close()
+            self.cmd_search = b' ;'.join(commands)
+
+    def _walk_sizes(self, options, afind_params):
+        """
+        Return [(path, size)] of files to search in walk order
+        """
+        include_rx = options.get('--file-search-regex')
+        include_rx = re.compile(include_rx.encode('utf-8')) if include_rx else None
+        excluder = None
+        if '-nG' in afind_params:
+            from afind.utils.path_excluder import PathExcluder
+            excluder = PathExcluder.from_params(afind_params)
+
+        files = []
+        for path in TreeWalker.from_options(options, include_rx, excluder):
+            try:
+                files.append((path, os.lstat(path).st_size))
+            except OSError:
+                files.append((path, 0))
+        return files
+
+    def _iter_shards(self, queue, commands):
+        """
+        Yield results of shards in their order, commands gets cmd_search of every finished shard
+        """
+        batches = [[] for _ in commands]
+        is_finished = [False] * len(commands)
+        current = 0
+        # shards found gone at the previous poll, their last message had time to arrive since then
+        gone = set()
+
+        while current < len(commands) and not self.is_terminated:
+            try:
+                message = queue.get(True, POLL_SECONDS)
+            except Empty:
+                self._check_gone(gone, is_finished)
+                gone = set(i for i, process in enumerate(self._processes)
+                           if not is_finished[i] and process.exitcode is not None)
+            else:
+                shard_index, batch = message[:2]
+                if batch is None:
+                    is_finished[shard_index] = True
+                    commands[shard_index] = message[2]
+                else:
+                    batches[shard_index].append(batch)
+
+            while current < len(commands):
+                shard_batches, batches[current] = batches[current], []
+                for shard_batch in shard_batches:
+                    for record in shard_batch:
+                        yield _load(record)
+                if not is_finished[current]:
+                    break
+                current += 1
+
+    def _check_gone(self, gone, is_finished):
+        """
+        Finish shards which were found gone before and didn't send their end since then:
+        process was killed, eg: by OOM killer
+        """
+        for shard_index in gone:
+            if not is_finished[shard_index]:
+                is_finished[shard_index] = True
+                sys.stderr.write('@afind jobs: shard {} stopped with exit code {}, its results are missing\n'.format(
+                    shard_index + 1, self._processes[shard_index].exitcode))
@@ -0,0 +1,371 @@
+from __future__ import unicode_literals, print_function
+import os
+import re
+import sys
+import json
+import time
+import errno
+import select
+import signal
+import socket
+import struct
+import traceback
+from threading import Thread, Lock
+
+
+# frame is channel byte, length of payload as 4 bytes and payload
+FRAME_HEADER = struct.Struct(b'>cI')
+
+REQUEST = b'r'
+STDOUT  = b'o'
+STDERR  = b'e'
+EXIT    = b'x'
+
+# params which need terminal of the user, searches with them are run by client itself
+INTERACTIVE_PARAMS = ['--subl', '--atom', '--daemon', '--watch']
+
+
+def get_socket_path():
+    return os.environ.get('AFIND_SOCKET') or os.path.join(os.path.expanduser('~'), '.cache', 'afind', 'daemon.sock')
+
+
+def send_frame(sock, channel, payload):
+    sock.sendall(FRAME_HEADER.pack(channel, len(payload)) + payload)
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def recv_frame(sock):
+    """
+    Return (channel, payload), None if connection is closed
+    """
+    header = _recv_exactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    channel, size = FRAME_HEADER.unpack(header)
+    payload = _recv_exactly(sock, size)
+    if payload is None:
+        return None
+    return channel, payload
+
+
+class FrameWriter(object):
+    '''
+    File-like object which sends everything written to it as frames of one channel
+    '''
+
+    def __init__(self, sock, channel, lock, is_tty=False):
+        self._sock = sock
+        self._channel = channel
+        self._lock = lock
+        self._is_tty = is_tty
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        if not data:
+            return
+        with self._lock:
+            send_frame(self._sock, self._channel, data)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return self._is_tty
+
+
+class DaemonServer(object):
+    '''
+    Serves searches of clients over Unix socket.
+    Modules are imported and backend is probed once, every request is run by process forked from server,
+    so it starts warm. After fork server loads what searches in directory of request build, so the next
+    requests there inherit it: parsed ignore files of the tree, -nG excluder and loaded index.
+    They are keyed by absolute paths and checked by mtime where they are used, tree is walked again
+    once WARM_INTERVAL passes. Application itself is created for every request, it holds its params only.
+    Process of request is leader of own group, when client disconnects before search is finished
+    the whole group and backend processes are killed.
+    Up to MAX_REQUESTS are run concurrently, other clients wait. Server exits after IDLE_TIMEOUT seconds
+    without requests
+    '''
+
+    MAX_REQUESTS = 4
+    IDLE_TIMEOUT = 15 * 60
+
+    # how often finished requests are reaped while server waits for new ones
+    POLL_INTERVAL = 0.5
+
+    # client sends request right after it connects
+    REQUEST_TIMEOUT = 5
+
+    # directory is walked for its ignore files again after that, walk stops after WARM_SECONDS in big trees
+    WARM_INTERVAL = 60
+    WARM_SECONDS = 2
+
+    def __init__(self, socket_path=None, max_requests=None, idle_timeout=None):
+        self.socket_path = socket_path or get_socket_path()
+        self.max_requests = max_requests or self.MAX_REQUESTS
+        self.idle_timeout = idle_timeout or int(os.environ.get('AFIND_DAEMON_IDLE', self.IDLE_TIMEOUT))
+        self._children = set()
+        # directory of requests -> time it was warmed
+        self._warmed = {}
+        self._server_dir = os.getcwd()
+
+    def _bind(self):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except socket.error:
+            pass
+        else:
+            raise RuntimeError('daemon is already running at ' + self.socket_path)
+        finally:
+            probe.close()
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        if not os.path.isdir(os.path.dirname(self.socket_path)):
+            os.makedirs(os.path.dirname(self.socket_path))
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        sock.listen(16)
+        return sock
+
+    def _reap_children(self):
+        for pid in list(self._children):
+            try:
+                finished_pid, _ = os.waitpid(pid, os.WNOHANG)
+            except OSError as e:
+                if e.errno != errno.ECHILD:
+                    raise
+                finished_pid = pid
+            if finished_pid:
+                self._children.discard(pid)
+
+    def serve(self):
+        try:
+            sock = self._bind()
+        except (RuntimeError, socket.error, OSError) as e:
+            sys.stderr.write('@afind daemon: {}\n'.format(e))
+            return False
+
+        # socket is removed on exit
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        # warm up whatever is cached in process, so every forked request gets it
+        import afind.application
+        from afind.backends.registry import probe_backend
+        probe_backend()
+
+        sys.stderr.write('@afind daemon: listening at {}\n'.format(self.socket_path))
+        last_activity = time.time()
+
+        try:
+            while True:
+                self._reap_children()
+                if self._children:
+                    last_activity = time.time()
+                elif time.time() - last_activity > self.idle_timeout:
+                    sys.stderr.write('@afind daemon: idle for {}s, exiting\n'.format(self.idle_timeout))
+                    break
+
+                if len(self._children) >= self.max_requests:
+                    time.sleep(self.POLL_INTERVAL)
+                    continue
+
+                readable, _, _ = select.select([sock], [], [], self.POLL_INTERVAL)
+                if not readable:
+                    continue
+
+                conn, _ = sock.accept()
+                last_activity = time.time()
+                request = self._read_request(conn)
+                if request is None:
+                    conn.close()
+                    continue
+
+                pid = os.fork()
+                if not pid:
+                    sock.close()
+                    self._serve_request(conn, request)
+                conn.close()
+                self._children.add(pid)
+                self._warm(request)
+        finally:
+            sock.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+        return True
+
+    def _read_request(self, conn):
+        """
+        Return request of client, None if it didn't send one in time
+        """
+        conn.settimeout(self.REQUEST_TIMEOUT)
+        try:
+            frame = recv_frame(conn)
+            if frame is None or frame[0] != REQUEST:
+                return None
+            return json.loads(frame[1].decode('utf-8'))
+        except (socket.error, ValueError):
+            return None
+        finally:
+            conn.settimeout(None)
+
+    def _warm(self, request):
+        """
+        Parse ignore files of tree of request directory, load its index and -nG excluder of request,
+        so processes forked for next requests get them ready
+        """
+        from afind.utils.files_walker import TreeWalker
+        from afind.utils.path_excluder import PathExcluder
+        from afind.utils.trigram_index import open_index
+
+        argv = request['argv']
+        specs = [argv[i + 1] for i in range(len(argv) - 1) if argv[i] == '-nG']
+        try:
+            PathExcluder.from_params({'-nG': specs})
+        except re.error:
+            pass
+
+        cwd = request['cwd']
+        time_started = time.time()
+        if time_started - self._warmed.get(cwd, 0) < self.WARM_INTERVAL:
+            return
+        self._warmed[cwd] = time_started
+
+        try:
+            os.chdir(cwd)
+            index = open_index()
+            if index.exists():
+                index.load()
+            for _ in TreeWalker([], workers=1):
+                if time.time() - time_started > self.WARM_SECONDS:
+                    break
+        except (IOError, OSError, ValueError, KeyError, TypeError, EOFError):
+            pass
+        finally:
+            os.chdir(self._server_dir)
+
+    def _serve_request(self, conn, request):
+        """
+        Run in forked process, never returns
+        """
+        exit_code = 1
+        try:
+            os.setpgid(0, 0)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+            watchdog = Thread(target=self._watch_client, args=(conn,))
+            watchdog.daemon = True
+            watchdog.start()
+
+            exit_code = self._run_request(conn, request)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            os._exit(exit_code)
+
+    def _watch_client(self, conn):
+        """
+        Client sends nothing after request, so end of its stream means it is gone: search is cancelled
+        """
+        try:
+            while conn.recv(4096):
+                pass
+        except socket.error:
+            pass
+        # backends are leaders of own groups
+        from afind.backends._base import kill_running_backends
+        kill_running_backends()
+        os.killpg(0, signal.SIGKILL)
+
+    def _run_request(self, conn, request):
+        # imported by server already, client doesn't need it
+        from afind.application import Application
+
+        lock = Lock()
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update((key.encode('utf-8'), value.encode('utf-8')) for key, value in request['env'].items())
+
+        sys.argv = [arg.encode('utf-8') for arg in request['argv']]
+        sys.stdin = open(os.devnull)
+        sys.stdout = FrameWriter(conn, STDOUT, lock, is_tty=request['isatty'])
+        sys.stderr = FrameWriter(conn, STDERR, lock)
+
+        try:
+            Application().run()
+            exit_code = 0
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception:
+            sys.stderr.write(traceback.format_exc())
+            exit_code = 1
+
+        with lock:
+            send_frame(conn, EXIT, b'%d' % exit_code)
+        return exit_code
+
+
+def run_client(argv, socket_path=None):
+    """
+    Run search with argv in daemon and print its output, return exit code
+    Return None if search has to be run locally: daemon isn't running or params need terminal
+    """
+    if any(param in argv for param in INTERACTIVE_PARAMS):
+        return None
+
+    try:
+        request = json.dumps({
+            'argv': [arg.decode('utf-8') for arg in argv],
+            'cwd': os.getcwd().decode('utf-8'),
+            'env': dict((key.decode('utf-8'), value.decode('utf-8')) for key, value in os.environ.items()),
+            'isatty': sys.stdout.isatty(),
+        })
+    except UnicodeDecodeError:
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path or get_socket_path())
+    except socket.error:
+        sock.close()
+        return None
+
+    try:
+        send_frame(sock, REQUEST, request.encode('utf-8'))
+
+        while True:
+            frame = recv_frame(sock)
+            if frame is None:
+                sys.stderr.write('@afind daemon: connection lost\n')
+                return 1
+
+            channel, payload = frame
+            if channel == STDOUT:
+                sys.stdout.write(payload)
+                sys.stdout.flush()
+            elif channel == STDERR:
+                sys.stderr.write(payload)
+            elif channel == EXIT:
+                return int(payload)
+    except IOError as e:
+        # output is closed, eg: by head, closed connection cancels search
+        if e.errno != errno.EPIPE:
+            raise
+        return 1
+    finally:
+        sock.close()
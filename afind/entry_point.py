@@ -1,8 +1,8 @@
 from __future__ import unicode_literals, print_function
-from afind.application import Application
 
 
 def main():
+    import os
     import sys
     import signal
 
@@ -12,6 +12,18 @@ def main():
 
     signal.signal(signal.SIGINT, signal_handler)
 
+    # daemon modules are imported only when used, socket takes a while to import
+    if '--daemon' in sys.argv[1:]:
+        from afind.daemon import DaemonServer
+        sys.exit(0 if DaemonServer().serve() else 1)
+
+    if ('--use-daemon' in sys.argv[1:]) or os.environ.get('AFIND_DAEMON') == '1':
+        from afind.daemon import run_client
+        exit_code = run_client(sys.argv)
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    from afind.application import Application
     Application().run()
 
 
@@ -0,0 +1,117 @@
+from __future__ import unicode_literals, print_function
+import os
+import stat
+import tempfile
+
+
+def _write_temp(path, data):
+    """
+    Write data into temporary file next to path with the same file mode, return its name
+    """
+    dirname = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='.afind-', dir=dirname)
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        try:
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+        except OSError:
+            pass
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    return tmp_path
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path, data):
+    """
+    Replace file content by writing temporary file next to it and renaming it over the original
+    File mode of the original is preserved
+    """
+    tmp_path = _write_temp(path, data)
+    try:
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+class CommitError(EnvironmentError):
+    '''
+    Not all files of batch were replaced: renamed ones have new content, not_renamed ones are left as they were
+    '''
+
+    def __init__(self, error, renamed, not_renamed):
+        super(CommitError, self).__init__(error.errno, error.strerror or str(error))
+        self.renamed = renamed
+        self.not_renamed = not_renamed
+
+
+class AtomicBatchWriter(object):
+    '''
+    Replaces content of many files: everything is written to temporary files first,
+    which are synced in one batch and only then renamed over the originals.
+    Every parent directory is synced once after all renames
+    '''
+
+    def __init__(self, pool=None):
+        self._pool = pool
+        self._pending = []
+
+    def add(self, path, data):
+        """
+        Can be called from several threads
+        """
+        self._pending.append((path, _write_temp(path, data)))
+
+    def _map(self, func, items):
+        return self._pool.map(func, items) if self._pool else list(map(func, items))
+
+    def commit(self):
+        """
+        Raise CommitError if some of files weren't replaced, temporary files are removed anyway
+        Files are renamed in order of their paths
+        """
+        pending, self._pending = sorted(self._pending), []
+        try:
+            self._map(_fsync_path, [tmp_path for _, tmp_path in pending])
+        except (IOError, OSError) as e:
+            self._remove(pending)
+            raise CommitError(e, [], [path for path, _ in pending])
+
+        renamed = []
+        for i, (path, tmp_path) in enumerate(pending):
+            try:
+                os.rename(tmp_path, path)
+            except (IOError, OSError) as e:
+                self._remove(pending[i:])
+                raise CommitError(e, renamed, [path for path, _ in pending[i:]])
+            renamed.append(path)
+
+        dirnames = set(os.path.dirname(path) or '.' for path, _ in pending)
+        try:
+            self._map(_fsync_path, sorted(dirnames))
+        except (IOError, OSError) as e:
+            raise CommitError(e, renamed, [])
+
+    def rollback(self):
+        pending, self._pending = self._pending, []
+        self._remove(pending)
+
+    def _remove(self, pending):
+        for _, tmp_path in pending:
+            try:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            except OSError:
+                pass
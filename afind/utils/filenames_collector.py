@@ -1,16 +1,57 @@
 import os
 import sys
+from array import array
+from subprocess import call
 from collections import OrderedDict
 
 
+# room left in argument list for whatever the system adds, like xargs does
+ARGS_HEADROOM = 2048
+
+# size of a pointer in argv and envp
+POINTER_SIZE = 8
+
+
+def get_args_limit():
+    """
+    Bytes available for arguments of new process: system limit minus size of environment
+    """
+    try:
+        arg_max = os.sysconf(b'SC_ARG_MAX')
+    except (ValueError, OSError):
+        arg_max = -1
+    if arg_max <= 0:
+        arg_max = 128 * 1024
+
+    env_size = sum(len(key) + len(value) + 2 + POINTER_SIZE for key, value in os.environ.items())
+    return max(arg_max - env_size - ARGS_HEADROOM, 4096)
+
+
+def split_args(args, limit):
+    """
+    Yield lists of args, every list fits into limit of bytes
+    """
+    batch, size = [], 0
+    for arg in args:
+        arg_size = len(arg) + 1 + POINTER_SIZE
+        if batch and size + arg_size > limit:
+            yield batch
+            batch, size = [], 0
+        batch.append(arg)
+        size += arg_size
+    if batch:
+        yield batch
+
+
 class FilenamesCollector(object):
     '''
     Collect matched filenames with linenumbers
     eg:
     {
-        'filename.js': [12, 23],
-        'filename.css': [77, 160],
+        'filename.js': array('I', [12, 23]),
+        'filename.css': array('I', [77, 160]),
     }
+    Filenames are interned, so they are shared with whatever else holds them
     '''
 
     def __init__(self, results_stream):
@@ -18,37 +59,46 @@ class FilenamesCollector(object):
         self._filenames = OrderedDict()
 
     def __iter__(self):
+        filenames = self._filenames
+        current_filename, line_numbers = None, None
+
         for res in self._results_stream:
+            filename = res.filename
 
-            if res.filename:
-                self._filenames.setdefault(res.filename, [])
+            if filename:
+                # results of one file come one after another
+                if filename is not current_filename:
+                    current_filename = filename
+                    filename = intern(filename)
+                    line_numbers = filenames.get(filename)
+                    if line_numbers is None:
+                        line_numbers = filenames[filename] = array(b'I')
 
                 if res.line_num:
-                    self._filenames[res.filename].append(res.line_num)
+                    line_numbers.append(int(res.line_num))
 
             yield res
 
-    def get_filenames(self, only_first_line=False):
-        result = ''
-
-        for filename in self._filenames.keys():
-            line_numbers = self._filenames[filename]
-
-            if line_numbers:
-                line_numbers = line_numbers[:1] if only_first_line else line_numbers
-                result += ' '.join('{}:{}'.format(filename, ln) for ln in line_numbers)
-            else:
-                result += filename
+    def iter_locations(self, only_first_line=False):
+        """
+        Yield 'filename:line' of every collected line, just 'filename' for files without lines
+        """
+        for filename, line_numbers in self._filenames.items():
+            if not line_numbers:
+                yield filename
+                continue
 
-            result += ' '
+            for line_num in (line_numbers[:1] if only_first_line else line_numbers):
+                yield b'%s:%d' % (filename, line_num)
 
-        return result.strip()
+    def get_filenames(self, only_first_line=False):
+        return b' '.join(self.iter_locations(only_first_line))
 
     def onen_in_editor(self, editor_title, editor_cmd):
         """
         :param: editor_title - string
-        :param: editor_cmd   - string
-        :param: filenames    - SearchResults instance
+        :param: editor_cmd   - executable of editor, it gets locations as arguments,
+                               in several runs if they don't fit into one command line
         """
 
         if not self._filenames:
@@ -59,9 +109,13 @@ class FilenamesCollector(object):
             if raw_input(msg).strip().lower() != 'y':
                 return
 
-        files = self.get_filenames(only_first_line=True)
-
         sys.stdout.write('@afind open: {}...\n'.format(editor_title))
-        cmd = "echo {} | xargs {}".format(files, editor_cmd)
-        os.system(cmd)
-        
+        sys.stdout.flush()
+
+        limit = get_args_limit() - len(editor_cmd) - 1 - POINTER_SIZE
+        for batch in split_args(self.iter_locations(only_first_line=True), limit):
+            try:
+                call([editor_cmd] + batch)
+            except OSError as e:
+                sys.stderr.write('@afind open: can\'t run {}: {}\n'.format(editor_cmd, e.strerror or e))
+                return
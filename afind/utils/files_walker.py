@@ -0,0 +1,448 @@
+from __future__ import unicode_literals, print_function
+import io
+import os
+import re
+import stat
+import time
+from collections import OrderedDict
+from Queue import Queue
+from threading import Thread, Event
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+# bytes in the beginning of file checked for zero byte to detect binary files
+BINARY_CHECK_SIZE = 512
+
+# ignore files read in every directory, rules of the later ones take precedence
+IGNORE_FILES = [b'.gitignore', b'.ignore', b'.agignore']
+
+# absolute path of ignore file -> (mtime, size, IgnoreRules), rules are parsed once per process,
+# daemon parses them before it forks processes of requests
+_ignore_cache = {}
+
+
+def glob_to_regex(glob):
+    """
+    Return regex source of glob: * and ? don't match /, ** matches anything, **/ any amount of directories
+    """
+    result = []
+    i = 0
+    while i < len(glob):
+        char = glob[i]
+        if glob.startswith('**/', i):
+            result.append('(?:.*/)?')
+            i += 3
+            continue
+        if glob.startswith('**', i):
+            result.append('.*')
+            i += 2
+            continue
+        if char == '*':
+            result.append('[^/]*')
+        elif char == '?':
+            result.append('[^/]')
+        elif char == '[' and glob.find(']', i + 2) > 0:
+            end = glob.find(']', i + 2)
+            body = glob[i + 1:end].replace('\\', '\\\\')
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            result.append('[' + body + ']')
+            i = end
+        else:
+            result.append(re.escape(char))
+        i += 1
+    return ''.join(result)
+
+
+def is_binary_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return b'\0' in f.read(BINARY_CHECK_SIZE)
+    except (IOError, OSError):
+        return False
+
+
+class IgnoreRules(object):
+    '''
+    Rules of one ignore file in .gitignore syntax: globs, !negation, trailing / for directories only,
+    patterns with / inside are matched from directory of ignore file, other ones against names at any depth.
+    Files without negations are checked by one regex for names and one for paths
+    '''
+
+    def __init__(self, lines):
+        # (compiled regex, is matched against relative path, is negated, is for directories only)
+        self.rules = []
+
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if line.endswith(' ') and not line.endswith('\\ '):
+                line = line.rstrip(' ')
+            if not line or line.startswith('#'):
+                continue
+
+            is_negated = line.startswith('!')
+            if is_negated:
+                line = line[1:]
+            line = line.replace('\\ ', ' ').lstrip('\\')
+
+            is_dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            is_path = '/' in line
+            line = line.lstrip('/')
+            if not line:
+                continue
+
+            rx = re.compile(('^' + glob_to_regex(line) + '$').encode('utf-8'))
+            self.rules.append((rx, is_path, is_negated, is_dir_only))
+
+        self._combined = None
+        if not any(is_negated for _, _, is_negated, _ in self.rules):
+            self._combined = [
+                self._join([rx for rx, is_path, _, is_dir_only in self.rules
+                            if is_path == for_path and (for_dirs or not is_dir_only)])
+                for for_path, for_dirs in ((False, False), (True, False), (False, True), (True, True))
+            ]
+
+    @staticmethod
+    def _join(regexes):
+        if not regexes:
+            return None
+        return re.compile(b'|'.join(b'(?:' + rx.pattern + b')' for rx in regexes))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Return rules of ignore file, None if it can't be read. Parsed files are cached till they change
+        """
+        # roots of walks are given as typed, relative to current directory
+        key = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+            cached = _ignore_cache.get(key)
+            if cached and cached[:2] == (st.st_mtime, st.st_size):
+                return cached[2]
+
+            with io.open(path, encoding='utf-8', errors='replace') as f:
+                rules = cls(f)
+        except (IOError, OSError):
+            return None
+
+        _ignore_cache[key] = (st.st_mtime, st.st_size, rules)
+        return rules
+
+    def match(self, relpath, name, is_dir):
+        """
+        Return True if path is ignored, False if it is explicitly not ignored, None if rules don't mention it
+        """
+        if self._combined is not None:
+            name_rx, path_rx = self._combined[2:] if is_dir else self._combined[:2]
+            if (name_rx and name_rx.match(name)) or (path_rx and path_rx.match(relpath)):
+                return True
+            return None
+
+        for rx, is_path, is_negated, is_dir_only in reversed(self.rules):
+            if is_dir_only and not is_dir:
+                continue
+            if rx.match(relpath if is_path else name):
+                return not is_negated
+        return None
+
+
+def _list_dir(dirpath):
+    """
+    Return sorted [(name, is_dir)] of directory, d_type of scandir saves stat of every entry.
+    scandir is in Python 3 or in scandir package, without it every entry costs lstat.
+    Symlinks to files are files, symlinks to directories are skipped like other special files
+    """
+    entries = []
+
+    if scandir is not None:
+        for entry in scandir(dirpath):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    entries.append((entry.name, True))
+                elif entry.is_file():
+                    entries.append((entry.name, False))
+            except OSError:
+                continue
+    else:
+        for name in os.listdir(dirpath):
+            path = os.path.join(dirpath, name)
+            try:
+                mode = os.lstat(path).st_mode
+                if stat.S_ISLNK(mode):
+                    mode = os.stat(path).st_mode & ~stat.S_IFDIR
+            except OSError:
+                continue
+            if stat.S_ISDIR(mode):
+                entries.append((name, True))
+            elif stat.S_ISREG(mode):
+                entries.append((name, False))
+
+    entries.sort()
+    return entries
+
+
+class _ScanTask(object):
+    '''
+    Listing of one directory, done is set once result or error of listing in thread is ready
+    '''
+    __slots__ = ('args', 'result', 'error', 'done')
+
+    def __init__(self, args):
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = None
+
+
+class TreeWalker(object):
+    '''
+    Yields paths of files to search in deterministic order: files of directory sorted by name,
+    then its subdirectories the same way. Paths are streamed as soon as their directory is listed.
+    Directories in page cache are listed fastest in consumer thread, but once a listing waits for disk,
+    the next directories are listed by pool of threads ahead of consumer, so their I/O overlaps.
+    Ignore files are read in every directory, like ag does, and their rules apply below it
+    '''
+
+    WORKERS = 8
+
+    # directories listed ahead of consumer at most
+    MAX_PENDING = 64
+
+    # listing of directory which takes longer waits for disk, then directories are listed in threads
+    SLOW_SCAN_SECONDS = 0.002
+
+    def __init__(self, paths, include_rx=None, excluder=None, hidden=False, ignore_files=None,
+                 skip_binary=False, workers=None, keep_dirs=False):
+        """
+        :param: paths        - list of files and directories, current directory if empty
+        :param: include_rx   - compiled regex, only paths matching it are yielded (ag -G)
+        :param: excluder     - PathExcluder of afind -nG, excluded directories aren't entered
+        :param: hidden       - descend into hidden files and directories too
+        :param: ignore_files - names of ignore files to obey, IGNORE_FILES by default
+        :param: skip_binary  - skip files with zero byte in the beginning
+        :param: workers      - threads listing directories, 1 lists them in consumer thread
+        :param: keep_dirs    - remember walked directories, so they can be listed again by rescan_dir
+        """
+        self._strip_dot = not paths
+        self.paths = [p.encode('utf-8') if not isinstance(p, bytes) else p for p in (paths or ['.'])]
+        self.include_rx = include_rx
+        self.excluder = excluder
+        self.hidden = hidden
+        self.ignore_files = IGNORE_FILES if ignore_files is None else ignore_files
+        self.skip_binary = skip_binary
+        self.workers = workers or self.WORKERS
+
+        self._queue = None
+        self._threads = []
+        self._pending = 0
+        self._is_prefetching = False
+        self._is_stopped = False
+
+        # walked directory -> ignore rules for its entries
+        self.dirs = OrderedDict() if keep_dirs else None
+
+    @classmethod
+    def from_options(cls, options, include_rx=None, excluder=None, paths=None, **kwargs):
+        """
+        Return walker of search paths of SearchOptions (or of given paths), which obeys their --hidden, -U and -u
+        """
+        ignore_files = IGNORE_FILES
+        if options.has('--unrestricted'):
+            ignore_files = []
+        elif options.has('--skip-vcs-ignores'):
+            ignore_files = [name for name in IGNORE_FILES if name != b'.gitignore']
+
+        hidden = options.has('--hidden') or options.has('--unrestricted')
+        paths = options.paths if paths is None else paths
+        return cls(paths, include_rx, excluder, hidden, ignore_files=ignore_files, **kwargs)
+
+    def display(self, path):
+        """
+        Return path as walker yields it
+        """
+        return path[2:] if self._strip_dot and path.startswith(b'./') else path
+
+    def _accept_file(self, path):
+        if self.include_rx and not self.include_rx.search(path):
+            return False
+        if self.excluder and self.excluder.is_excluded(path):
+            return False
+        return True
+
+    def __iter__(self):
+        try:
+            for root in self.paths:
+                if os.path.isdir(root):
+                    for path in self._walk(root):
+                        yield path
+                else:
+                    path = self.display(root)
+                    if self._accept_file(path):
+                        yield path
+        finally:
+            # threads finish listing they are busy with and stop, queued directories are dropped
+            self._is_stopped = True
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+
+    def _walk(self, root):
+        stack = [_ScanTask((root, ()))]
+
+        while stack:
+            task = stack.pop()
+            if self.dirs is not None:
+                self.dirs[task.args[0]] = task.args[1]
+            files, subdirs = self._get(task)
+            for path in files:
+                yield path
+
+            tasks = [_ScanTask(args) for args in reversed(subdirs)]
+            stack.extend(tasks)
+
+            if self._is_prefetching and len(stack) > 1:
+                # the nearest directories of depth-first order are listed first
+                for task in reversed(stack[-self.MAX_PENDING:]):
+                    if self._pending >= self.MAX_PENDING:
+                        break
+                    if task.done is None:
+                        self._start(task)
+
+    def _start(self, task):
+        if self._queue is None:
+            # threads are started only when listing turns out to wait for disk
+            self._queue = Queue()
+            self._threads = [Thread(target=self._scan_worker) for _ in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+
+        task.done = Event()
+        self._queue.put(task)
+        self._pending += 1
+
+    def _scan_worker(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            if self._is_stopped:
+                continue
+            try:
+                task.result = self._scan(*task.args)
+            except Exception as e:
+                task.error = e
+            task.done.set()
+
+    def _get(self, task):
+        if task.done is None:
+            time_started = time.time()
+            result = self._scan(*task.args)
+            if self.workers > 1 and time.time() - time_started > self.SLOW_SCAN_SECONDS:
+                self._is_prefetching = True
+            return result
+
+        self._pending -= 1
+        # no timeout: in Python 2 waiting with it polls, listing of one directory doesn't take long
+        task.done.wait()
+        if task.error is not None:
+            raise task.error
+        return task.result
+
+    def rescan_dir(self, dirpath):
+        """
+        Return (paths of accepted files, subdirectories) of walked directory as they are now,
+        new subdirectories can be rescanned too
+        """
+        files, subdirs = self._scan(dirpath, self.dirs[dirpath])
+        for subdir, ignore_chain in subdirs:
+            self.dirs[subdir] = ignore_chain
+        return files, [subdir for subdir, _ in subdirs]
+
+    def _is_ignored(self, ignore_chain, path, name, is_dir):
+        # rules of the deepest ignore file which mentions path decide
+        for base, rules in reversed(ignore_chain):
+            is_ignored = rules.match(path[len(base):], name, is_dir)
+            if is_ignored is not None:
+                return is_ignored
+        return False
+
+    def _scan(self, dirpath, ignore_chain):
+        """
+        Return (paths of accepted files, [(subdirectory, ignore rules for it)])
+        """
+        try:
+            entries = _list_dir(dirpath)
+        except OSError:
+            return [], []
+
+        display_dir = self.display(dirpath)
+        base = b'' if display_dir == b'.' else display_dir.rstrip(b'/') + b'/'
+
+        if self.ignore_files:
+            names = set(name for name, is_dir in entries if not is_dir)
+            for ignore_name in self.ignore_files:
+                if ignore_name in names:
+                    rules = IgnoreRules.load(os.path.join(dirpath, ignore_name))
+                    if rules and rules.rules:
+                        ignore_chain += ((base, rules),)
+
+        files, subdirs = [], []
+
+        for name, is_dir in entries:
+            if name == b'.git' or (not self.hidden and name.startswith(b'.')):
+                continue
+
+            path = base + name
+            if ignore_chain and self._is_ignored(ignore_chain, path, name, is_dir):
+                continue
+
+            if is_dir:
+                if self.excluder and self.excluder.is_dir_excluded(path):
+                    continue
+                subdirs.append((os.path.join(dirpath, name), ignore_chain))
+            else:
+                if not self._accept_file(path):
+                    continue
+                if self.skip_binary and is_binary_file(os.path.join(dirpath, name)):
+                    continue
+                files.append(path)
+
+        return files, subdirs
+
+
+def walk_files(paths, include_rx=None, excluder=None, hidden=False, **options):
+    """
+    Yield paths of files to search in deterministic order, see TreeWalker for params
+    """
+    return iter(TreeWalker(paths, include_rx, excluder, hidden, **options))
+
+
+def filter_paths(paths, roots=None, include_rx=None, excluder=None):
+    """
+    Return paths which are inside one of roots, match include regex and aren't excluded by PathExcluder
+    """
+    roots = [os.path.normpath(r.encode('utf-8') if not isinstance(r, bytes) else r) for r in (roots or [])]
+    if b'.' in roots:
+        roots = []
+
+    result = []
+    for path in paths:
+        if roots and not any(path == r or path.startswith(r.rstrip(b'/') + b'/') for r in roots):
+            continue
+        if include_rx and not include_rx.search(path):
+            continue
+        if excluder and excluder.is_excluded(path):
+            continue
+        result.append(path)
+    return result
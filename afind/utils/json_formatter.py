@@ -0,0 +1,79 @@
+import base64
+from json.encoder import encode_basestring_ascii
+from afind.utils.result_formatters import FormatterBase
+
+
+def json_bytes(data):
+    """
+    JSON string of UTF-8 bytes, object {"bytes": base64} if they aren't valid UTF-8
+    """
+    try:
+        # bytes are taken as UTF-8 and escaped without decoding them first
+        return encode_basestring_ascii(data)
+    except UnicodeDecodeError:
+        return b'{"bytes":"' + base64.b64encode(data) + b'"}'
+
+
+class JsonFormatter(FormatterBase):
+    '''
+    One compact JSON object per line of output (NDJSON), eg:
+    {"type":"begin","path":"file.py"}
+    {"type":"match","path":"file.py","line_number":2,"text":"def func1():","cols":[[4,5]]}
+    {"type":"context","path":"file.py","line_number":3,"text":"    pass"}
+    {"type":"delimiter"}
+    {"type":"end","path":"file.py","matches":1}
+    {"type":"summary","files":1,"matches":1,"lines":2}
+    Path and text which aren't valid UTF-8 are objects: {"bytes": base64}.
+    Matches of --patterns-file have "patterns": id of pattern for every column
+    '''
+
+    def __iter__(self):
+        out = self._sink
+        current_path = None
+        file_matches = 0
+        files_count = matches_count = lines_count = 0
+
+        for res in self._results_stream:
+            if res.is_title:
+                if current_path is not None:
+                    out.write(b'{"type":"end","path":', current_path, b',"matches":%d}\n' % file_matches)
+                current_path = json_bytes(res.filename)
+                file_matches = 0
+                files_count += 1
+                out.write(b'{"type":"begin","path":', current_path, b'}\n')
+
+            elif res.is_file_finished or res.is_results_finished:
+                if current_path is not None:
+                    out.write(b'{"type":"end","path":', current_path, b',"matches":%d}\n' % file_matches)
+                    current_path = None
+                if res.is_results_finished:
+                    out.write(b'{"type":"summary","files":%d,"matches":%d,"lines":%d}\n' % (
+                        files_count, matches_count, lines_count))
+                    out.flush()
+                else:
+                    out.end_file()
+
+            elif res.is_group_delimiter:
+                out.write(b'{"type":"delimiter"}\n')
+
+            elif res.line_text is not None:
+                lines_count += 1
+                if res.is_match:
+                    file_matches += 1
+                    matches_count += 1
+                    cols = b','.join([b'[%d,%d]' % (start, length) for start, length in res.line_cols])
+                    if res.pattern_ids is None:
+                        patterns = b''
+                    else:
+                        patterns = b',"patterns":[%s]' % b','.join(
+                            [b'null' if pattern_id is None else b'%d' % pattern_id for pattern_id in res.pattern_ids])
+                    out.write(b'{"type":"match","path":%s,"line_number":%s,"text":%s,"cols":[%s]%s}\n' % (
+                        current_path, res.line_num, json_bytes(res.line_text), cols, patterns))
+                else:
+                    out.write(b'{"type":"context","path":%s,"line_number":%s,"text":%s}\n' % (
+                        current_path, res.line_num, json_bytes(res.line_text)))
+                out.end_line()
+
+            yield res
+
+        out.flush()
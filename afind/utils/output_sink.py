@@ -0,0 +1,43 @@
+from __future__ import unicode_literals, print_function
+import sys
+
+
+class OutputSink(object):
+    '''
+    Gathers output fragments and writes them to stream in large blocks:
+    when buffer grows above BUFFER_SIZE and when output of one file is finished.
+    Interactive terminal gets every finished line at once, so results appear without delay
+    '''
+
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, stream=None, buffer_size=None, interactive=None):
+        self._stream = stream or sys.stdout
+        self._buffer_size = self.BUFFER_SIZE if buffer_size is None else buffer_size
+        self._parts = []
+        self._size = 0
+        self.bytes_written = 0
+
+        if interactive is None:
+            isatty = getattr(self._stream, 'isatty', None)
+            interactive = bool(isatty and isatty())
+        self.interactive = interactive
+
+    def write(self, *parts):
+        self._parts.extend(parts)
+        self._size += sum(len(part) for part in parts)
+
+    def end_line(self):
+        if self.interactive or self._size >= self._buffer_size:
+            self.flush()
+
+    def end_file(self):
+        self.flush()
+
+    def flush(self):
+        if self._parts:
+            self._stream.write(b''.join(self._parts))
+            self.bytes_written += self._size
+            self._parts = []
+            self._size = 0
+        self._stream.flush()
@@ -0,0 +1,201 @@
+from __future__ import unicode_literals, print_function
+import re
+import sys
+from collections import OrderedDict
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from afind.utils.file_writer import write_atomic
+
+
+class PatchError(Exception):
+    pass
+
+
+class Hunk(object):
+
+    def __init__(self, number, old_start, old_count):
+        self.number = number
+        self.old_start = old_start
+        self.old_count = old_count
+        self.old_lines = []
+        self.new_lines = []
+
+
+class PatchApplier(object):
+    '''
+    Applies unified diff, like ones PatchFormatter makes, without external utility.
+    Every file is read once, context of all its hunks is verified before anything is written.
+    Files are processed in parallel and written only if all of them can be patched.
+    '''
+
+    HUNK_HEADER_RE = re.compile(br'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+    # how far from position in hunk header its context is looked for
+    MAX_OFFSET = 100
+
+    def __init__(self, strip=1, workers=None):
+        self.strip = strip
+        self.workers = workers or min(32, cpu_count() * 2)
+
+    def parse(self, data):
+        """
+        Return OrderedDict: filename -> list of hunks
+        """
+        lines = data.split(b'\n')
+        if lines and not lines[-1]:
+            lines.pop()
+
+        files = OrderedDict()
+        hunks = None
+        i = 0
+
+        while i < len(lines):
+            line = lines[i]
+
+            if line.startswith(b'--- ') and i + 1 < len(lines) and lines[i + 1].startswith(b'+++ '):
+                filename = self._strip_path(lines[i + 1][4:])
+                hunks = files.setdefault(filename, [])
+                i += 2
+                continue
+
+            header = self.HUNK_HEADER_RE.match(line)
+            if not header:
+                i += 1
+                continue
+
+            if hunks is None:
+                raise PatchError('hunk without file header at line {}'.format(i + 1))
+
+            old_start, old_count = int(header.group(1)), header.group(2)
+            hunk = Hunk(len(hunks) + 1, old_start, int(old_count) if old_count is not None else 1)
+            hunks.append(hunk)
+            i = self._parse_hunk(lines, i + 1, hunk)
+
+        return files
+
+    def _parse_hunk(self, lines, i, hunk):
+        old_left = hunk.old_count
+
+        while i < len(lines):
+            line = lines[i]
+
+            # rest of lines are added ones, "\\ No newline at end of file" markers are skipped
+            if not old_left and not line.startswith(b'+') and not line.startswith(b'\\'):
+                break
+
+            tag, text = line[:1], line[1:]
+
+            if tag == b' ' or not line:
+                hunk.old_lines.append(text)
+                hunk.new_lines.append(text)
+                old_left -= 1
+            elif tag == b'-':
+                hunk.old_lines.append(text)
+                old_left -= 1
+            elif tag == b'+':
+                hunk.new_lines.append(text)
+            elif tag != b'\\':
+                raise PatchError('malformed line {} in hunk #{}'.format(i + 1, hunk.number))
+
+            i += 1
+
+        if old_left:
+            raise PatchError('hunk #{} is truncated'.format(hunk.number))
+
+        return i
+
+    def _strip_path(self, path):
+        path = path.split(b'\t')[0].strip()
+        parts = path.split(b'/')
+        return b'/'.join(parts[self.strip:]) if len(parts) > self.strip else parts[-1]
+
+    def patch_file(self, filename, hunks):
+        """
+        Return new content of file with all hunks applied, None if content stays the same
+        """
+        try:
+            with open(filename, 'rb') as f:
+                lines = f.read().split(b'\n')
+        except (IOError, OSError) as e:
+            raise PatchError(e.strerror or str(e))
+
+        result = []
+        cursor = 0
+
+        for hunk in hunks:
+            pos = self._find_hunk(lines, hunk, cursor)
+            result += lines[cursor:pos] + hunk.new_lines
+            cursor = pos + len(hunk.old_lines)
+
+        result += lines[cursor:]
+        return b'\n'.join(result) if result != lines else None
+
+    def _find_hunk(self, lines, hunk, min_pos):
+        # header of hunk without old lines refers to line after which new lines are added
+        expected = hunk.old_start - 1 if hunk.old_lines else hunk.old_start
+        count = len(hunk.old_lines)
+
+        for offset in range(self.MAX_OFFSET + 1):
+            for pos in ((expected + offset, expected - offset) if offset else (expected,)):
+                if min_pos <= pos <= len(lines) - count and lines[pos:pos + count] == hunk.old_lines:
+                    return pos
+
+        raise PatchError('hunk #{} context mismatch at line {}'.format(hunk.number, hunk.old_start))
+
+    def _prepare(self, item):
+        filename, hunks = item
+        try:
+            return filename, self.patch_file(filename, hunks), None
+        except PatchError as e:
+            # errors are byte strings: strerror can be localized and non-ASCII
+            return filename, None, str(e)
+
+    def _write(self, item):
+        filename, data = item
+        if data is None:
+            return None
+        try:
+            write_atomic(filename, data)
+            return None
+        except (IOError, OSError) as e:
+            return e.strerror or str(e)
+
+    def apply(self, patch_filename, dry_run=False):
+        """
+        Apply patch and print per-file report, return True on success
+        In dry run files are only checked
+        """
+        try:
+            with open(patch_filename, 'rb') as f:
+                files = self.parse(f.read())
+        except (IOError, OSError, PatchError) as e:
+            sys.stderr.write(b'@afind patch-error: ' + str(e) + b'\n')
+            return False
+
+        written = False
+        pool = ThreadPool(self.workers)
+        try:
+            prepared = pool.map(self._prepare, files.items())
+            failed = [(filename, error) for filename, _, error in prepared if error]
+
+            if not failed and not dry_run:
+                errors = pool.map(self._write, [(filename, data) for filename, data, _ in prepared])
+                failed = [(filename, error) for (filename, _, _), error in zip(prepared, errors) if error]
+                written = True
+        finally:
+            pool.close()
+
+        failed = OrderedDict(failed)
+        action = b'checking' if dry_run else b'patching'
+
+        for filename, _, _ in prepared:
+            if filename in failed:
+                sys.stderr.write(b'@afind patch-error: ' + filename + b': ' + failed[filename] + b'\n')
+            elif dry_run or written:
+                sys.stdout.write(action + b' file ' + filename + b'\n')
+
+        if failed:
+            note = '' if written else ', nothing was changed'
+            sys.stderr.write('@afind patch: {} of {} files failed{}\n'.format(len(failed), len(prepared), note))
+
+        return not failed
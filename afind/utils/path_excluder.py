@@ -0,0 +1,304 @@
+from __future__ import unicode_literals, print_function
+import os
+import re
+import marshal
+import sre_parse
+import sre_constants
+from afind.utils.files_walker import glob_to_regex
+
+
+# -nG PATTERN is regex, prefixes choose other forms
+GLOB_PREFIX  = 'glob:'
+REGEX_PREFIX = 're:'
+
+# files which make backends skip paths, children of directory with them can't be given to backend
+# as search roots: it would search them even if they are ignored
+IGNORE_FILES = [b'.git', b'.gitignore', b'.agignore', b'.ignore', b'.rgignore', b'.hgignore']
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'afind', 'excludes')
+CACHE_NAME = 'rules'
+
+# bumped when analysis of rules changes, so older cached rule sets are never read
+RULES_VERSION = 1
+
+# rule sets of that many last -nG combinations are cached, older ones are dropped
+MAX_RULE_SETS = 32
+
+# tuple of -nG specs -> PathExcluder, excluders depend on specs only, daemon keeps them for requests
+_excluders = {}
+
+# assertions which look at text after the match, with them a match in directory path
+# doesn't mean that paths of all its files match too
+_FORWARD_ASSERTIONS = {
+    sre_constants.AT_END, sre_constants.AT_END_LINE, sre_constants.AT_END_STRING,
+    sre_constants.AT_BOUNDARY, sre_constants.AT_NON_BOUNDARY,
+}
+
+# marks in trie nodes: excluded are all paths starting with the prefix / only path equal to it
+_PREFIX_END = None
+_EXACT_END  = b''
+
+# state of directory in trie: it is excluded entirely
+EXCLUDED = object()
+
+
+def _has_forward_assertions(items):
+    for item in items:
+        if isinstance(item, sre_parse.SubPattern):
+            for op, av in item:
+                if op == sre_constants.AT and av in _FORWARD_ASSERTIONS:
+                    return True
+                if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT) and av[0] >= 0:
+                    return True
+                if isinstance(av, (list, tuple)) and _has_forward_assertions(av):
+                    return True
+        elif isinstance(item, (list, tuple)) and _has_forward_assertions(item):
+            return True
+    return False
+
+
+def _literal_prefix(parsed):
+    """
+    Return text of regex which is only ^ and literal characters, None for any other regex
+    """
+    items = list(parsed)
+    if not items or items[0] != (sre_constants.AT, sre_constants.AT_BEGINNING):
+        return None
+    if not all(op == sre_constants.LITERAL for op, _ in items[1:]):
+        return None
+    return ''.join('%c' % av for _, av in items[1:])
+
+
+def parse_rule(spec):
+    """
+    Return analysed rule of -nG param:
+    (regex, regex for directories or None if they can't be pruned by it, trie prefix, is trie prefix exact,
+     glob matched against every path component or None)
+    """
+    if spec.startswith(GLOB_PREFIX):
+        glob = spec[len(GLOB_PREFIX):].strip('/')
+        body = glob_to_regex(glob)
+
+        if '/' not in glob:
+            # like in .gitignore: matches any file or directory name
+            return '(?:^|/)' + body + r'(?:/|\Z)', '(?:^|/)' + body + '/', None, False, glob
+        if not any(char in glob for char in '*?['):
+            return None, None, glob, True, None
+        return '^' + body + r'(?:/|\Z)', '^' + body + '/', None, False, None
+
+    if spec.startswith(REGEX_PREFIX):
+        spec = spec[len(REGEX_PREFIX):]
+
+    parsed = sre_parse.parse(spec)
+    prefix = _literal_prefix(parsed)
+    if prefix:
+        return None, None, prefix, False, None
+
+    return spec, (None if _has_forward_assertions([parsed]) else spec), None, False, None
+
+
+def load_rules(specs, cache_dir=None):
+    """
+    Return analysed rules of specs, rule sets of last MAX_RULE_SETS specs are kept between runs
+    in one cache file, which is rewritten in place when new specs are added
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    path = os.path.join(cache_dir, CACHE_NAME)
+    key = (RULES_VERSION,) + tuple(specs)
+
+    try:
+        with open(path, 'rb') as f:
+            rule_sets = marshal.load(f)
+        for set_key, rules in rule_sets:
+            if set_key == key:
+                return rules
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        rule_sets = []
+
+    rules = [parse_rule(spec) for spec in specs]
+    rule_sets = [(set_key, set_rules) for set_key, set_rules in rule_sets if set_key[:1] == (RULES_VERSION,)]
+    rule_sets = rule_sets[-(MAX_RULE_SETS - 1):] + [(key, rules)]
+
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            marshal.dump(rule_sets, f)
+        os.rename(tmp_path, path)
+
+        # earlier versions kept a file per rule set
+        for name in os.listdir(cache_dir):
+            if name != CACHE_NAME and not name.endswith('.tmp'):
+                os.remove(os.path.join(cache_dir, name))
+    except (IOError, OSError):
+        pass
+
+    return rules
+
+
+def _join_regexes(sources):
+    sources = [source for source in sources if source is not None]
+    if not sources:
+        return None
+    return '|'.join('(?:' + source + ')' for source in sources)
+
+
+class PathExcluder(object):
+    '''
+    Decides which paths -nG params exclude from search. Params can be:
+        re:REGEX or REGEX - path is excluded if regex matches any part of it
+        glob:NAME         - file or directory with matching name is excluded anywhere
+        glob:DIR/PATH     - glob matched from start of path, it excludes all files below too
+    Rules which are literal path prefixes (^src/vendor, glob:src/vendor) are kept in trie of characters,
+    trie node of every directory is found once, so files are checked only against rest of their names.
+    Other rules make one regex. Directories matched by rules are pruned, regexes which look beyond
+    the match (end anchors, lookaheads, word boundaries) can't prune directories and are checked for files
+    '''
+
+    def __init__(self, specs, cache_dir=None):
+        self.specs = list(specs)
+        self.rules = load_rules(self.specs, cache_dir)
+
+        self._trie = {}
+        for _, _, prefix, is_exact, _ in self.rules:
+            if prefix is not None:
+                self._add_prefix(prefix.encode('utf-8'), is_exact)
+
+        rx = _join_regexes(rule[0] for rule in self.rules)
+        self._rx = re.compile(rx.encode('utf-8')) if rx else None
+        dir_rx = _join_regexes(rule[1] for rule in self.rules)
+        self._dir_rx = re.compile(dir_rx.encode('utf-8')) if dir_rx else None
+
+        # directory path -> its trie node, EXCLUDED or None if no prefix starts with it
+        self._dir_nodes = {b'': self._trie}
+
+    @classmethod
+    def from_params(cls, afind_params):
+        """
+        Return excluder of -nG params, None if there are none
+        """
+        specs = afind_params.get('-nG')
+        if not specs:
+            return None
+        if tuple(specs) not in _excluders:
+            _excluders[tuple(specs)] = cls(specs)
+        return _excluders[tuple(specs)]
+
+    def _add_prefix(self, prefix, is_exact):
+        node = self._trie
+        for i in range(len(prefix)):
+            node = node.setdefault(prefix[i:i + 1], {})
+        if is_exact:
+            # exact path and everything below it
+            node[_EXACT_END] = True
+            node = node.setdefault(b'/', {})
+        node[_PREFIX_END] = True
+
+    def _walk_trie(self, node, text):
+        """
+        Return trie node after text, EXCLUDED if text passes end of prefix, None if no prefix continues text
+        """
+        for i in range(len(text)):
+            if _PREFIX_END in node:
+                return EXCLUDED
+            node = node.get(text[i:i + 1])
+            if node is None:
+                return None
+        return EXCLUDED if _PREFIX_END in node else node
+
+    def _get_dir_node(self, dirpath):
+        node = self._dir_nodes.get(dirpath, self)
+        if node is not self:
+            return node
+
+        parent, _, name = dirpath.rpartition(b'/')
+        node = self._get_dir_node(parent)
+        if node is not None and node is not EXCLUDED:
+            node = self._walk_trie(node, name + b'/')
+        self._dir_nodes[dirpath] = node
+        return node
+
+    def is_dir_excluded(self, dirpath):
+        """
+        Directory is excluded with everything in it
+        """
+        if self._get_dir_node(dirpath) is EXCLUDED:
+            return True
+        return self._dir_rx is not None and self._dir_rx.search(dirpath + b'/') is not None
+
+    def is_excluded(self, path):
+        dirpath, _, name = path.rpartition(b'/')
+        node = self._get_dir_node(dirpath)
+        if node is EXCLUDED:
+            return True
+
+        if node is not None:
+            node = self._walk_trie(node, name)
+            if node is EXCLUDED or (node is not None and _EXACT_END in node):
+                return True
+
+        return self._rx is not None and self._rx.search(path) is not None
+
+    @property
+    def glob_names(self):
+        """
+        Globs of file and directory names, backends can skip them by themselves
+        """
+        return [rule[4] for rule in self.rules if rule[4] is not None]
+
+    def get_regex(self, with_glob_names=True, with_prefixes=True):
+        """
+        Return bytes regex of rules for backends, None if there are no such rules
+        """
+        sources = [rule[0] for rule in self.rules if rule[0] is not None and (with_glob_names or rule[4] is None)]
+        if with_prefixes:
+            sources += ['^' + re.escape(rule[2]) + ('(?:/|\\Z)' if rule[3] else '')
+                        for rule in self.rules if rule[2] is not None]
+        rx = _join_regexes(sources)
+        return rx.encode('utf-8') if rx is not None else None
+
+    def split_roots(self, roots, hidden=False):
+        """
+        Return (roots, is_complete): search roots where directories which contain excluded prefixes
+        are replaced by their entries, so backend doesn't have to filter by prefixes.
+        is_complete is False if some directory couldn't be split because of ignore files in it,
+        then prefix rules still have to be applied by backend
+        """
+        result = []
+        is_complete = True
+
+        for root in (roots or [b'.']):
+            root = root.rstrip(b'/') or b'/'
+            display = b'' if root == b'.' else root
+
+            if not os.path.isdir(root):
+                if not display or not self.is_excluded(display):
+                    result.append(root)
+                continue
+
+            node = self._get_dir_node(display) if display else self._trie
+            if node is EXCLUDED:
+                continue
+            if node is None or not node:
+                result.append(root)
+                continue
+
+            try:
+                names = sorted(os.listdir(root))
+            except OSError:
+                result.append(root)
+                continue
+
+            if any(name in IGNORE_FILES for name in names):
+                result.append(root)
+                is_complete = False
+                continue
+
+            children = [os.path.join(display, name) if display else name
+                        for name in names if hidden or not name.startswith(b'.')]
+            child_roots, is_child_complete = self.split_roots(children, hidden) if children else ([], True)
+            result += child_roots
+            is_complete = is_complete and is_child_complete
+
+        return result, is_complete
@@ -0,0 +1,96 @@
+from __future__ import unicode_literals, print_function
+import io
+from collections import OrderedDict
+
+
+# characters with special meaning in regexes of every backend
+REGEX_SPECIAL_CHARS = set('\\.^$|?*+()[]{}')
+
+# end of literal in trie
+_END = ''
+
+
+def load_patterns(filename):
+    """
+    Return literal patterns of file, one per line, in order of lines: {literal: pattern id}
+    Id is number of line, empty lines are skipped, repeated literal keeps the first id
+    """
+    patterns = OrderedDict()
+    with io.open(filename, encoding='utf-8') as f:
+        for line_num, line in enumerate(f, 1):
+            literal = line.rstrip('\r\n')
+            if literal and literal not in patterns:
+                patterns[literal] = line_num
+    return patterns
+
+
+def _escape(char):
+    return '\\' + char if char in REGEX_SPECIAL_CHARS else char
+
+
+def _trie_regex(node):
+    alternatives = [_escape(char) + _trie_regex(child) for char, child in sorted(node.items()) if char != _END]
+    if not alternatives:
+        return ''
+    if len(alternatives) == 1 and _END not in node:
+        return alternatives[0]
+
+    regex = '(?:' + '|'.join(alternatives) + ')'
+    # greedy optional tail: the longest literal matches, like in ag/rg
+    return regex + '?' if _END in node else regex
+
+
+def literals_regex(literals):
+    """
+    Return one regex matching any of literals, which all backends understand.
+    Literals are merged by common prefixes, so regex engines don't try every literal at every position
+    """
+    trie = {}
+    for literal in literals:
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        node[_END] = {}
+    return _trie_regex(trie)
+
+
+class PatternsTagger(object):
+    '''
+    Sets pattern_ids of matched lines: id of pattern for every column of line_cols,
+    None if matched text is none of patterns. Counts hits of every pattern
+    '''
+
+    def __init__(self, results_stream, patterns, ignore_case=False):
+        self._results_stream = results_stream
+        self._ignore_case = ignore_case
+        # matched bytes -> id
+        self._ids = {}
+        for literal, pattern_id in patterns.items():
+            self._ids.setdefault(self._key(literal.encode('utf-8')), pattern_id)
+        # pattern id -> amount of matches
+        self.hits = OrderedDict((pattern_id, 0) for pattern_id in patterns.values())
+        self._literals = dict((pattern_id, literal) for literal, pattern_id in patterns.items())
+
+    def _key(self, text):
+        return text.lower() if self._ignore_case else text
+
+    def __iter__(self):
+        ids = self._ids
+        hits = self.hits
+
+        for res in self._results_stream:
+            if res.is_match:
+                line_text = res.line_text
+                res.pattern_ids = [ids.get(self._key(line_text[start:start + length]))
+                                   for start, length in res.line_cols]
+                for pattern_id in res.pattern_ids:
+                    if pattern_id is not None:
+                        hits[pattern_id] += 1
+            yield res
+
+    def format_summary(self):
+        found_count = sum(1 for count in self.hits.values() if count)
+        lines = ['@afind patterns: {} of {} found'.format(found_count, len(self.hits))]
+        for pattern_id, count in self.hits.items():
+            lines.append('{:>8} {:>6}  {}'.format(count, '#{}'.format(pattern_id), self._literals[pattern_id]))
+        return '\n'.join(lines) + '\n'
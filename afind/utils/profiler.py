@@ -0,0 +1,136 @@
+from __future__ import unicode_literals, print_function
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+class StageStats(object):
+
+    FIELDS = ['wall', 'cpu', 'events', 'bytes_read', 'bytes_written', 'errors']
+
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.events = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.errors = 0
+
+    def as_dict(self):
+        return OrderedDict((field, getattr(self, field)) for field in self.FIELDS)
+
+
+class Profiler(object):
+    '''
+    Collects wall/CPU time and counters of search pipeline stages.
+    Stages wrapped one into another, like parser into formatter, get only their own time:
+    time spent in inner stage is subtracted from outer one.
+    Stages of different threads aren't told apart, time of ShardedParser workers goes to its stage
+    '''
+
+    STAGES = ['spawn', 'first_byte', 'read', 'parse', 'format', 'collect', 'post']
+
+    def __init__(self):
+        self.stages = OrderedDict((name, StageStats()) for name in self.STAGES)
+        self._time_started = time.time()
+        self._cpu_started = _cpu_time()
+        # [wall, cpu] spent in inner stages of every running measurement
+        self._nested = []
+
+    def add(self, stage, **counters):
+        stats = self.stages[stage]
+        for name, value in counters.items():
+            setattr(stats, name, getattr(stats, name) + value)
+
+    def _start(self):
+        self._nested.append([0.0, 0.0])
+        return time.time(), _cpu_time()
+
+    def _stop(self, stats, started):
+        wall, cpu = time.time() - started[0], _cpu_time() - started[1]
+        nested_wall, nested_cpu = self._nested.pop()
+        stats.wall += wall - nested_wall
+        stats.cpu += cpu - nested_cpu
+        if self._nested:
+            self._nested[-1][0] += wall
+            self._nested[-1][1] += cpu
+
+    @contextmanager
+    def measure(self, stage):
+        stats = self.stages[stage]
+        started = self._start()
+        try:
+            yield stats
+        finally:
+            self._stop(stats, started)
+
+    def wrap(self, stage, iterable):
+        """
+        Yield items of iterable, time of getting every item goes to stage
+        """
+        stats = self.stages[stage]
+        iterator = iter(iterable)
+
+        while True:
+            started = self._start()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._stop(stats, started)
+
+            stats.events += 1
+            yield item
+
+    def get_report(self):
+        return OrderedDict([
+            ('total', OrderedDict([
+                ('wall', time.time() - self._time_started),
+                ('cpu', _cpu_time() - self._cpu_started),
+            ])),
+            ('stages', OrderedDict((name, stats.as_dict()) for name, stats in self.stages.items())),
+        ])
+
+    def format_report(self):
+        report = self.get_report()
+        lines = ['@afind profile: {:.3f}s wall, {:.3f}s cpu'.format(report['total']['wall'], report['total']['cpu'])]
+        lines.append('  {:<12}{:>9}{:>9}{:>10}{:>12}{:>12}{:>8}'.format(
+            'stage', 'wall s', 'cpu s', 'events', 'read', 'written', 'errors'))
+
+        for name, stats in report['stages'].items():
+            lines.append('  {:<12}{:>9.3f}{:>9.3f}{:>10}{:>12}{:>12}{:>8}'.format(
+                name, stats['wall'], stats['cpu'], stats['events'],
+                stats['bytes_read'], stats['bytes_written'], stats['errors']))
+
+        return '\n'.join(lines) + '\n'
+
+    def save_report(self, filename):
+        import json
+        with open(filename, 'w') as f:
+            json.dump(self.get_report(), f, indent=2)
+
+
+class NullProfiler(object):
+    '''
+    Profiler which measures nothing, used when profiling is off
+    '''
+
+    def add(self, stage, **counters):
+        pass
+
+    @contextmanager
+    def measure(self, stage):
+        yield None
+
+    def wrap(self, stage, iterable):
+        return iterable
+
+
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,135 @@
+from __future__ import unicode_literals, print_function
+import sys
+from collections import OrderedDict
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from afind.utils.file_writer import AtomicBatchWriter, CommitError
+
+
+class ReplaceError(Exception):
+    pass
+
+
+class Replacer(object):
+    '''
+    Collects matched lines from results stream and rewrites them in place:
+    every match from line_cols is replaced by template, which can refer regex groups (\\1, \\g<name>)
+    '''
+
+    def __init__(self, results_stream, rx, template, is_literal=False, workers=None):
+        self._results_stream = results_stream
+        self._rx = rx
+        self._template = template.encode('utf-8')
+        self._is_literal = is_literal
+        self._workers = workers or min(32, cpu_count() * 2)
+        # filename -> {line number: result}
+        self._lines = OrderedDict()
+
+    def __iter__(self):
+        for res in self._results_stream:
+            if res.is_match:
+                self._lines.setdefault(res.filename, OrderedDict())[int(res.line_num)] = res
+            yield res
+
+    def replace_line(self, res):
+        """
+        Return text of result line with all matches replaced
+        """
+        line_text = res.line_text
+        parts = []
+        cursor = 0
+
+        for start, length in res.line_cols:
+            end = start + length
+            parts.append(line_text[cursor:start])
+
+            if self._is_literal:
+                parts.append(self._template)
+            else:
+                match = self._rx.match(line_text, start)
+                if not match or match.end() != end:
+                    raise ReplaceError('match at column {} can\'t be reproduced'.format(start))
+                parts.append(match.expand(self._template))
+
+            cursor = end
+
+        parts.append(line_text[cursor:])
+        return b''.join(parts)
+
+    def preview_line(self, res):
+        """
+        Same as replace_line, but original text is returned for lines which can't be replaced
+        """
+        try:
+            return self.replace_line(res)
+        except ReplaceError:
+            return res.line_text
+
+    def _replace_file(self, item):
+        filename, lines = item
+
+        try:
+            with open(filename, 'rb') as f:
+                file_lines = f.read().split(b'\n')
+
+            for line_num, res in lines.items():
+                if file_lines[line_num - 1:line_num] != [res.line_text]:
+                    raise ReplaceError('line {} was changed since search'.format(line_num))
+                file_lines[line_num - 1] = self.replace_line(res)
+
+            if not self._dry_run:
+                self._writer.add(filename, b'\n'.join(file_lines))
+        except (IOError, OSError) as e:
+            # errors are byte strings: strerror can be localized and non-ASCII
+            return filename, e.strerror or str(e)
+        except ReplaceError as e:
+            return filename, str(e)
+
+        return filename, None
+
+    def apply(self, dry_run=False):
+        """
+        Rewrite collected lines in all files, report and return True on success
+        Files are changed only if all of them can be rewritten, if renaming fails on the way,
+        files which were and weren't rewritten are reported
+        """
+        self._dry_run = dry_run
+        pool = ThreadPool(self._workers)
+        self._writer = AtomicBatchWriter(pool)
+        commit_error = None
+
+        try:
+            results = pool.map(self._replace_file, self._lines.items())
+            failed = [(filename, error) for filename, error in results if error]
+
+            if failed:
+                self._writer.rollback()
+            else:
+                try:
+                    self._writer.commit()
+                except CommitError as e:
+                    commit_error = e
+        finally:
+            pool.close()
+
+        for filename, error in failed:
+            sys.stderr.write(b'@afind replace-error: ' + filename + b': ' + error + b'\n')
+
+        if commit_error:
+            for filename in commit_error.renamed:
+                sys.stderr.write(b'@afind replace-error: ' + filename + b': rewritten\n')
+            for filename in commit_error.not_renamed:
+                sys.stderr.write(b'@afind replace-error: ' + filename + b': not rewritten\n')
+            sys.stderr.write('@afind replace: {} of {} files rewritten before error: '.format(
+                len(commit_error.renamed), len(self._lines)).encode('utf-8') + commit_error.strerror + b'\n')
+            return False
+
+        lines_count = sum(len(lines) for lines in self._lines.values())
+        if failed:
+            sys.stderr.write('@afind replace: {} of {} files failed, nothing was changed\n'.format(
+                len(failed), len(self._lines)))
+        else:
+            action = 'would replace' if dry_run else 'replaced'
+            sys.stderr.write('@afind replace: {} {} lines in {} files\n'.format(action, lines_count, len(self._lines)))
+
+        return not failed
@@ -0,0 +1,165 @@
+from __future__ import unicode_literals, print_function
+import os
+import json
+import time
+import marshal
+import hashlib
+from afind.backends._base import ParseResult
+
+
+class ResultCache(object):
+    '''
+    On-disk cache of results streams
+    Entry is marshaled list of results, its mtime is time of last use, which drives LRU eviction
+    '''
+
+    DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'afind', 'results')
+
+    # total size of entries, least recently used ones are removed above it
+    MAX_SIZE = 64 * 1024 * 1024
+
+    # directory mtimes don't reflect in-place file changes, so entries are trusted only for a while
+    MAX_AGE = 300
+
+    # bumped when layout of stored results changes, so older entries are never read
+    RECORDS_VERSION = 3
+
+    def __init__(self, cache_dir=None, max_size=None, max_age=None):
+        # $AFIND_CACHE_DIR is shared with backend probe and blobs cache, entries have own directory in it
+        cache_dir = cache_dir or os.environ.get('AFIND_CACHE_DIR')
+        self.cache_dir = os.path.join(cache_dir, 'results') if cache_dir else self.DEFAULT_DIR
+        self.max_size = max_size or self.MAX_SIZE
+        self.max_age = max_age or int(os.environ.get('AFIND_CACHE_TTL', self.MAX_AGE))
+        self.last_status = None
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    @classmethod
+    def make_key(cls, *parts):
+        return hashlib.sha1(json.dumps([cls.RECORDS_VERSION, parts], sort_keys=True).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def tree_fingerprint(paths, hidden=False):
+        """
+        Cheap fingerprint of searched paths: mtimes of all their directories
+        Hidden directories are skipped unless they are searched too, .git is never searched
+        """
+        digest = hashlib.sha1()
+
+        for root in (paths or ['.']):
+            root = root.encode('utf-8')
+            try:
+                digest.update(root + repr(os.stat(root).st_mtime).encode('ascii'))
+            except OSError:
+                continue
+
+            for dirpath, dirnames, _ in os.walk(root):
+                dirnames[:] = sorted(d for d in dirnames if d != b'.git' and (hidden or not d.startswith(b'.')))
+                for name in dirnames:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        digest.update(path + repr(os.stat(path).st_mtime).encode('ascii'))
+                    except OSError:
+                        continue
+
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Return iterator over cached results, None if there is no fresh entry
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                created, records = marshal.load(f)
+            if time.time() - created > self.max_age:
+                raise ValueError('outdated entry')
+            # mark entry as recently used
+            os.utime(path, None)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            self._count('misses')
+            return None
+
+        self._count('hits')
+        return (_load_result(record) for record in records)
+
+    def record(self, key, results_stream):
+        """
+        Pass results through and store them once stream is finished
+        """
+        records = []
+        for res in results_stream:
+            records.append(_dump_result(res))
+            yield res
+
+        self._store(key, records)
+
+    def _store(self, key, records):
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+
+            data = marshal.dumps((time.time(), records))
+            if len(data) > self.max_size // 4:
+                return
+
+            tmp_path = self._path(key + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.rename(tmp_path, self._path(key))
+
+            self._evict()
+        except (IOError, OSError):
+            pass
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name == 'stats' or name.endswith('.tmp'):
+                continue
+            st = os.stat(self._path(name))
+            entries.append((st.st_mtime, st.st_size, name))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            os.remove(self._path(name))
+            total_size -= size
+
+    def stats(self):
+        try:
+            with open(self._path('stats')) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {'hits': 0, 'misses': 0}
+
+    def _count(self, counter):
+        self.last_status = 'hit' if counter == 'hits' else 'miss'
+        stats = self.stats()
+        stats[counter] = stats.get(counter, 0) + 1
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(self._path('stats'), 'w') as f:
+                json.dump(stats, f)
+        except (IOError, OSError):
+            pass
+
+
+_SHARED_RESULTS = dict((res.kind, res) for res in (
+    ParseResult.FILE_FINISHED, ParseResult.GROUP_DELIMITER, ParseResult.RESULTS_FINISHED,
+))
+
+
+def _dump_result(res):
+    if res.kind in _SHARED_RESULTS:
+        return res.kind
+    return (res.kind, res.filename, res.line_text, res.line_num, res.line_cols)
+
+
+def _load_result(record):
+    if not isinstance(record, tuple):
+        return _SHARED_RESULTS[record]
+    return ParseResult(*record)
@@ -1,5 +1,6 @@
 import sys
 from afind.utils.term_colors import TermColors
+from afind.utils.output_sink import OutputSink
 
 
 class DefaultColors(object):
@@ -7,81 +8,122 @@ class DefaultColors(object):
     FILENAME = TermColors.make_flags(TermColors.green,  bold=True)
     LINENUM  = TermColors.make_flags(TermColors.yellow, bold=True)
     MATCH    = TermColors.make_flags(TermColors.black,  bg=TermColors.yellow)
+    # matches of --patterns-file, color is chosen by pattern id
+    PATTERN_MATCHES = [
+        TermColors.make_flags(TermColors.black, bg=TermColors.yellow),
+        TermColors.make_flags(TermColors.black, bg=TermColors.cyan),
+        TermColors.make_flags(TermColors.black, bg=TermColors.magenta),
+        TermColors.make_flags(TermColors.black, bg=TermColors.green),
+        TermColors.make_flags(TermColors.white, bg=TermColors.blue),
+        TermColors.make_flags(TermColors.white, bg=TermColors.red),
+    ]
 
 
 
 class FormatterBase(object):
 
-    def __init__(self, results_stream, colors=None):
+    def __init__(self, results_stream, colors=None, sink=None):
         self._results_stream = results_stream
         self._colors = colors or DefaultColors()
+        self._sink = sink or OutputSink(sys.stdout)
 
 
 class TtyFormatter(FormatterBase):
 
+    def _get_pattern_color(self, pattern_id):
+        if pattern_id is None:
+            return self._colors.MATCH
+        colors = self._colors.PATTERN_MATCHES
+        return colors[(pattern_id - 1) % len(colors)]
+
     def __iter__(self):
         c = self._colors
+        out = self._sink
 
         for res in self._results_stream:
             if res.is_file_finished:
-                sys.stdout.write(b'\n')
+                out.write(b'\n')
+                out.end_file()
 
             elif res.is_title:
-                sys.stdout.write(c.FILENAME + res.filename.encode('utf-8') + c.RESET + b'\n')
+                out.write(c.FILENAME, res.filename, c.RESET, b'\n')
 
             elif res.is_group_delimiter:
-                sys.stdout.write(b'--\n')
+                out.write(b'--\n')
+
+            elif res.is_results_finished:
+                out.flush()
 
             elif res.line_text is not None:
-                suffix = b':' if res.line_cols else b'-'
-                sys.stdout.write(c.LINENUM + res.line_num.encode('utf-8') + suffix + c.RESET)
+                suffix = b':' if res.is_match else b'-'
+                out.write(c.LINENUM, res.line_num, suffix, c.RESET)
 
-                line_text = res.line_text.encode('utf-8')
+                line_text = res.line_text
+                pattern_ids = res.pattern_ids
                 cursor = 0
-                for start, length in res.line_cols:
+                for i, (start, length) in enumerate(res.line_cols):
                     end = start + length
-                    sys.stdout.write(line_text[cursor:start])
-                    sys.stdout.write(c.MATCH + line_text[start:end] + c.RESET)
+                    match_color = c.MATCH if pattern_ids is None else self._get_pattern_color(pattern_ids[i])
+                    out.write(line_text[cursor:start], match_color, line_text[start:end], c.RESET)
                     cursor = end
-                sys.stdout.write(line_text[cursor:] + b'\n')
+                out.write(line_text[cursor:], b'\n')
+                out.end_line()
 
             yield res
 
+        out.flush()
+
 
 
 class PipeFormatter(FormatterBase):
 
     def __iter__(self):
-        current_filename = ''
+        current_filename = b''
+        out = self._sink
 
         for res in self._results_stream:
             if res.is_file_finished:
-                pass
+                out.end_file()
 
             elif res.is_title:
-                current_filename = res.filename.encode('utf-8')
+                current_filename = res.filename
 
             elif res.is_group_delimiter:
-                sys.stdout.write(b'--\n')
+                out.write(b'--\n')
+
+            elif res.is_results_finished:
+                out.flush()
 
             elif res.line_text is not None:
-                prefix = b':' if res.line_cols else b'-'
-                sys.stdout.write(current_filename + b':')
-                sys.stdout.write(res.line_num.encode('utf-8') + prefix + res.line_text.encode('utf-8'))
-                sys.stdout.write(b'\n')
-            
+                prefix = b':' if res.is_match else b'-'
+                out.write(current_filename, b':', res.line_num, prefix, res.line_text, b'\n')
+                out.end_line()
+
             yield res
 
+        out.flush()
+
 
 
 class PatchBlock(object):
 
-    def __init__(self):
+    def __init__(self, line_transform=None, sink=None):
         self._results = []
+        self._line_transform = line_transform
+        self._sink = sink or OutputSink(sys.stdout)
 
     def add_result(self, result):
+        # lines which aren't adjacent can't share one hunk
+        if self._results and self._is_gap(self._results[-1], result):
+            self.flush()
         self._results.append(result)
 
+    def _is_gap(self, prev, result):
+        try:
+            return int(result.line_num) != int(prev.line_num) + 1
+        except (ValueError, TypeError):
+            return False
+
     def flush(self):
         if not self._results:
             return
@@ -90,7 +132,7 @@ class PatchBlock(object):
             first_line = int(self._results[0].line_num)
             last_line = int(self._results[-1].line_num)
             context_count = last_line - first_line + 1
-            sys.stdout.write(b'@@ -{0},{1} +{0},{1} @@\n'.format(first_line, context_count))
+            self._sink.write(b'@@ -{0},{1} +{0},{1} @@\n'.format(first_line, context_count))
 
         except (IndexError, ValueError, TypeError) as e:
             sys.stderr.write(b'@@ WRONG BLOCK @@\n')
@@ -98,35 +140,48 @@ class PatchBlock(object):
             return
 
         for res in self._results:
-            line_text = res.line_text.encode('utf-8')
+            line_text = res.line_text
 
-            if res.line_cols: # lines with matches
-                sys.stdout.write(b'-' + line_text + b'\n')
-                sys.stdout.write(b'+' + line_text + b'\n')
+            if res.is_match: # lines with matches
+                new_text = self._line_transform(res) if self._line_transform else line_text
+                self._sink.write(b'-', line_text, b'\n', b'+', new_text, b'\n')
             else: # context lines
-                sys.stdout.write(b' ' + line_text + b'\n')
+                self._sink.write(b' ', line_text, b'\n')
 
         self._results = []
+        self._sink.end_line()
 
 
 class PatchFormatter(FormatterBase):
 
+    def __init__(self, results_stream, colors=None, line_transform=None, sink=None):
+        '''
+        :param: line_transform - function returning new text of matched line for '+' lines of patch
+        '''
+        super(PatchFormatter, self).__init__(results_stream, colors, sink)
+        self._line_transform = line_transform
+
     def __iter__(self):
-        current_filename = ''
+        current_filename = b''
+        out = self._sink
 
-        block = PatchBlock()
+        block = PatchBlock(self._line_transform, out)
 
         for res in self._results_stream:
             if res.is_file_finished or res.is_group_delimiter or res.is_results_finished:
                 block.flush()
+                if not res.is_group_delimiter:
+                    out.end_file()
 
             elif res.is_title:
-                current_filename = res.filename.encode('utf-8')
-                sys.stdout.write(b'--- a/' + current_filename + b'\n')
-                sys.stdout.write(b'+++ b/' + current_filename + b'\n')
+                current_filename = res.filename
+                out.write(b'--- a/', current_filename, b'\n', b'+++ b/', current_filename, b'\n')
 
             elif res.line_text is not None:
                 block.add_result(res)
 
             yield res
 
+        block.flush()
+        out.flush()
+
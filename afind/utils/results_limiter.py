@@ -0,0 +1,94 @@
+from __future__ import unicode_literals, print_function
+from threading import Timer
+from afind.backends._base import ParseResult
+
+
+class ResultsLimiter(object):
+    '''
+    Passes results stream through until a match beyond --max-results, a file beyond --max-files or --deadline
+    comes, then stops the backend and finishes the stream: the last file is ended as usual
+    and RESULTS_FINISHED is given, so formatters complete their output. reached_limit tells if it was truncated,
+    so search with exactly --max-results matches isn't.
+    Deadline is watched by timer thread, as the stream can wait for backend output for long
+    '''
+
+    def __init__(self, results_stream, parser, max_results=None, max_files=None, deadline=None):
+        self._results_stream = results_stream
+        self._parser = parser
+        self.max_results = max_results
+        self.max_files = max_files
+        self.deadline = deadline
+
+        self.results_count = 0
+        self.files_count = 0
+        # param of reached limit, None while stream isn't truncated
+        self.reached_limit = None
+
+    def _on_deadline(self):
+        self.reached_limit = '--deadline'
+        self._parser.terminate()
+
+    def __iter__(self):
+        timer = None
+        if self.deadline is not None:
+            timer = Timer(self.deadline, self._on_deadline)
+            timer.daemon = True
+            timer.start()
+
+        # file separator is held till the next file, there is none after the last one
+        is_file_finished = False
+
+        try:
+            for res in self._iter_limited():
+                if res.is_file_finished:
+                    is_file_finished = True
+                    continue
+                if res.is_results_finished:
+                    break
+                if is_file_finished:
+                    is_file_finished = False
+                    yield ParseResult.FILE_FINISHED
+                yield res
+        finally:
+            if timer:
+                timer.cancel()
+                timer.join()
+
+        yield ParseResult.RESULTS_FINISHED
+
+    def _iter_limited(self):
+        results_stream = iter(self._results_stream)
+        # results after the last allowed match, they are given only if no match follows them
+        held = []
+        try:
+            for res in results_stream:
+                if self.reached_limit:
+                    break
+
+                if res.is_title:
+                    if self.max_files is not None and self.files_count >= self.max_files:
+                        self.reached_limit = '--max-files'
+                        break
+                    self.files_count += 1
+
+                if self.max_results is not None and self.results_count >= self.max_results:
+                    if res.is_match:
+                        self.reached_limit = '--max-results'
+                        break
+                    held.append(res)
+                    continue
+
+                yield res
+
+                if res.is_match:
+                    self.results_count += 1
+
+            if not self.reached_limit:
+                for res in held:
+                    yield res
+        finally:
+            if self.reached_limit:
+                self._parser.terminate()
+                close = getattr(results_stream, 'close', None)
+                if close:
+                    close()
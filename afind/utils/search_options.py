@@ -0,0 +1,156 @@
+from __future__ import unicode_literals, print_function
+import re
+
+
+class SearchOptions(object):
+    '''
+    Understands command line of ag-compatible backends:
+    search pattern, paths and options afind itself has to care about
+    '''
+
+    # short options followed by an argument
+    SHORT_WITH_ARG = 'ABCGgmpW'
+
+    # long options followed by an argument (if not given as --name=value)
+    LONG_WITH_ARG = {
+        '--after', '--before', '--depth', '--file-search-regex', '--ignore', '--ignore-dir',
+        '--max-count', '--pager', '--path-to-ignore', '--workers', '--color-line-number',
+        '--color-match', '--color-path',
+    }
+
+    SHORT_ALIASES = {
+        'A': '--after', 'B': '--before', 'C': '--context', 'G': '--file-search-regex',
+        'i': '--ignore-case', 's': '--case-sensitive', 'S': '--smart-case',
+        'Q': '--literal', 'w': '--word-regexp', 'u': '--unrestricted', 'a': '--all-types',
+        'U': '--skip-vcs-ignores', 'm': '--max-count', 't': '--all-text',
+    }
+
+    def __init__(self, parser_params):
+        self.params = list(parser_params)
+
+        self.pattern = None
+        self.paths = []
+        # (name, value) pairs, name is always long form
+        self.options = []
+        # tokens of self.params that are options or their arguments
+        self._option_tokens = []
+
+        self._parse()
+
+    def _parse(self):
+        params = list(self.params)
+        positional = []
+
+        while params:
+            token = params.pop(0)
+
+            if token == '--':
+                positional += params
+                break
+
+            elif token.startswith('--') and len(token) > 2:
+                tokens = [token]
+                name, _, value = token.partition('=')
+                if not _:
+                    value = None
+                    if name in self.LONG_WITH_ARG and params:
+                        value = params.pop(0)
+                        tokens.append(value)
+                self.options.append((name, value))
+                self._option_tokens += tokens
+
+            elif token.startswith('-') and len(token) > 1:
+                tokens = [token]
+                chars = token[1:]
+                while chars:
+                    char, chars = chars[0], chars[1:]
+                    name = self.SHORT_ALIASES.get(char, '-' + char)
+
+                    if char in self.SHORT_WITH_ARG:
+                        value = chars
+                        if not value and params:
+                            value = params.pop(0)
+                            tokens.append(value)
+                        self.options.append((name, value))
+                        break
+
+                    self.options.append((name, None))
+                self._option_tokens += tokens
+
+            else:
+                positional.append(token)
+
+        if positional:
+            self.pattern = positional[0]
+            self.paths = positional[1:]
+
+    def has(self, *names):
+        return any(name in names for name, _ in self.options)
+
+    def get(self, name, default=None):
+        for opt_name, value in reversed(self.options):
+            if opt_name == name:
+                return value
+        return default
+
+    def get_int(self, name, default=0):
+        value = self.get(name)
+        try:
+            return int(value) if value is not None else default
+        except ValueError:
+            return default
+
+    @property
+    def context_before(self):
+        return self.get_int('--before') if self.has('--before') else self._context()
+
+    @property
+    def context_after(self):
+        return self.get_int('--after') if self.has('--after') else self._context()
+
+    def _context(self):
+        if not self.has('--context'):
+            return 0
+        return self.get_int('--context', 2)
+
+    @property
+    def ignore_case(self):
+        """
+        Case rules of ag: smart case is default one
+        """
+        for name, _ in reversed(self.options):
+            if name == '--ignore-case':
+                return True
+            if name == '--case-sensitive':
+                return False
+            if name == '--smart-case':
+                break
+        return self.pattern is not None and self.pattern == self.pattern.lower()
+
+    def compile_pattern(self, flags=0):
+        """
+        Return compiled bytes regex equal to one backend would use
+        """
+        pattern = self.pattern.encode('utf-8')
+
+        if self.has('--literal'):
+            pattern = re.escape(pattern)
+        if self.has('--word-regexp'):
+            pattern = br'\b(?:' + pattern + br')\b'
+        if self.ignore_case:
+            flags |= re.IGNORECASE
+
+        return re.compile(pattern, flags | re.MULTILINE)
+
+    def with_paths(self, paths):
+        """
+        Return parser params where search paths are replaced by given ones
+        """
+        return self._option_tokens + ['--', self.pattern] + list(paths)
+
+    def with_pattern(self, pattern):
+        """
+        Return parser params searching given pattern, every positional param is a search path then
+        """
+        positional = [self.pattern] + self.paths if self.pattern is not None else []
+        return self._option_tokens + ['--', pattern] + positional
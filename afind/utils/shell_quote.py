@@ -1,7 +1,7 @@
 
 import re
 
-_find_unsafe = re.compile(r'[\"\'&|#()`<>+*;:\[\]\\ ]').search
+_find_unsafe = re.compile(r'[^\w@%+=:,./-]').search
 
 def quote(s):
     """Return a shell-escaped version of the string *s*."""
@@ -0,0 +1,224 @@
+from __future__ import unicode_literals, print_function
+import os
+import time
+import errno
+import select
+import struct
+
+
+# what makes file or directory changed for inotify
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC  = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+# wd, mask, cookie, length of name of struct inotify_event
+_EVENT_HEADER = struct.Struct(b'iIII')
+
+READ_SIZE = 64 * 1024
+
+
+class PollingWatcher(object):
+    '''
+    Finds changes by comparing mtimes and sizes of entries of watched directories every interval.
+    Works everywhere, but costs stat of every file of tree per interval
+    '''
+
+    NAME = 'polling'
+
+    INTERVAL = 1.0
+
+    def __init__(self, interval=None):
+        self.interval = interval or self.INTERVAL
+        # directory -> {name: (mtime, size)}
+        self._snapshots = {}
+
+    def _snapshot(self, dirpath):
+        snapshot = {}
+        try:
+            names = os.listdir(dirpath)
+        except OSError:
+            return snapshot
+
+        for name in names:
+            try:
+                st = os.stat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            snapshot[name] = (st.st_mtime, st.st_size)
+        return snapshot
+
+    def add_dir(self, dirpath):
+        self._snapshots[dirpath] = self._snapshot(dirpath)
+
+    def remove_dir(self, dirpath):
+        self._snapshots.pop(dirpath, None)
+
+    def wait(self, timeout=None):
+        """
+        Return {directory: set of names of changed entries} found within timeout, wait for them if it is None
+        """
+        while True:
+            time_started = time.time()
+            changes = self._poll()
+            if changes or (timeout is not None and timeout <= 0):
+                return changes
+
+            # polling of big tree takes a while itself
+            delay = max(self.interval - (time.time() - time_started), 0)
+            if timeout is not None:
+                delay = min(delay, timeout)
+                timeout -= time.time() - time_started + delay
+            time.sleep(delay)
+
+    def _poll(self):
+        changes = {}
+
+        for dirpath, old_snapshot in list(self._snapshots.items()):
+            snapshot = self._snapshot(dirpath)
+            if snapshot == old_snapshot:
+                continue
+            self._snapshots[dirpath] = snapshot
+            changes[dirpath] = set(
+                name for name in set(snapshot) | set(old_snapshot)
+                if snapshot.get(name) != old_snapshot.get(name)
+            )
+
+        return changes
+
+    def close(self):
+        self._snapshots = {}
+
+
+class InotifyWatcher(object):
+    '''
+    Gets changes of watched directories from Linux kernel, every directory needs own watch.
+    Raises OSError if inotify isn't available or its limits are reached
+    '''
+
+    NAME = 'inotify'
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library(b'c') or b'libc.so.6', use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not supported')
+
+        self._get_errno = ctypes.get_errno
+        self.fd = self._check(self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+
+        # watch descriptor -> directory and back
+        self._dirs = {}
+        self._wds = {}
+
+    def _check(self, result):
+        if result < 0:
+            error = self._get_errno()
+            raise OSError(error, os.strerror(error))
+        return result
+
+    def add_dir(self, dirpath):
+        wd = self._check(self._libc.inotify_add_watch(self.fd, dirpath, WATCH_MASK))
+        self._dirs[wd] = dirpath
+        self._wds[dirpath] = wd
+
+    def remove_dir(self, dirpath):
+        wd = self._wds.pop(dirpath, None)
+        if wd is not None:
+            self._dirs.pop(wd, None)
+            # directory can be gone with its watch already
+            self._libc.inotify_rm_watch(self.fd, wd)
+
+    def wait(self, timeout=None):
+        """
+        Return {directory: set of names of changed entries} found within timeout, wait for them if it is None.
+        Names are None if kernel dropped events, then anything in directory could change
+        """
+        changes = {}
+
+        try:
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return changes
+        if not readable:
+            return changes
+
+        data = b''
+        while True:
+            try:
+                chunk = os.read(self.fd, READ_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+            if not chunk:
+                break
+            data += chunk
+
+        pos = 0
+        while pos + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_length = _EVENT_HEADER.unpack_from(data, pos)
+            pos += _EVENT_HEADER.size
+            name = data[pos:pos + name_length].rstrip(b'\0')
+            pos += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                for dirpath in self._wds:
+                    changes[dirpath] = None
+                continue
+
+            dirpath = self._dirs.get(wd)
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                if dirpath is not None and self._wds.get(dirpath) == wd:
+                    del self._wds[dirpath]
+                continue
+            if dirpath is None or not name:
+                continue
+
+            names = changes.setdefault(dirpath, set())
+            if names is not None:
+                names.add(name)
+
+        return changes
+
+    def close(self):
+        os.close(self.fd)
+
+
+def create_watcher(dirs):
+    """
+    Return inotify watcher of directories, polling one if inotify can't watch them all
+    """
+    try:
+        watcher = InotifyWatcher()
+    except (OSError, AttributeError):
+        watcher = None
+
+    if watcher is not None:
+        try:
+            for dirpath in dirs:
+                watcher.add_dir(dirpath)
+            return watcher
+        except OSError:
+            watcher.close()
+
+    watcher = PollingWatcher()
+    for dirpath in dirs:
+        watcher.add_dir(dirpath)
+    return watcher
@@ -0,0 +1,608 @@
+from __future__ import unicode_literals, print_function
+import os
+import re
+import json
+import mmap
+import fcntl
+import struct
+import marshal
+import sre_parse
+import sre_constants
+from array import array
+from contextlib import contextmanager
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+from afind.utils.files_walker import filter_paths
+
+
+INDEX_DIR_NAME = '.afind-index'
+
+# absolute index directory -> TrigramIndex opened by open_index(), the most recently used last
+_opened = OrderedDict()
+MAX_OPENED = 8
+
+# extract all trigrams from buffer in three passes of non-overlapping chunks
+_TRIGRAM_RE = re.compile(b'...', re.DOTALL)
+
+# lookup entry: trigram, offset of postings, amount of file ids, array typecode of deltas
+_ENTRY = struct.Struct(b'<3sQIc')
+
+# typecodes of delta arrays by max value they can hold
+_DELTA_TYPECODES = [(0xFF, b'B'), (0xFFFF, b'H'), (0xFFFFFFFF, b'I')]
+
+
+def file_trigrams(path):
+    """
+    Return set of lowercase trigrams of file content, None for unreadable and binary files
+    """
+    try:
+        with open(path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return set()
+            data = f.read()
+    except (IOError, OSError):
+        return None
+
+    if b'\0' in data[:512]:
+        return None
+
+    data = data.lower()
+    trigrams = set()
+    for shift in (0, 1, 2):
+        trigrams.update(_TRIGRAM_RE.findall(data, shift))
+    return trigrams
+
+
+def _file_trigrams_worker(path):
+    trigrams = file_trigrams(path)
+    return path, sorted(trigrams) if trigrams is not None else None
+
+
+def encode_postings(file_ids):
+    """
+    Delta-encode sorted file ids into array of the smallest suitable type
+    Return (typecode, bytes)
+    """
+    deltas = [file_ids[0]] + [b - a for a, b in zip(file_ids, file_ids[1:])]
+    max_delta = max(deltas)
+    typecode = next(tc for limit, tc in _DELTA_TYPECODES if max_delta <= limit)
+    return typecode, array(str(typecode.decode('ascii')), deltas).tostring()
+
+
+def decode_postings(typecode, data):
+    deltas = array(str(typecode.decode('ascii')))
+    deltas.fromstring(data)
+
+    file_ids = []
+    current = 0
+    for delta in deltas:
+        current += delta
+        file_ids.append(current)
+    return file_ids
+
+
+def required_literals(pattern, is_literal=False):
+    """
+    Return alternatives of literal strings which any match of pattern must contain:
+    [[b'foo', b'bar'], [b'baz']] means (foo AND bar) OR baz
+    None means that literals can't be extracted and full scan is required
+    """
+    if is_literal:
+        alternatives = [[pattern.lower()]]
+    else:
+        try:
+            alternatives = _sequence_alternatives(list(sre_parse.parse(pattern)))
+        except (sre_constants.error, OverflowError):
+            return None
+
+    if not alternatives or any(not any(len(lit) >= 3 for lit in alt) for alt in alternatives):
+        return None
+    return alternatives
+
+
+def _sequence_alternatives(items):
+    # whole pattern is alternation: a|b|c
+    if len(items) == 1 and items[0][0] == sre_constants.BRANCH:
+        alternatives = []
+        for branch in items[0][1][1]:
+            branch_alternatives = _sequence_alternatives(list(branch))
+            if not branch_alternatives:
+                return None
+            alternatives += branch_alternatives
+        return alternatives
+
+    return [[lit.lower() for lit in _sequence_literals(items) if lit]]
+
+
+def _sequence_literals(items):
+    literals = [b'']
+    for op, value in items:
+        if op == sre_constants.LITERAL:
+            literals[-1] += struct.pack(b'B', value) if value < 256 else b''
+        elif op == sre_constants.SUBPATTERN and not _has_branch(list(value[-1])):
+            sub = _sequence_literals(list(value[-1]))
+            literals[-1] += sub[0]
+            literals += sub[1:]
+        elif op == sre_constants.AT:
+            continue
+        else:
+            literals.append(b'')
+    return literals
+
+
+def _has_branch(items):
+    return any(op == sre_constants.BRANCH for op, _ in items)
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return st.st_ino, st.st_size, st.st_mtime
+
+
+class _Segment(object):
+    '''
+    Immutable part of index with postings of some file ids
+        lookup   - sorted fixed size entries, see _ENTRY
+        postings - delta-encoded file ids
+    '''
+
+    def __init__(self, segment_dir):
+        self.segment_dir = segment_dir
+        self.stat_key = _stat_key(os.path.join(segment_dir, 'lookup'))
+        self._lookup = self._mmap('lookup')
+        self._postings = self._mmap('postings')
+
+    def _mmap(self, name):
+        with open(os.path.join(self.segment_dir, name), 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def write(segment_dir, postings):
+        os.makedirs(segment_dir)
+
+        offset = 0
+        with open(os.path.join(segment_dir, 'postings'), 'wb') as postings_file, \
+                open(os.path.join(segment_dir, 'lookup'), 'wb') as lookup_file:
+            for trigram in sorted(postings):
+                file_ids = postings[trigram]
+                typecode, data = encode_postings(file_ids)
+                postings_file.write(data)
+                lookup_file.write(_ENTRY.pack(trigram, offset, len(file_ids), typecode))
+                offset += len(data)
+
+    def _read_postings(self, offset, count, typecode):
+        size = count * array(str(typecode.decode('ascii'))).itemsize
+        return decode_postings(typecode, self._postings[offset:offset + size])
+
+    def file_ids(self, trigram):
+        """
+        Binary search of trigram in memory-mapped lookup table
+        """
+        lo, hi = 0, len(self._lookup) // _ENTRY.size
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key, offset, count, typecode = _ENTRY.unpack_from(self._lookup, mid * _ENTRY.size)
+            if key < trigram:
+                lo = mid + 1
+            elif key > trigram:
+                hi = mid
+            else:
+                return self._read_postings(offset, count, typecode)
+
+        return []
+
+    def iter_postings(self):
+        for pos in range(0, len(self._lookup), _ENTRY.size):
+            key, offset, count, typecode = _ENTRY.unpack_from(self._lookup, pos)
+            yield key, self._read_postings(offset, count, typecode)
+
+
+class TrigramIndex(object):
+    '''
+    On-disk trigram index, maps trigrams of file contents to files they occur in
+    Files of index directory:
+        meta           - json with current generation, list of its segments and options tree was walked with
+        gen-N.files    - marshal: paths by file id and tombstoned file ids
+        gen-N.manifest - marshal: {path: (file id, inode, size, mtime)} of indexed tree
+        gen-N.dirs     - marshal: {path: mtime} of walked directories, they change when files are added or deleted
+        seg-N/         - segments, see _Segment
+    Update adds segment with changed files only and tombstones their previous ids,
+    compaction merges all segments into one without tombstoned ids
+    '''
+
+    VERSION = 3
+
+    # compaction is started when part of tombstoned ids or amount of segments is exceeded
+    COMPACT_TOMBSTONES_RATIO = 0.25
+    COMPACT_SEGMENTS_COUNT = 16
+
+    # file id of files in manifest which aren't indexed (binary or unreadable)
+    NOT_INDEXED = -1
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self._meta = None
+        self._paths = None
+        self._tombstones = None
+        self._segments = None
+
+        # read-only data of files of current generation and its segments, they are kept while their
+        # files stay the same: index of long-living process (daemon) isn't read again by every search
+        # gen-N.KIND -> (stat key, data)
+        self._loaded = {}
+        # segment name -> _Segment
+        self._loaded_segments = {}
+
+    def _path(self, *names):
+        return os.path.join(self.index_dir, *names)
+
+    def exists(self):
+        return os.path.exists(self._path('meta'))
+
+    @property
+    def generation(self):
+        meta = self._read_meta()
+        return meta['generation'] if meta else 0
+
+    @property
+    def walk_options(self):
+        """
+        Options tree was walked with when index was built, None for indexes of older versions
+        """
+        meta = self._read_meta()
+        if not meta or meta.get('version') != self.VERSION:
+            return None
+        return meta['walk']
+
+    def _read_meta(self):
+        try:
+            with open(self._path('meta')) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _read_marshal(self, name, is_kept=False):
+        """
+        Return data of marshal file, kept one is shared between calls, so it must not be changed
+        """
+        if is_kept:
+            key = _stat_key(self._path(name))
+            loaded = self._loaded.get(name)
+            if loaded and loaded[0] == key:
+                return loaded[1]
+
+        with open(self._path(name), 'rb') as f:
+            data = marshal.load(f)
+
+        if is_kept:
+            self._loaded[name] = (key, data)
+        return data
+
+    def _write_marshal(self, name, data):
+        with open(self._path(name), 'wb') as f:
+            marshal.dump(data, f)
+
+    def _read_generation(self, kinds, is_kept=False):
+        """
+        Return meta and contents of its gen-N.KIND files, kept ones mustn't be changed by caller
+        """
+        for attempt in range(2):
+            meta = self._read_meta()
+            names = ['gen-{}.{}'.format(meta['generation'], kind) for kind in kinds]
+            try:
+                data = [self._read_marshal(name, is_kept) for name in names]
+                break
+            except (IOError, OSError):
+                # generation was replaced by concurrent update meanwhile
+                if attempt:
+                    raise
+
+        if is_kept:
+            for name in list(self._loaded):
+                if not name.startswith('gen-{}.'.format(meta['generation'])):
+                    del self._loaded[name]
+        return [meta] + data
+
+    @contextmanager
+    def _lock(self):
+        if not os.path.isdir(self.index_dir):
+            os.makedirs(self.index_dir)
+
+        with open(self._path('lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _commit(self, meta, paths, tombstones, manifest, dirs, segments, walk):
+        """
+        Write new generation and atomically switch index to it, then remove stale files
+        """
+        generation = meta['generation'] + 1 if meta else 1
+        self._write_marshal('gen-{}.files'.format(generation), (paths, sorted(tombstones)))
+        self._write_marshal('gen-{}.manifest'.format(generation), manifest)
+        self._write_marshal('gen-{}.dirs'.format(generation), dirs)
+
+        with open(self._path('meta.tmp'), 'w') as f:
+            json.dump({'version': self.VERSION, 'generation': generation, 'segments': segments, 'walk': walk}, f)
+        os.rename(self._path('meta.tmp'), self._path('meta'))
+
+        live = set(segments) | set('gen-{}.{}'.format(generation, kind) for kind in ('files', 'manifest', 'dirs'))
+        for name in os.listdir(self.index_dir):
+            if (name.startswith('gen-') or name.startswith('seg-')) and name not in live:
+                self._remove(name)
+
+    def _remove(self, name):
+        path = self._path(name)
+        if os.path.isdir(path):
+            for child in os.listdir(path):
+                os.remove(os.path.join(path, child))
+            os.rmdir(path)
+        else:
+            os.remove(path)
+
+    def _new_segment_name(self):
+        numbers = [int(name.split('-')[1]) for name in os.listdir(self.index_dir) if name.startswith('seg-')]
+        return 'seg-{}'.format(max(numbers) + 1 if numbers else 1)
+
+    def _tokenize(self, paths, first_id, manifest, stats):
+        """
+        Read trigrams of paths, which get file ids starting with first_id
+        Return postings and list of indexed paths, manifest gets entries for them
+        """
+        postings = {}
+        indexed = []
+
+        if not paths:
+            return postings, indexed
+
+        pool = Pool(cpu_count())
+        try:
+            for path, trigrams in pool.imap(_file_trigrams_worker, paths, 16):
+                if trigrams is None:
+                    manifest[path] = (self.NOT_INDEXED,) + stats[path]
+                    continue
+
+                file_id = first_id + len(indexed)
+                indexed.append(path)
+                manifest[path] = (file_id,) + stats[path]
+
+                for trigram in trigrams:
+                    postings.setdefault(trigram, []).append(file_id)
+            pool.close()
+        finally:
+            pool.terminate()
+
+        return postings, indexed
+
+    def _stat_files(self, files):
+        stats = OrderedDict()
+        for path in files:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stats[path] = (st.st_ino, st.st_size, st.st_mtime)
+        return stats
+
+    def _stat_dirs(self, dirs):
+        mtimes = {}
+        for path in dirs:
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                continue
+        return mtimes
+
+    def build(self, files, dirs=(), walk=None):
+        """
+        Index given files from scratch, return (amount of files, amount of trigrams)
+        :param: dirs - directories files were listed from, see find_changed()
+        :param: walk - options tree was walked with, they are only kept for walk_options
+        """
+        with self._lock():
+            meta = self._read_meta()
+            stats = self._stat_files(files)
+            manifest = {}
+            postings, paths = self._tokenize(list(stats), 0, manifest, stats)
+
+            segment = self._new_segment_name()
+            _Segment.write(self._path(segment), postings)
+            self._commit(meta, paths, set(), manifest, self._stat_dirs(dirs), [segment], walk)
+
+        return len(paths), len(postings)
+
+    def update(self, files, dirs=(), walk=None):
+        """
+        Re-index added and changed files, tombstone deleted ones
+        Index is built from scratch if tree was walked with other options
+        Return (amount of added, changed, deleted files)
+        """
+        if not self.exists() or self.walk_options != walk:
+            files_count, _ = self.build(files, dirs, walk)
+            return files_count, 0, 0
+
+        with self._lock():
+            meta, (paths, tombstones), manifest = self._read_generation(('files', 'manifest'))
+            tombstones = set(tombstones)
+
+            stats = self._stat_files(files)
+            added, changed = [], []
+
+            for path, stat in stats.items():
+                entry = manifest.get(path)
+                if entry is None:
+                    added.append(path)
+                elif entry[1:] != stat:
+                    changed.append(path)
+
+            deleted = [path for path in manifest if path not in stats]
+
+            for path in changed + deleted:
+                file_id = manifest.pop(path)[0]
+                if file_id != self.NOT_INDEXED:
+                    tombstones.add(file_id)
+
+            segments = list(meta['segments'])
+            postings, indexed = self._tokenize(added + changed, len(paths), manifest, stats)
+
+            if postings:
+                segment = self._new_segment_name()
+                _Segment.write(self._path(segment), postings)
+                segments.append(segment)
+
+            self._commit(meta, paths + indexed, tombstones, manifest, self._stat_dirs(dirs), segments, walk)
+
+        if self._needs_compaction(len(paths + indexed), len(tombstones), len(segments)):
+            self._compact_in_background()
+
+        return len(added), len(changed), len(deleted)
+
+    def _needs_compaction(self, files_count, tombstones_count, segments_count):
+        if segments_count > self.COMPACT_SEGMENTS_COUNT:
+            return True
+        return files_count and float(tombstones_count) / files_count > self.COMPACT_TOMBSTONES_RATIO
+
+    def _compact_in_background(self):
+        if not hasattr(os, 'fork'):
+            self.compact()
+            return
+
+        if os.fork():
+            return
+
+        # detached child, it must never return into caller's code
+        try:
+            os.setsid()
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            self.compact()
+        finally:
+            os._exit(0)
+
+    def compact(self):
+        """
+        Merge all segments into one, without tombstoned file ids
+        """
+        with self._lock():
+            meta, (paths, tombstones), manifest, dirs = self._read_generation(('files', 'manifest', 'dirs'))
+            tombstones = set(tombstones)
+
+            new_ids = {}
+            for file_id, path in enumerate(paths):
+                if file_id not in tombstones:
+                    new_ids[file_id] = len(new_ids)
+
+            # segments hold increasing ranges of ids, so merged lists stay sorted
+            postings = {}
+            for segment in meta['segments']:
+                for trigram, file_ids in _Segment(self._path(segment)).iter_postings():
+                    file_ids = [new_ids[i] for i in file_ids if i in new_ids]
+                    if file_ids:
+                        postings.setdefault(trigram, []).extend(file_ids)
+
+            for path, entry in manifest.items():
+                if entry[0] != self.NOT_INDEXED:
+                    manifest[path] = (new_ids[entry[0]],) + entry[1:]
+
+            segment = self._new_segment_name()
+            _Segment.write(self._path(segment), postings)
+            paths = [path for file_id, path in enumerate(paths) if file_id in new_ids]
+            self._commit(meta, paths, set(), manifest, dirs, [segment], meta['walk'])
+
+    def find_changed(self, roots=None):
+        """
+        Return path of indexed file or walked directory inside roots which changed since index was built
+        or updated, None if index is up to date. Costs stat of every file of roots, but no reads
+        """
+        _, manifest, dirs = self._read_generation(('manifest', 'dirs'), is_kept=True)
+
+        for path in filter_paths(sorted(dirs), roots):
+            try:
+                if os.stat(path).st_mtime != dirs[path]:
+                    return path
+            except OSError:
+                return path
+
+        for path in filter_paths(sorted(manifest), roots):
+            try:
+                st = os.stat(path)
+            except OSError:
+                return path
+            if manifest[path][1:] != (st.st_ino, st.st_size, st.st_mtime):
+                return path
+
+        return None
+
+    def _open(self):
+        """
+        Load current generation, files and segments which didn't change since the last time are reused
+        """
+        meta, (paths, tombstones) = self._read_generation(('files',), is_kept=True)
+        if paths is not self._paths:
+            self._paths = paths
+            self._tombstones = set(tombstones)
+        self._meta = meta
+
+        segments = {}
+        for name in meta['segments']:
+            segment = self._loaded_segments.get(name)
+            if segment is None or segment.stat_key != _stat_key(self._path(name, 'lookup')):
+                segment = _Segment(self._path(name))
+            segments[name] = segment
+        self._loaded_segments = segments
+        self._segments = [segments[name] for name in meta['segments']]
+
+    def load(self):
+        """
+        Read index ahead of searches: daemon loads it before it forks processes of requests
+        """
+        self._open()
+        self._read_generation(('manifest', 'dirs'), is_kept=True)
+
+    def _file_ids(self, trigram):
+        file_ids = set()
+        for segment in self._segments:
+            file_ids.update(segment.file_ids(trigram))
+        return file_ids - self._tombstones
+
+    def candidates(self, alternatives):
+        """
+        Return sorted paths of files which can contain given literals, see required_literals()
+        """
+        self._open()
+        file_ids = set()
+
+        for literals in alternatives:
+            trigrams = set()
+            for literal in literals:
+                trigrams.update(literal[i:i + 3] for i in range(len(literal) - 2))
+
+            matched = None
+            for trigram in sorted(trigrams):
+                ids = self._file_ids(trigram)
+                matched = ids if matched is None else (matched & ids)
+                if not matched:
+                    break
+
+            file_ids |= matched or set()
+
+        return [self._paths[i] for i in sorted(file_ids)]
+
+
+def open_index(index_dir=INDEX_DIR_NAME):
+    """
+    Return index of directory for searches, the same instance for the same directory:
+    what it has loaded is reused while index doesn't change
+    """
+    index_dir = os.path.abspath(index_dir)
+    index = _opened.pop(index_dir, None) or TrigramIndex(index_dir)
+    _opened[index_dir] = index
+    while len(_opened) > MAX_OPENED:
+        _opened.popitem(last=False)
+    return index
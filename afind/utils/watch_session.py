@@ -0,0 +1,219 @@
+from __future__ import unicode_literals, print_function
+import os
+import sys
+import time
+import bisect
+from collections import OrderedDict
+from afind.utils.files_walker import TreeWalker
+from afind.utils.search_options import SearchOptions
+from afind.utils.term_colors import TermColors
+from afind.utils.tree_watcher import create_watcher
+
+
+def _subtract(lines, other_lines):
+    """
+    Return lines whose text isn't in other lines, repeated texts are counted
+    """
+    counts = {}
+    for _, line_text in other_lines:
+        counts[line_text] = counts.get(line_text, 0) + 1
+
+    result = []
+    for line in lines:
+        if counts.get(line[1]):
+            counts[line[1]] -= 1
+        else:
+            result.append(line)
+    return result
+
+
+class WatchSession(object):
+    '''
+    --watch: after initial search, only changed files are searched again and matched lines which
+    appeared (+) or disappeared (-) are printed. Matched lines of every file are kept in memory,
+    they are compared by text, so lines only moved by edits above them aren't reported.
+    Changed directories are listed again with the same ignore rules as tree was walked with,
+    so new, deleted and newly ignored files are found too
+    '''
+
+    # changes are collected till there are no new ones for this time, but not longer than max
+    DEBOUNCE_SECONDS = 0.1
+    MAX_DEBOUNCE_SECONDS = 1.0
+
+    # files searched at once, the rest waits for the next tick
+    MAX_FILES_PER_TICK = 200
+
+    ADDED_COLOR   = TermColors.make_flags(fg=TermColors.green, bold=True)
+    REMOVED_COLOR = TermColors.make_flags(fg=TermColors.red, bold=True)
+
+    def __init__(self, parser, parser_params, afind_params, include_rx=None, excluder=None, is_tty=False):
+        self.parser = parser
+        self.parser_params = parser_params
+        self.afind_params = afind_params
+        self.options = SearchOptions(parser_params)
+        self.walker = TreeWalker.from_options(self.options, include_rx, excluder, keep_dirs=True)
+        self.is_tty = is_tty
+        self.watcher = None
+
+        # filename -> [(line_num, line_text)] of matched lines
+        self._results = {}
+        # watched directory -> paths of its files to search
+        self._dir_files = OrderedDict()
+        # directory -> names of files given as search paths, they are watched alone
+        self._file_roots = {}
+        # path -> it has to be searched (False if it is gone or ignored now)
+        self._pending = OrderedDict()
+
+    def start(self):
+        """
+        List tree and start watching it, so changes made during initial search are found too
+        """
+        for root in self.walker.paths:
+            if os.path.isdir(root):
+                root = root.rstrip(b'/') or b'/'
+                self.walker.dirs[root] = ()
+                self._add_tree(root, is_new=False)
+            else:
+                dirpath, name = os.path.split(root)
+                self._file_roots.setdefault(dirpath or b'.', set()).add(name)
+
+        self.watcher = create_watcher(list(self._dir_files) + list(self._file_roots))
+        sys.stderr.write('@afind watch: {} directories ({}), Ctrl-C to stop\n'.format(
+            len(self._dir_files) + len(self._file_roots), self.watcher.NAME))
+
+    def record(self, results_stream):
+        """
+        Pass results of initial search through, keeping matched lines of every file
+        """
+        for res in results_stream:
+            if res.is_match:
+                self._results.setdefault(res.filename, []).append((int(res.line_num), res.line_text))
+            yield res
+
+    def run(self):
+        """
+        Search changed files till interrupted
+        """
+        while True:
+            changes = self.watcher.wait(0 if self._pending else None)
+
+            deadline = time.time() + self.MAX_DEBOUNCE_SECONDS
+            while changes:
+                self._apply_changes(changes)
+                if time.time() >= deadline:
+                    break
+                changes = self.watcher.wait(self.DEBOUNCE_SECONDS)
+
+            if self._pending:
+                self._tick()
+
+    def _add_tree(self, dirpath, is_new=True):
+        stack = [dirpath]
+        while stack:
+            dirpath = stack.pop()
+            files, subdirs = self.walker.rescan_dir(dirpath)
+            self._dir_files[dirpath] = set(files)
+            stack += subdirs
+
+            if is_new:
+                for path in files:
+                    self._pending[path] = True
+                self._watch(dirpath)
+
+    def _remove_tree(self, dirpath):
+        prefix = dirpath + b'/'
+        for subdir in [d for d in self._dir_files if d == dirpath or d.startswith(prefix)]:
+            for path in self._dir_files.pop(subdir):
+                self._pending[path] = False
+            self.walker.dirs.pop(subdir, None)
+            self.watcher.remove_dir(subdir)
+
+    def _watch(self, dirpath):
+        try:
+            self.watcher.add_dir(dirpath)
+        except OSError as e:
+            sys.stderr.write(b'@afind watch: can\'t watch ' + dirpath + b': ' + (e.strerror or str(e)) + b'\n')
+
+    def _apply_changes(self, changes):
+        """
+        Mark files of changed directories for search: changed and new ones, and gone ones to drop their lines
+        """
+        ignore_names = set(self.walker.ignore_files)
+
+        # parents go first: directory with changed ignore file makes all below it listed again
+        queue = sorted(changes)
+        while queue:
+            dirpath = queue.pop(0)
+            names = changes[dirpath]
+
+            for name in self._file_roots.get(dirpath, ()):
+                if names is None or name in names:
+                    self._pending[self.walker.display(os.path.join(dirpath, name))] = True
+
+            if dirpath not in self._dir_files:
+                continue
+
+            known = self._dir_files[dirpath]
+            files, subdirs = self.walker.rescan_dir(dirpath)
+            files = set(files)
+            self._dir_files[dirpath] = files
+
+            changed = files
+            if names is not None:
+                changed = files & set(self.walker.display(os.path.join(dirpath, name)) for name in names)
+            for path in known - files:
+                self._pending[path] = False
+            for path in sorted((files - known) | changed):
+                self._pending[path] = True
+
+            for subdir in subdirs:
+                if subdir not in self._dir_files:
+                    self._add_tree(subdir)
+                elif (names is None or names & ignore_names) and subdir not in changes:
+                    changes[subdir] = set()
+                    bisect.insort(queue, subdir)
+
+            subdirs = set(subdirs)
+            for subdir in [d for d in self._dir_files if os.path.dirname(d) == dirpath and d not in subdirs]:
+                self._remove_tree(subdir)
+
+    def _tick(self):
+        batch = []
+        while self._pending and len(batch) < self.MAX_FILES_PER_TICK:
+            batch.append(self._pending.popitem(last=False))
+
+        paths = [path for path, is_searched in batch if is_searched and os.path.isfile(path)]
+        results = self._search(paths)
+
+        for path, _ in sorted(batch):
+            self._report(path, results.get(path, []))
+        sys.stdout.flush()
+
+    def _search(self, paths):
+        """
+        Return {filename: [(line_num, line_text)]} of matched lines in paths
+        """
+        results = {}
+        if not paths:
+            return results
+
+        # paths are bytes like walker yields them, names which aren't utf-8 are searched as they are
+        parser_params = self.options.with_paths(paths)
+        for res in self.parser.get_results(parser_params, self.afind_params):
+            if res.is_match:
+                results.setdefault(res.filename, []).append((int(res.line_num), res.line_text))
+        return results
+
+    def _report(self, path, lines):
+        old_lines = self._results.pop(path, [])
+        if lines:
+            self._results[path] = lines
+
+        for sign, color, diff_lines in (
+                (b'-', self.REMOVED_COLOR, _subtract(old_lines, lines)),
+                (b'+', self.ADDED_COLOR, _subtract(lines, old_lines))):
+            for line_num, line_text in diff_lines:
+                prefix = b'%s%s:%d:' % (sign, path, line_num)
+                if self.is_tty:
+                    prefix = color + prefix + TermColors.RESET
+                sys.stdout.write(prefix + line_text + b'\n')
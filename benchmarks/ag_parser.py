@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+'''
+Lines/sec of AgParser on recorded --ackmate output, replayed instead of running ag,
+against parsing every line with its own regex match, as AgParser did before.
+Results are consumed like PipeFormatter (no columns) and like TtyFormatter (columns are read)
+
+usage: python benchmarks/ag_parser.py [REPEAT_COUNT]
+'''
+from __future__ import print_function, unicode_literals
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from afind.backends._base import ParseResult
+from afind.backends.ag import AgParser
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'ackmate.txt')
+
+
+class ReplayParser(AgParser):
+    '''
+    Parses output given as chunks instead of running ag
+    '''
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def _get_cmd_chunks(self, command):
+        return iter(self.chunks)
+
+
+class PerLineParser(ReplayParser):
+    '''
+    Parsing of every line separately with columns parsed at once
+    '''
+
+    MATCH_STR_RE = re.compile(br'^(\d+)(?:;(\d+[ ]\d+(?:,\d+[ ]\d+)*))?:(.*)$')
+
+    def get_results(self, parser_params, afind_params):
+        current_filename = b''
+
+        for line in self._get_cmd_output(''):
+            if not line:
+                current_filename = b''
+                yield ParseResult.FILE_FINISHED
+
+            elif line.startswith(b':'):
+                current_filename = line[1:]
+                yield ParseResult(ParseResult.KIND_TITLE, current_filename)
+
+            elif line.strip() == b'--':
+                yield ParseResult.GROUP_DELIMITER
+
+            else:
+                parsed = self.MATCH_STR_RE.match(line)
+                if not parsed:
+                    continue
+
+                line_num, line_cols, line_text = parsed.groups()
+                if line_cols:
+                    line_cols = [map(int, c.split(b' ')) for c in line_cols.split(b',')]
+                else:
+                    line_cols = []
+
+                yield ParseResult(ParseResult.KIND_LINE, current_filename, line_text, line_num, line_cols)
+
+        yield ParseResult.RESULTS_FINISHED
+
+
+def make_chunks(data, chunk_size=AgParser.READ_CHUNK_SIZE):
+    """
+    Split data into chunks of whole lines, like ParserBase._get_cmd_chunks yields them
+    """
+    chunks = []
+    start = 0
+    while start < len(data):
+        end = data.rfind(b'\n', start, start + chunk_size) + 1 or len(data)
+        chunks.append(data[start:end])
+        start = end
+    return chunks
+
+
+def consume_pipe(results):
+    for res in results:
+        if res.line_text is not None:
+            res.is_match
+
+
+def consume_tty(results):
+    for res in results:
+        if res.line_text is not None:
+            res.line_cols
+
+
+def measure(parser_class, chunks, consume, lines_count):
+    time_started = time.time()
+    consume(parser_class(chunks).get_results([], {}))
+    return lines_count / (time.time() - time_started)
+
+
+def main():
+    repeat_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+    with open(FIXTURE, 'rb') as f:
+        fixture = f.read()
+
+    # replayed fixture copies are separated like files in ag output
+    data = b'\n'.join([fixture] * repeat_count)
+    chunks = make_chunks(data)
+    lines_count = data.count(b'\n')
+
+    print('{:<10} {:>14} {:>14} {:>8}'.format('consumer', 'per-line l/s', 'bulk l/s', 'speedup'))
+    for name, consume in (('pipe', consume_pipe), ('tty', consume_tty)):
+        before = measure(PerLineParser, chunks, consume, lines_count)
+        after = measure(ReplayParser, chunks, consume, lines_count)
+        print('{:<10} {:>14,.0f} {:>14,.0f} {:>7.2f}x'.format(name, before, after, after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+'''
+Deterministic synthetic corpus for benchmarks: the same seed and scale always give the same files.
+Corpus has:
+    small/     - many small source-like files in a few levels of directories
+    huge/      - a few huge files
+    minified/  - files with very long lines
+    latin1/    - files which aren't valid UTF-8
+    deep/      - one file per level of a deep directory tree
+Word NEEDLE occurs in every kind of files, so every scenario has results
+
+usage: python benchmarks/corpus.py DIR [--seed N] [--scale X]
+'''
+from __future__ import print_function, unicode_literals
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+
+
+NEEDLE = 'needle'
+
+WORDS = [
+    'def', 'return', 'self', 'import', 'class', 'value', 'result', 'options', 'item', 'items',
+    'config', 'path', 'filename', 'buffer', 'offset', 'length', 'index', 'count', 'parser', 'stream',
+    'for', 'in', 'if', 'else', 'None', 'True', 'False', 'while', 'yield', 'lambda',
+]
+
+# chance of NEEDLE instead of other word
+NEEDLE_RATE = 0.002
+
+# bump when generated content changes, so existing corpora are regenerated
+VERSION = 1
+
+MANIFEST_NAME = '.corpus.json'
+
+
+class CorpusGenerator(object):
+
+    def __init__(self, root, seed=0, scale=1.0):
+        self.root = root
+        self.seed = seed
+        self.scale = scale
+        self._random = random.Random(seed)
+
+    def _count(self, count):
+        return max(1, int(count * self.scale))
+
+    # only random() is used, as randint() and choice() give different numbers in Python 2 and 3
+    def _randint(self, a, b):
+        return a + int(self._random.random() * (b - a + 1))
+
+    def _word(self):
+        if self._random.random() < NEEDLE_RATE:
+            return NEEDLE
+        return WORDS[self._randint(0, len(WORDS) - 1)]
+
+    def _words(self, count):
+        return ' '.join(self._word() for _ in range(count))
+
+    def _line(self):
+        return ' ' * (4 * self._randint(0, 3)) + self._words(self._randint(0, 12))
+
+    def _write(self, relpath, data):
+        path = os.path.join(self.root, relpath)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def _text(self, lines_count):
+        return ('\n'.join(self._line() for _ in range(lines_count)) + '\n').encode('utf-8')
+
+    def generate_small(self):
+        for i in range(self._count(2000)):
+            relpath = os.path.join('small', 'pkg{}'.format(i % 20), 'mod{}'.format(i % 7), 'file{}.py'.format(i))
+            self._write(relpath, self._text(self._randint(10, 80)))
+
+    def generate_huge(self):
+        for i in range(3):
+            self._write(os.path.join('huge', 'huge{}.log'.format(i)), self._text(self._count(200000)))
+
+    def generate_minified(self):
+        for i in range(self._count(20)):
+            lines = [self._words(self._randint(10000, 40000)) for _ in range(3)]
+            self._write(os.path.join('minified', 'bundle{}.min.js'.format(i)), '\n'.join(lines).encode('utf-8'))
+
+    def generate_latin1(self):
+        for i in range(self._count(100)):
+            lines = [self._line() + ' caf\xe9 \xfcber' for _ in range(self._randint(10, 80))]
+            self._write(os.path.join('latin1', 'file{}.txt'.format(i)), '\n'.join(lines).encode('latin-1'))
+
+    def generate_deep(self):
+        parts = []
+        for i in range(self._count(40)):
+            parts.append('level{}'.format(i))
+            self._write(os.path.join('deep', *parts + ['file.py']), self._text(self._randint(10, 80)))
+
+    def generate(self):
+        """
+        Generate corpus if it doesn't exist yet or was generated with other params, return its root
+        Directory which isn't empty and wasn't made by generator is never removed
+        """
+        params = {'version': VERSION, 'seed': self.seed, 'scale': self.scale}
+        manifest_path = os.path.join(self.root, MANIFEST_NAME)
+
+        try:
+            with open(manifest_path) as f:
+                existing = json.load(f)
+        except (IOError, OSError, ValueError):
+            existing = None
+
+        if existing == params:
+            return self.root
+        if existing is not None:
+            shutil.rmtree(self.root)
+        elif os.path.isdir(self.root) and os.listdir(self.root):
+            raise ValueError('{} is not empty and is not a corpus'.format(self.root))
+
+        self.generate_small()
+        self.generate_huge()
+        self.generate_minified()
+        self.generate_latin1()
+        self.generate_deep()
+
+        with open(manifest_path, 'w') as f:
+            json.dump(params, f)
+
+        return self.root
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Generate synthetic corpus for benchmarks')
+    args_parser.add_argument('root')
+    args_parser.add_argument('--seed', type=int, default=0)
+    args_parser.add_argument('--scale', type=float, default=1.0)
+    args = args_parser.parse_args()
+
+    CorpusGenerator(args.root, args.seed, args.scale).generate()
+    print(args.root)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
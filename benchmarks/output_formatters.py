@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+'''
+Lines/sec of result formatters with buffered output sink against writing every fragment directly,
+as formatters did before sink was added. Output goes to /dev/null
+
+usage: python benchmarks/output_formatters.py [LINES_COUNT]
+'''
+from __future__ import print_function, unicode_literals
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from afind.backends._base import ParseResult
+from afind.utils.output_sink import OutputSink
+from afind.utils.result_formatters import TtyFormatter, PipeFormatter, PatchFormatter
+from afind.utils.json_formatter import JsonFormatter
+
+
+LINES_PER_FILE = 50
+
+
+class DirectSink(object):
+    '''
+    Writes every fragment to stream as soon as it is given
+    '''
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, *parts):
+        for part in parts:
+            self._stream.write(part)
+
+    def end_line(self):
+        pass
+
+    def end_file(self):
+        pass
+
+    def flush(self):
+        self._stream.flush()
+
+
+def make_results(lines_count):
+    results = []
+    for i in range(lines_count):
+        line_num = i % LINES_PER_FILE + 1
+        if line_num == 1:
+            if i:
+                results.append(ParseResult.FILE_FINISHED)
+            filename = b'src/module_%d/file_%d.py' % (i // 1000, i // LINES_PER_FILE)
+            results.append(ParseResult(ParseResult.KIND_TITLE, filename))
+
+        results.append(ParseResult(
+            ParseResult.KIND_LINE,
+            filename=filename,
+            line_text=b'    result = process_item(item, options=options)  # item %d' % i,
+            line_num=b'%d' % line_num,
+            line_cols=[(13, 7), (26, 4)],
+        ))
+    results.append(ParseResult.RESULTS_FINISHED)
+    return results
+
+
+def measure(formatter_class, sink, results, lines_count):
+    time_started = time.time()
+    for _ in formatter_class(iter(results), sink=sink):
+        pass
+    return lines_count / (time.time() - time_started)
+
+
+def main():
+    lines_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    results = make_results(lines_count)
+    devnull = open(os.devnull, 'wb')
+
+    print('{:<16} {:>14} {:>14} {:>8}'.format('formatter', 'direct l/s', 'buffered l/s', 'speedup'))
+    for formatter_class in (TtyFormatter, PipeFormatter, PatchFormatter, JsonFormatter):
+        before = measure(formatter_class, DirectSink(devnull), results, lines_count)
+        after = measure(formatter_class, OutputSink(devnull, interactive=False), results, lines_count)
+        print('{:<16} {:>14,.0f} {:>14,.0f} {:>7.2f}x'.format(formatter_class.__name__, before, after, after / before))
+
+
+if __name__ == '__main__':
+    main()
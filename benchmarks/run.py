@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+'''
+End-to-end benchmarks: every scenario is run with every installed backend on synthetic corpus.
+For each run are measured:
+    ttfr          - seconds from start till the first byte of output
+    wall          - seconds till process exit
+    lines         - amount of output lines
+    lines_per_sec - lines / wall
+    max_rss_kb    - peak resident memory of afind and backend it runs
+Time values are medians of repeated runs, memory is the maximum.
+
+Results are printed or saved as JSON. With --baseline they are compared against stored results:
+every value which became worse by more than --threshold is reported and exit code is 1
+
+usage: python benchmarks/run.py [--corpus DIR] [--scale X] [--repeat N] [--backend NAME]
+                                [--scenario NAME] [--output FILE] [--baseline FILE] [--threshold X]
+'''
+from __future__ import print_function, unicode_literals
+import os
+import pty
+import sys
+import json
+import time
+import errno
+import platform
+import argparse
+from subprocess import Popen
+from collections import OrderedDict
+
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_dir)
+
+from afind.backends.registry import BACKENDS, find_executable
+from corpus import CorpusGenerator, NEEDLE
+
+
+DEFAULT_CORPUS_DIR = os.path.join(project_dir, 'benchmarks', 'corpus')
+
+# name: params of afind, is_tty - output goes to pseudo terminal
+SCENARIOS = OrderedDict([
+    ('pipe',    {'params': [NEEDLE]}),
+    ('tty',     {'params': [NEEDLE], 'is_tty': True}),
+    ('patch',   {'params': [NEEDLE, '--make-patch']}),
+    ('json',    {'params': [NEEDLE, '--json']}),
+    ('exclude', {'params': [NEEDLE, '-nG', 'minified|latin1']}),
+    ('context', {'params': [NEEDLE, '-C', '3']}),
+])
+
+# values which are worse when bigger
+COMPARED_VALUES = ['ttfr', 'wall', 'max_rss_kb']
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def installed_backends():
+    return [name for name, backend in BACKENDS.items()
+            if not backend['executable'] or find_executable(backend['executable'])]
+
+
+def run_once(command, cwd, is_tty=False):
+    """
+    Run command, read its output and return measurements of the run
+    """
+    if is_tty:
+        read_fd, write_fd = pty.openpty()
+    else:
+        read_fd, write_fd = os.pipe()
+
+    time_started = time.time()
+    with open(os.devnull, 'wb') as devnull:
+        proc = Popen(command, stdout=write_fd, stderr=devnull, cwd=cwd)
+    os.close(write_fd)
+
+    ttfr = None
+    lines = 0
+
+    while True:
+        try:
+            chunk = os.read(read_fd, READ_CHUNK_SIZE)
+        except OSError as e:
+            # pseudo terminal reports end of output as EIO
+            if e.errno == errno.EIO:
+                break
+            raise
+        if not chunk:
+            break
+        if ttfr is None:
+            ttfr = time.time() - time_started
+        lines += chunk.count(b'\n')
+
+    os.close(read_fd)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    wall = time.time() - time_started
+    proc.returncode = status
+
+    return {
+        'ttfr': ttfr,
+        'wall': wall,
+        'lines': lines,
+        'max_rss_kb': rusage.ru_maxrss,
+    }
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def run_scenario(backend, scenario, corpus_dir, repeat):
+    command = [sys.executable, os.path.join(project_dir, 'afind'), '--backend', backend] + scenario['params']
+    runs = [run_once(command, corpus_dir, scenario.get('is_tty', False)) for _ in range(repeat)]
+
+    ttfrs = [run['ttfr'] for run in runs if run['ttfr'] is not None]
+    wall = median([run['wall'] for run in runs])
+    lines = max(run['lines'] for run in runs)
+
+    return OrderedDict([
+        ('ttfr', median(ttfrs) if ttfrs else None),
+        ('wall', wall),
+        ('lines', lines),
+        ('lines_per_sec', lines / wall if wall else None),
+        ('max_rss_kb', max(run['max_rss_kb'] for run in runs)),
+    ])
+
+
+def compare(results, baseline, threshold):
+    """
+    Return list of regressions: (run name, value name, baseline value, new value)
+    """
+    regressions = []
+
+    for name, values in results.items():
+        base_values = baseline.get(name)
+        if not base_values:
+            continue
+
+        for value_name in COMPARED_VALUES:
+            value, base_value = values.get(value_name), base_values.get(value_name)
+            if value is None or not base_value:
+                continue
+            if value > base_value * (1 + threshold):
+                regressions.append((name, value_name, base_value, value))
+
+    return regressions
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Run end-to-end benchmarks of afind')
+    args_parser.add_argument('--corpus', default=DEFAULT_CORPUS_DIR, help='directory of generated corpus')
+    args_parser.add_argument('--seed', type=int, default=0)
+    args_parser.add_argument('--scale', type=float, default=1.0, help='size of corpus relative to default one')
+    args_parser.add_argument('--repeat', type=int, default=3, help='runs of every scenario')
+    args_parser.add_argument('--backend', action='append', help='backend to run, all installed ones by default')
+    args_parser.add_argument('--scenario', action='append', choices=list(SCENARIOS), help='scenario to run')
+    args_parser.add_argument('--output', help='file to save results to as JSON')
+    args_parser.add_argument('--baseline', help='JSON file of stored results to compare with')
+    args_parser.add_argument('--threshold', type=float, default=0.1, help='allowed relative regression')
+    args = args_parser.parse_args()
+
+    corpus_dir = CorpusGenerator(args.corpus, args.seed, args.scale).generate()
+    backends = args.backend or installed_backends()
+    scenarios = args.scenario or list(SCENARIOS)
+
+    results = OrderedDict()
+    for backend in backends:
+        for scenario_name in scenarios:
+            name = '{}/{}'.format(backend, scenario_name)
+            results[name] = run_scenario(backend, SCENARIOS[scenario_name], corpus_dir, args.repeat)
+            sys.stderr.write('{:<20} {}\n'.format(name, json.dumps(results[name])))
+
+    report = OrderedDict([
+        ('meta', OrderedDict([
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('seed', args.seed),
+            ('scale', args.scale),
+            ('repeat', args.repeat),
+        ])),
+        ('results', results),
+    ])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        for key in ('seed', 'scale'):
+            if baseline['meta'].get(key) != report['meta'][key]:
+                sys.stderr.write('warning: baseline was made with other corpus {}\n'.format(key))
+
+        regressions = compare(results, baseline['results'], args.threshold)
+        for name, value_name, base_value, value in regressions:
+            sys.stderr.write('regression: {} {}: {:.4g} -> {:.4g} ({:+.1%})\n'.format(
+                name, value_name, base_value, value, value / base_value - 1))
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
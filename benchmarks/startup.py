@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+'''
+Cold start benchmark: time from start of afind till it runs search backend.
+Backend is replaced by fake script which only records time it was started at and exits,
+so measured value is the overhead afind adds to every search. Target is TARGET_MS.
+
+Measured are `python afind` of source tree and dist/af.pyz, build it first with makeonefile.py
+
+usage: python benchmarks/startup.py [--repeat N] [--backend rg|ag]
+'''
+from __future__ import print_function, unicode_literals
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+from subprocess import call
+
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from run import median
+
+
+TARGET_MS = 30
+
+# fake backend prints time it was started at, date of coreutils gives it with nanoseconds
+FAKE_BACKEND = '#!/bin/sh\ndate +%s.%N >> "$AFIND_STARTUP_LOG"\n'
+
+
+def make_fake_backend(bin_dir, name):
+    path = os.path.join(bin_dir, name)
+    with open(path, 'w') as f:
+        f.write(FAKE_BACKEND)
+    os.chmod(path, 0o755)
+
+
+def measure(command, env, log_path, repeat):
+    """
+    Return median milliseconds from start of command till its backend is started
+    """
+    timings = []
+
+    with open(os.devnull, 'wb') as devnull:
+        for _ in range(repeat):
+            if os.path.exists(log_path):
+                os.remove(log_path)
+
+            time_started = time.time()
+            call(command, env=env, stdout=devnull, stderr=devnull)
+            with open(log_path) as f:
+                timings.append((float(f.read().split()[0]) - time_started) * 1000)
+
+    return median(timings)
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Measure cold start of afind')
+    args_parser.add_argument('--repeat', type=int, default=20)
+    args_parser.add_argument('--backend', default='rg', choices=['rg', 'ag'])
+    args = args_parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='afind-startup-')
+    try:
+        make_fake_backend(tmp_dir, args.backend)
+        log_path = os.path.join(tmp_dir, 'started.log')
+
+        env = dict(os.environ)
+        env['PATH'] = tmp_dir + os.pathsep + env.get('PATH', '')
+        env['AFIND_STARTUP_LOG'] = log_path
+        env.pop('AFIND_DAEMON', None)
+
+        # fake backend alone, its own start isn't overhead of afind
+        own_start = measure([os.path.join(tmp_dir, args.backend)], env, log_path, args.repeat)
+
+        commands = [('source', [sys.executable, os.path.join(project_dir, 'afind')])]
+        pyz_path = os.path.join(project_dir, 'dist', 'af.pyz')
+        if os.path.exists(pyz_path):
+            commands.append(('pyz', [sys.executable, pyz_path]))
+        else:
+            sys.stderr.write('dist/af.pyz not found, run makeonefile.py to measure it\n')
+
+        exit_code = 0
+        for name, command in commands:
+            command += ['--backend', args.backend, 'needle', tmp_dir]
+            startup = measure(command, env, log_path, args.repeat) - own_start
+            is_ok = startup <= TARGET_MS
+            exit_code = exit_code or int(not is_ok)
+            verdict = 'ok' if is_ok else 'above target of {} ms'.format(TARGET_MS)
+            print('{:<8} {:6.1f} ms  {}'.format(name, startup, verdict))
+
+        return exit_code
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+'''
+Tree walking benchmark: time to list files to search in synthetic corpus.
+Compared are TreeWalker of native backend with pool of threads and without it,
+plain os.walk as baseline and, if they are installed, `ag -g .` and `rg --files`.
+Values are medians of repeated runs in seconds, amount of listed files is printed too
+
+usage: python benchmarks/walker.py [--corpus DIR] [--scale X] [--repeat N] [--workers N]
+'''
+from __future__ import print_function, unicode_literals
+import os
+import sys
+import time
+import argparse
+from subprocess import Popen, PIPE
+
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_dir)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from afind.backends.registry import find_executable
+from afind.utils.files_walker import TreeWalker, scandir
+from corpus import CorpusGenerator
+from run import median, DEFAULT_CORPUS_DIR
+
+
+def os_walk():
+    count = 0
+    for _, dirnames, filenames in os.walk(b'.'):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(b'.'))
+        count += sum(1 for name in filenames if not name.startswith(b'.'))
+    return count
+
+
+def tree_walker(workers):
+    return lambda: sum(1 for _ in TreeWalker([], workers=workers))
+
+
+def external(command):
+    def run():
+        process = Popen(command, stdout=PIPE)
+        output = process.communicate()[0]
+        return output.count(b'\n')
+    return run
+
+
+def measure(walk, repeat):
+    """
+    Return (median seconds, amount of files)
+    """
+    timings = []
+    for _ in range(repeat):
+        time_started = time.time()
+        count = walk()
+        timings.append(time.time() - time_started)
+    return median(timings), count
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Measure listing of files to search')
+    args_parser.add_argument('--corpus', default=DEFAULT_CORPUS_DIR, help='directory of generated corpus')
+    args_parser.add_argument('--seed', type=int, default=0)
+    args_parser.add_argument('--scale', type=float, default=1.0, help='size of corpus relative to default one')
+    args_parser.add_argument('--repeat', type=int, default=5)
+    args_parser.add_argument('--workers', type=int, default=TreeWalker.WORKERS, help='threads of TreeWalker')
+    args = args_parser.parse_args()
+
+    corpus_dir = CorpusGenerator(args.corpus, args.seed, args.scale).generate()
+    os.chdir(corpus_dir)
+
+    walkers = [
+        ('os.walk', os_walk),
+        ('TreeWalker/1', tree_walker(1)),
+        ('TreeWalker/{}'.format(args.workers), tree_walker(args.workers)),
+    ]
+    if find_executable('ag'):
+        walkers.append(('ag -g .', external(['ag', '-g', '.', '--nocolor'])))
+    if find_executable('rg'):
+        walkers.append(('rg --files', external(['rg', '--files'])))
+
+    # without scandir every entry costs lstat, the numbers measure that fallback then
+    print('TreeWalker lists directories with {}'.format(
+        'scandir' if scandir is not None else 'listdir + lstat (no os.scandir or scandir package)'))
+
+    for name, walk in walkers:
+        seconds, count = measure(walk, args.repeat)
+        print('{:<16} {:8.4f} s  {} files'.format(name, seconds, count))
+
+
+if __name__ == '__main__':
+    main()
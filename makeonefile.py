@@ -1,46 +1,72 @@
 #!/usr/bin/env python
+'''
+Build dist/af.pyz: executable zip with afind package, which python runs like a script.
+Modules are stored with bytecode compiled by the interpreter running the build,
+so they aren't compiled on every start. Other interpreters compile them from source
+'''
 from __future__ import print_function, unicode_literals
 import os
+import sys
+import stat
+import time
+import struct
+import zipfile
+import marshal
+import imp
 
 
 project_dir = os.path.dirname(os.path.abspath(__file__))
 
+SHEBANG = b'#!/usr/bin/env python\n'
+
+MAIN_SOURCE = b'from afind.entry_point import main\nmain()\n'
+
+
+def iter_package_files(package_dir):
+    for dirpath, dirnames, filenames in os.walk(package_dir):
+        dirnames[:] = sorted(d for d in dirnames if d != '__pycache__')
+        for filename in sorted(filenames):
+            if filename.endswith('.py') and filename != '__main__.py':
+                yield os.path.join(dirpath, filename)
+
+
+def compile_source(source, filename, mtime):
+    """
+    Return content of .pyc file, the same as py_compile writes
+    """
+    code = compile(source, filename, 'exec', dont_inherit=True)
+    return imp.get_magic() + struct.pack(b'<I', mtime) + marshal.dumps(code)
+
+
+def add_module(archive, arcname, source):
+    # zipimport uses bytecode only if its timestamp equals timestamp of source in archive,
+    # which has precision of 2 seconds
+    mtime = int(time.time()) // 2 * 2
+    date_time = time.localtime(mtime)[:6]
+
+    info = zipfile.ZipInfo(arcname, date_time)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    archive.writestr(info, source)
+
+    info = zipfile.ZipInfo(arcname + 'c', date_time)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    archive.writestr(info, compile_source(source, arcname, mtime))
+
 
 def main():
-    files = [
-        'afind/utils/term_colors.py',
-        'afind/utils/result_formatters.py',
-        'afind/utils/filenames_collector.py',
-        'afind/backends/_base.py',
-        'afind/backends/ag.py',
-        'afind/application.py',
-        'afind/entry_point.py',
-    ]
-
-    outname = os.path.join(project_dir, 'dist', 'af.py')
-    outfile = open(outname, 'w')
-
-    outfile.writelines([
-        '#!/usr/bin/env python\n',
-        'from __future__ import print_function, unicode_literals\n',
-        '\n',
-    ])
-
-    for filename in files:
-        with open(filename) as f:
-            lines = f.read().splitlines()
-            lines = [
-                '\n',
-                '#-- {} {}\n'.format(filename, '-' * 20)
-            ] + [
-                (ln + '\n') for ln in lines
-                if not ln.startswith('from afind.') and not ln.startswith('from __future__')
-            ]
-
-            outfile.writelines(lines)
+    outname = os.path.join(project_dir, 'dist', 'af.pyz')
+
+    with open(outname, 'wb') as outfile:
+        outfile.write(SHEBANG)
+        with zipfile.ZipFile(outfile, 'w') as archive:
+            add_module(archive, '__main__.py', MAIN_SOURCE)
+            for path in iter_package_files(os.path.join(project_dir, 'afind')):
+                with open(path, 'rb') as f:
+                    add_module(archive, os.path.relpath(path, project_dir), f.read())
 
+    os.chmod(outname, os.stat(outname).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
     print('Created ' + outname)
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
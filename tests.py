@@ -3,6 +3,10 @@ from __future__ import unicode_literals, print_function
 import os
 import re
 import sys
+import pty
+import json
+import time
+import base64
 import unittest
 from itertools import chain
 from subprocess import Popen, PIPE
@@ -12,7 +16,7 @@ project_dir = os.path.dirname(os.path.abspath(__file__))
 path = lambda *parts: os.path.join(project_dir, *parts)
 
 
-def afind(params='', sort_results=False, get_errors=False):
+def afind(params='', sort_results=False, get_errors=False, get_raw=False):
     cmd  = 'python ' + path('afind') + ' ' + params
     proc = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True, env=os.environ)
     out, err = proc.communicate()
@@ -20,7 +24,8 @@ def afind(params='', sort_results=False, get_errors=False):
     if get_errors:
         return err
 
-    out = out.decode('utf-8')
+    if not get_raw:
+        out = out.decode('utf-8')
 
     lines = out.splitlines()
     if sort_results:
@@ -29,6 +34,32 @@ def afind(params='', sort_results=False, get_errors=False):
     return lines
 
 
+def afind_patched(params, setup):
+    """
+    Run afind after setup lines of code, which can patch its modules, return its stderr
+    """
+    script = '\n'.join(['import os, sys', 'sys.path.insert(0, sys.argv.pop(1))'] + setup + [
+        'import afind.entry_point',
+        'afind.entry_point.main()',
+    ])
+    proc = Popen(['python', '-c', script, project_dir] + params, stdout=PIPE, stderr=PIPE, cwd=project_dir)
+    return proc.communicate()[1].decode('utf-8').splitlines()
+
+
+def afind_failing_rename(params, failing_suffix):
+    """
+    Run afind in which renaming over files ending with failing_suffix fails, return its stderr
+    """
+    return afind_patched(params, [
+        'rename = os.rename',
+        'def failing_rename(src, dst):',
+        '    if dst.endswith({!r}):'.format(failing_suffix),
+        '        raise OSError(13, b"Zugriff verweigert f\\xc3\\xbcr Datei")',
+        '    rename(src, dst)',
+        'os.rename = failing_rename',
+    ])
+
+
 class TestAfind(unittest.TestCase):
 
     def test_01_search_simple(self):
@@ -99,11 +130,12 @@ class TestAfind(unittest.TestCase):
             'workdir/file1.py:2:def func1():',
         ])
 
-    def test_07_handle_decode_error(self):
-        self.assertEqual(afind('line_with_special_chars workdir -A 1', get_errors=True), (
-            b'@afind decode-error: 2;4 23:\xa9\xc0\xa9\xa4line_with_special_chars\n' +
-            b'@afind decode-error: 3:\xa9\xa6      S0_background_app.png\n'
-        ))
+    def test_07_keep_non_utf8_lines(self):
+        self.assertEqual(afind('line_with_special_chars workdir -A 1', get_raw=True), [
+            b'workdir/file4.txt:2:\xa9\xc0\xa9\xa4line_with_special_chars',
+            b'workdir/file4.txt:3-\xa9\xa6      S0_background_app.png',
+        ])
+        self.assertEqual(afind('line_with_special_chars workdir -A 1', get_errors=True), b'')
 
     def test_08_open_in_sublime(self):
         subl_out = path('workdir', 'bin', 'subl.out')
@@ -218,7 +250,693 @@ class TestAfind(unittest.TestCase):
         for lang in ['en', 'de']:
             os.system('rm -rf ' + path('workdir', 'lang-' + lang + '.json'))
 
+    def test_12_apply_patch_dry_run(self):
+        filename = path('workdir', 'lang-en.json')
+        content = '{\n    "network_unavalable": "Network is unavalable"\n}\n'
+
+        with open(filename, 'w') as target_file:
+            target_file.write(content)
+
+        with open(path('workdir', 'test_apply_patch.patch'), 'w') as patchfile:
+            patchfile.write('\n'.join([
+                '--- a/workdir/lang-en.json',
+                '+++ b/workdir/lang-en.json',
+                '@@ -2,1 +2,1 @@',
+                '-    "network_unavalable": "Network is unavalable"',
+                '+    "network_unavalable": "Sorry, network is unavalable"',
+                '--- a/workdir/lang-de.json',
+                '+++ b/workdir/lang-de.json',
+                '@@ -2,1 +2,1 @@',
+                '-    "network_unavalable": "Network is unavalable"',
+                '+    "network_unavalable": "Entschuldigung, Netzwerk nicht verfügbar ist"',
+                '',
+            ]).encode('utf-8'))
+
+        # file of second block doesn't exist, so nothing has to be changed
+        err = afind('--apply-patch ' + path('workdir', 'test_apply_patch.patch'), get_errors=True)
+        self.assertEqual(err.splitlines(), [
+            b'@afind patch-error: workdir/lang-de.json: No such file or directory',
+            b'@afind patch: 1 of 2 files failed, nothing was changed',
+        ])
+        self.assertEqual(open(filename).read(), content)
+
+        self.assertEqual(afind('--apply-patch ' + path('workdir', 'test_apply_patch.patch') + ' --dry-run'), [
+            'checking file workdir/lang-en.json',
+        ])
+
+        os.system('rm -rf ' + path('workdir', 'test_apply_patch.patch'))
+        os.system('rm -rf ' + filename)
+
+
+class TestAfindNative(unittest.TestCase):
 
+    def test_01_search_simple(self):
+        self.assertEqual(afind('func1 workdir --native'), [
+            'workdir/file1.py:2:def func1():',
+        ])
+
+        self.assertEqual(afind('func1 workdir -C 1 --native --force-colors'), [
+            '\033[1;32mworkdir/file1.py\033[0m',
+            '\033[1;33m1-\033[0m',
+            '\033[1;33m2:\033[0mdef \033[30;43mfunc1\033[0m():',
+            '\033[1;33m3-\033[0m    pass',
+        ])
+
+    def test_02_search_with_group_delimeter(self):
+        self.assertEqual(afind('println workdir -C 1 --native'), [
+            'workdir/file2.scala:2-    def main(args: Array[String]) {',
+            'workdir/file2.scala:3:        println("Hello, world!")',
+            'workdir/file2.scala:4-        // empty line',
+            'workdir/file2.scala:5:        println("Second print")',
+            'workdir/file2.scala:6-        // three',
+            '--',
+            'workdir/file2.scala:8-        // lines',
+            'workdir/file2.scala:9:        println("Third print")',
+            'workdir/file2.scala:10-    }',
+        ])
+
+    def test_03_exlude_files(self):
+        self.assertEqual(afind('def workdir -nG scala --native'), [
+            'workdir/file1.py:2:def func1():',
+        ])
+        self.assertEqual(afind("'def|func1|Alphabets' workdir -nG 'glob:*.scala' -nG ^workdir/file3 --native"), [
+            'workdir/file1.py:2:def func1():',
+        ])
+        self.assertEqual(afind('def workdir -nG glob:workdir --native'), [])
+        self.assertEqual(afind("def workdir -nG '(' --native", get_errors=True),
+                         b'Error: Wrong -nG pattern: unbalanced parenthesis\n')
+
+    def test_04_search_with_index(self):
+        os.system('rm -rf ' + path('.afind-index'))
+        afind('--index-build')
+
+        self.assertEqual(afind('println workdir --native --use-index'), [
+            'workdir/file2.scala:3:        println("Hello, world!")',
+            'workdir/file2.scala:5:        println("Second print")',
+            'workdir/file2.scala:9:        println("Third print")',
+        ])
+        self.assertEqual(afind('no_such_text_anywhere workdir --native --use-index'), [])
+
+        # paths of index are relative to current directory, search paths can be absolute
+        self.assertEqual(afind('println ' + path('workdir') + ' --native --use-index'), [
+            path('workdir', 'file2.scala') + ':3:        println("Hello, world!")',
+            path('workdir', 'file2.scala') + ':5:        println("Second print")',
+            path('workdir', 'file2.scala') + ':9:        println("Third print")',
+        ])
+        self.assertEqual(afind('println ' + path('workdir') + ' --native --use-index', get_errors=True), b'')
+
+        # inverted search reports files without the literal, so it isn't narrowed to files with it
+        for option in ('-v', '--invert-match', '-L', '--files-without-matches'):
+            cmd = [line for line in afind('println workdir --native --use-index --afind-dbg ' + option)
+                   if line.startswith('@afind cmd:')]
+            self.assertEqual(cmd, ['@afind cmd: native println workdir ' + option])
+
+        self.assertEqual(afind('println workdir --native --use-index --hidden', get_errors=True),
+                         b'@afind index: it was built with other --hidden, -u, -U, -G or -nG options, '
+                         b'searching without index\n')
+
+        new_file = path('workdir', 'index_new.txt')
+        with open(new_file, 'w') as f:
+            f.write('println of new file\n')
+        try:
+            self.assertEqual(afind('println workdir --native --use-index')[-1],
+                             'workdir/index_new.txt:1:println of new file')
+            self.assertEqual(afind('println workdir --native --use-index', get_errors=True),
+                             b'@afind index: workdir changed since index was built, '
+                             b'searching without index (run --index-update)\n')
+        finally:
+            os.system('rm -rf ' + new_file)
+
+        os.system('rm -rf ' + path('.afind-index'))
+
+    def test_05_replace(self):
+        filename = path('workdir', 'replace.txt')
+        with open(filename, 'w') as target_file:
+            target_file.write('one call_a(1)\ntwo\nthree call_b(3) call_c(3)\n')
+
+        self.assertEqual(afind("'call_(\\w)' workdir/replace.txt --native --replace 'invoke_\\1' --replace-diff"), [
+            '--- a/workdir/replace.txt',
+            '+++ b/workdir/replace.txt',
+            '@@ -1,1 +1,1 @@',
+            '-one call_a(1)',
+            '+one invoke_a(1)',
+            '@@ -3,1 +3,1 @@',
+            '-three call_b(3) call_c(3)',
+            '+three invoke_b(3) invoke_c(3)',
+        ])
+        self.assertEqual(open(filename).read(), 'one invoke_a(1)\ntwo\nthree invoke_b(3) invoke_c(3)\n')
+
+        os.system('rm -rf ' + filename)
+
+    def test_05_replace_rename_error(self):
+        filenames = [path('workdir', 'replace_{}.txt'.format(i)) for i in range(1, 4)]
+        for filename in filenames:
+            with open(filename, 'w') as target_file:
+                target_file.write('one call_a(1)\n')
+
+        # renaming over the second file fails, error message is localized
+        err = afind_failing_rename(['call_a', 'workdir', '--native', '--file-search-regex', 'replace_\\d',
+                                    '--replace', 'invoke_a'], b'_2.txt')
+        try:
+            self.assertEqual(err, [
+                '@afind replace-error: workdir/replace_1.txt: rewritten',
+                '@afind replace-error: workdir/replace_2.txt: not rewritten',
+                '@afind replace-error: workdir/replace_3.txt: not rewritten',
+                '@afind replace: 1 of 3 files rewritten before error: Zugriff verweigert für Datei',
+            ])
+            self.assertEqual([open(filename).read() for filename in filenames],
+                             ['one invoke_a(1)\n', 'one call_a(1)\n', 'one call_a(1)\n'])
+            self.assertEqual([name for name in os.listdir(path('workdir')) if name.startswith('.afind-')], [])
+        finally:
+            os.system('rm -rf ' + ' '.join(filenames))
+
+    def test_05_apply_patch_error(self):
+        filename = path('workdir', 'patch_error.txt')
+        patch_filename = path('workdir', 'patch_error.patch')
+        with open(filename, 'w') as target_file:
+            target_file.write('one\n')
+        with open(patch_filename, 'w') as patch_file:
+            patch_file.write('--- a/workdir/patch_error.txt\n+++ b/workdir/patch_error.txt\n'
+                             '@@ -1,1 +1,1 @@\n-one\n+two\n')
+
+        try:
+            self.assertEqual(afind_failing_rename(['--apply-patch', patch_filename], b'patch_error.txt'), [
+                '@afind patch-error: workdir/patch_error.txt: Zugriff verweigert für Datei',
+                '@afind patch: 1 of 1 files failed',
+            ])
+            self.assertEqual(open(filename).read(), 'one\n')
+        finally:
+            os.system('rm -rf {} {}'.format(filename, patch_filename))
+
+    def test_06_profile(self):
+        profile_json = path('workdir', 'profile.json')
+
+        err = afind('def workdir --native --afind-profile --afind-profile-json ' + profile_json, get_errors=True)
+        stages = [line.split()[0] for line in err.decode('utf-8').splitlines()[2:]]
+        self.assertEqual(stages, ['spawn', 'first_byte', 'read', 'parse', 'format', 'collect', 'post'])
+
+        report = json.load(open(profile_json))
+        os.system('rm -rf ' + profile_json)
+        self.assertEqual(report['stages']['parse']['events'], 6)
+        self.assertEqual(report['stages']['format']['bytes_written'], 90)
+
+    def test_07_json_output(self):
+        events = [json.loads(line) for line in afind("'line_with_special_chars|func1' workdir -A 1 --native --json")]
+        self.assertEqual(events, [
+            {'type': 'begin', 'path': 'workdir/file1.py'},
+            {'type': 'match', 'path': 'workdir/file1.py', 'line_number': 2, 'text': 'def func1():', 'cols': [[4, 5]]},
+            {'type': 'context', 'path': 'workdir/file1.py', 'line_number': 3, 'text': '    pass'},
+            {'type': 'end', 'path': 'workdir/file1.py', 'matches': 1},
+            {'type': 'begin', 'path': 'workdir/file4.txt'},
+            {'type': 'match', 'path': 'workdir/file4.txt', 'line_number': 2,
+             'text': {'bytes': 'qcCppGxpbmVfd2l0aF9zcGVjaWFsX2NoYXJz'}, 'cols': [[4, 23]]},
+            {'type': 'context', 'path': 'workdir/file4.txt', 'line_number': 3,
+             'text': {'bytes': 'qaYgICAgICBTMF9iYWNrZ3JvdW5kX2FwcC5wbmc='}},
+            {'type': 'end', 'path': 'workdir/file4.txt', 'matches': 1},
+            {'type': 'summary', 'files': 2, 'matches': 2, 'lines': 4},
+        ])
+
+    def test_08_daemon(self):
+        os.environ['AFIND_SOCKET'] = path('workdir', 'daemon.sock')
+        tree = path('workdir', 'daemon_tree')
+        daemon = Popen('exec python ' + path('afind') + ' --daemon', stderr=PIPE, shell=True, env=os.environ)
+        try:
+            daemon.stderr.readline()
+
+            self.assertEqual(afind('println workdir -C 1 --native --use-daemon'),
+                             afind('println workdir -C 1 --native'))
+            self.assertEqual(afind('func1 workdir --native --use-daemon --backend unknown', get_errors=True),
+                             b'Error: Unknown backend unknown, use one of: rg, ag, native\n')
+
+            # ignore rules kept by daemon are parsed again once their file changes
+            os.makedirs(tree)
+            for name in ('a.txt', 'b.txt'):
+                with open(os.path.join(tree, name), 'w') as f:
+                    f.write('daemon_marker\n')
+            with open(os.path.join(tree, '.gitignore'), 'w') as f:
+                f.write('a.txt\n')
+            self.assertEqual(afind('daemon_marker workdir/daemon_tree --native --use-daemon'),
+                             ['workdir/daemon_tree/b.txt:1:daemon_marker'])
+            self.assertEqual(afind('daemon_marker workdir/daemon_tree --native --use-daemon'),
+                             ['workdir/daemon_tree/b.txt:1:daemon_marker'])
+            with open(os.path.join(tree, '.gitignore'), 'w') as f:
+                f.write('b.txt\n# changed\n')
+            self.assertEqual(afind('daemon_marker workdir/daemon_tree --native --use-daemon'),
+                             ['workdir/daemon_tree/a.txt:1:daemon_marker'])
+        finally:
+            daemon.terminate()
+            daemon.wait()
+            del os.environ['AFIND_SOCKET']
+            os.system('rm -rf ' + tree)
+
+        # client doesn't import application, daemon runs it
+        proc = Popen([sys.executable, '-c', 'import sys; import afind.daemon; '
+                      'print("afind.application" in sys.modules)'], stdout=PIPE, cwd=project_dir)
+        self.assertEqual(proc.communicate()[0], b'False\n')
+
+        self.assertFalse(os.path.exists(path('workdir', 'daemon.sock')))
+
+    def test_09_limits(self):
+        self.assertEqual(afind('println workdir --native --max-results 2'), [
+            'workdir/file2.scala:3:        println("Hello, world!")',
+            'workdir/file2.scala:5:        println("Second print")',
+        ])
+        self.assertEqual(afind('println workdir --native --max-results 2', get_errors=True),
+                         b'@afind: results are truncated, --max-results is reached\n')
+
+        # nothing is left out when there are exactly as many matches as allowed
+        self.assertEqual(afind('println workdir -A 1 --native --max-results 3'), afind('println workdir -A 1 --native'))
+        self.assertEqual(afind('println workdir --native --max-results 3', get_errors=True), b'')
+
+        self.assertEqual(afind("'def|println' workdir --native --max-files 1", sort_results=True), [
+            'workdir/file1.py:2:def func1():',
+        ])
+        self.assertEqual(afind('println workdir --native --max-files 1', get_errors=True), b'')
+        self.assertEqual(len(afind('println workdir --native --deadline 10')), 3)
+
+    def test_10_patterns_file(self):
+        patterns_file = path('workdir', 'patterns.txt')
+        with open(patterns_file, 'w') as f:
+            f.write('func1\nprintln("Second\n\nno_such_text\n')
+
+        try:
+            self.assertEqual(afind('workdir/file1.py workdir/file2.scala --native --patterns-file ' + patterns_file), [
+                'workdir/file1.py:2:def func1():',
+                'workdir/file2.scala:5:        println("Second print")',
+            ])
+            self.assertEqual(afind('workdir/file2.scala --native --force-colors --patterns-file ' + patterns_file), [
+                '\033[1;32mworkdir/file2.scala\033[0m',
+                '\033[1;33m5:\033[0m        \033[30;46mprintln("Second\033[0m print")',
+            ])
+            self.assertEqual(afind('workdir/file1.py --native --patterns-summary --patterns-file ' + patterns_file,
+                                   get_errors=True).decode('utf-8').splitlines(), [
+                '@afind patterns: 1 of 3 found',
+                '       1     #1  func1',
+                '       0     #2  println("Second',
+                '       0     #4  no_such_text',
+            ])
+        finally:
+            os.system('rm -rf ' + patterns_file)
+
+    def test_11_ignore_files(self):
+        ignore_file = path('workdir', '.gitignore')
+        with open(ignore_file, 'w') as f:
+            f.write('# comment\n*.py\nbin/\n!file3-*\nfile3-*\n')
+
+        try:
+            self.assertEqual(afind('def workdir --native'), [
+                'workdir/file2.scala:2:    def main(args: Array[String]) {',
+            ])
+            self.assertEqual(afind('func1 workdir --native -U'), [
+                'workdir/file1.py:2:def func1():',
+            ])
+            self.assertEqual(afind('func1 workdir/file1.py --native'), [
+                'workdir/file1.py:2:def func1():',
+            ])
+            self.assertEqual(afind('comment workdir --native -u'), [
+                'workdir/.gitignore:1:# comment',
+            ])
+        finally:
+            os.system('rm -rf ' + ignore_file)
+
+    def test_12_git_rev(self):
+        self.assertEqual(afind('func1 workdir --rev HEAD'), [
+            'HEAD:workdir/file1.py:2:def func1():',
+        ])
+        self.assertEqual(afind('func1 workdir -G scala --rev HEAD'), [])
+        self.assertEqual(afind('func1 workdir --rev HEAD --replace func2', get_errors=True),
+                         b'Error: --replace can\'t be used with --rev\n')
+
+    def test_13_watch(self):
+        watched_file = path('workdir', 'watched.txt')
+        with open(watched_file, 'w') as f:
+            f.write('watch_marker one\n')
+
+        watcher = Popen('exec python ' + path('afind') + ' watch_marker workdir --native --watch',
+                        stdout=PIPE, stderr=PIPE, shell=True, env=os.environ)
+        try:
+            # tree is watched once it is reported
+            watcher.stderr.readline()
+            self.assertEqual(watcher.stdout.readline(), b'workdir/watched.txt:1:watch_marker one\n')
+
+            with open(watched_file, 'w') as f:
+                f.write('watch_marker two\n')
+            self.assertEqual(watcher.stdout.readline(), b'-workdir/watched.txt:1:watch_marker one\n')
+            self.assertEqual(watcher.stdout.readline(), b'+workdir/watched.txt:1:watch_marker two\n')
+
+            os.remove(watched_file)
+            self.assertEqual(watcher.stdout.readline(), b'-workdir/watched.txt:1:watch_marker two\n')
+
+            # name which isn't utf-8 is searched and reported as it is
+            with open(watched_file.encode('utf-8') + b'\xff', 'w') as f:
+                f.write('watch_marker three\n')
+            self.assertEqual(watcher.stdout.readline(), b'+workdir/watched.txt\xff:1:watch_marker three\n')
+        finally:
+            watcher.terminate()
+            watcher.wait()
+            os.system('rm -rf ' + watched_file + '*')
+
+        self.assertEqual(afind('todo workdir --native --watch --json', get_errors=True),
+                         b'Error: --json can\'t be used with --watch\n')
+
+    def test_14_index_update(self):
+        index_dir = path('.afind-index')
+        tree = path('workdir', 'index_update')
+        os.system('rm -rf {} {}'.format(index_dir, tree))
+        os.makedirs(tree)
+
+        def write(name, text):
+            with open(os.path.join(tree, name), 'w') as f:
+                f.write(text + '\n')
+
+        def search_with_index():
+            results = afind('update_marker workdir --native --use-index --afind-dbg')
+            # last line is command, it shows files index passed to backend
+            self.assertEqual(results[:-2], afind('update_marker workdir --native'))
+            return results[-1]
+
+        try:
+            write('changed.txt', 'update_marker before change')
+            write('deleted.txt', 'update_marker of deleted file')
+            for i in range(20):
+                write('filler{}.txt'.format(i), 'filler')
+            afind('--index-build')
+
+            write('changed.txt', 'no marker anymore')
+            os.remove(os.path.join(tree, 'deleted.txt'))
+            write('added.txt', 'update_marker of added file')
+            self.assertEqual(afind('--index-update'), ['@afind index: 1 added, 1 changed, 1 deleted'])
+
+            # ids of changed and deleted files are tombstoned, so they aren't candidates anymore
+            self.assertEqual(search_with_index(), '@afind cmd: native -- update_marker workdir/index_update/added.txt')
+
+            # tombstones exceed a quarter of file ids, segments are merged in background
+            for i in range(20):
+                os.remove(os.path.join(tree, 'filler{}.txt'.format(i)))
+            write('changed.txt', 'update_marker after change')
+            self.assertEqual(afind('--index-update'), ['@afind index: 0 added, 1 changed, 20 deleted'])
+
+            for _ in range(50):
+                meta = json.load(open(os.path.join(index_dir, 'meta')))
+                if len(meta['segments']) == 1:
+                    break
+                time.sleep(0.1)
+            self.assertEqual(len(meta['segments']), 1)
+
+            self.assertEqual(search_with_index(), '@afind cmd: native -- update_marker '
+                                                  'workdir/index_update/added.txt workdir/index_update/changed.txt')
+        finally:
+            os.system('rm -rf {} {}'.format(index_dir, tree))
+
+    def test_15_result_cache(self):
+        os.environ['AFIND_CACHE_DIR'] = path('.afind-test-cache')
+        new_file = path('workdir', 'cached_new.txt')
+        hidden_dir = path('workdir', '.cached_hidden')
+        os.system('rm -rf {} {} {}'.format(os.environ['AFIND_CACHE_DIR'], new_file, hidden_dir))
+
+        def search(params=''):
+            results = afind('println workdir --native --cache --afind-dbg ' + params)
+            return results[:-3], results[-1].split(' (')[0]
+
+        expected = afind('println workdir --native')
+        try:
+            # truncated results aren't stored
+            self.assertEqual(search('--max-results 1')[1], '@afind cache: miss')
+            self.assertEqual(search(), (expected, '@afind cache: miss'))
+            self.assertEqual(search(), (expected, '@afind cache: hit'))
+            self.assertEqual(search('--max-results 1'), (expected[:1], '@afind cache: hit'))
+
+            # new file changes mtime of its directory
+            with open(new_file, 'w') as f:
+                f.write('println of new file\n')
+            self.assertEqual(search(), (['workdir/cached_new.txt:1:println of new file'] + expected,
+                                        '@afind cache: miss'))
+            self.assertEqual(search()[1], '@afind cache: hit')
+
+            # entries have own directory, other caches share $AFIND_CACHE_DIR
+            self.assertTrue(os.listdir(path('.afind-test-cache', 'results')))
+
+            # searched hidden directories are part of fingerprint
+            self.assertEqual(search('--hidden')[1], '@afind cache: miss')
+            os.mkdir(hidden_dir)
+            with open(os.path.join(hidden_dir, 'new.txt'), 'w') as f:
+                f.write('println of hidden file\n')
+            self.assertEqual(search('--hidden')[1], '@afind cache: miss')
+            self.assertEqual(search('--hidden')[1], '@afind cache: hit')
+        finally:
+            os.system('rm -rf {} {} {}'.format(os.environ['AFIND_CACHE_DIR'], new_file, hidden_dir))
+            del os.environ['AFIND_CACHE_DIR']
+
+    def test_16_jobs(self):
+        tree = path('workdir', 'jobs')
+        files = {
+            '.gitignore': 'ignored\n*.log\n',
+            'x.log': 'jobs_marker log\n',
+            'ignored/b.txt': 'jobs_marker ignored\n',
+            'big/c.txt': 'jobs_marker big\n' + 'filler\n' * 20000 + 'jobs_marker big end\n',
+            'src/a.txt': 'jobs_marker a\n',
+            'src/d.txt': 'jobs_marker d\n',
+            'z.txt': 'jobs_marker z\n',
+        }
+        os.system('rm -rf ' + tree)
+        for name, text in files.items():
+            if not os.path.isdir(os.path.dirname(os.path.join(tree, name))):
+                os.makedirs(os.path.dirname(os.path.join(tree, name)))
+            with open(os.path.join(tree, name), 'w') as f:
+                f.write(text)
+
+        try:
+            for params in ('', ' -C 1', ' --make-patch', ' --force-colors', ' -u'):
+                expected = afind('jobs_marker workdir/jobs --native' + params, get_raw=True)
+                self.assertEqual(afind('jobs_marker workdir/jobs --native --jobs 3' + params, get_raw=True), expected)
+
+            self.assertEqual(afind('jobs_marker workdir/jobs --native --jobs 3'), [
+                'workdir/jobs/z.txt:1:jobs_marker z',
+                'workdir/jobs/big/c.txt:1:jobs_marker big',
+                'workdir/jobs/big/c.txt:20002:jobs_marker big end',
+                'workdir/jobs/src/a.txt:1:jobs_marker a',
+                'workdir/jobs/src/d.txt:1:jobs_marker d',
+            ])
+
+            # big file makes a shard of its own, so results come from several processes
+            cmd = [line for line in afind('jobs_marker workdir/jobs --native --jobs 3 --afind-dbg')
+                   if line.startswith('@afind cmd:')][0]
+            self.assertGreater(cmd.count('native --'), 1)
+
+            self.assertEqual(afind('jobs_marker workdir/jobs --native --jobs 0', get_errors=True),
+                             b'Error: Parameter --jobs requires positive argument\n')
+            self.assertEqual(afind('jobs_marker workdir/jobs --backend rg --jobs 2', get_errors=True),
+                             b'Error: --jobs can be used only with native backend\n')
+
+            # results stream closed early stops shards, first result is the one of the first shard
+            self.assertEqual(afind('jobs_marker workdir/jobs --native --jobs 3 --max-results 1'),
+                             ['workdir/jobs/z.txt:1:jobs_marker z'])
+        finally:
+            os.system('rm -rf ' + tree)
+
+
+    def test_17_open_in_editor_batches(self):
+        subl_out = path('workdir', 'bin', 'subl.out')
+        os.system('rm -rf ' + subl_out)
+
+        # locations which don't fit into one command line are given to several runs of editor
+        afind_patched(['def', 'workdir', '--native', '--subl'], [
+            'import afind.utils.filenames_collector as collector',
+            'collector.get_args_limit = lambda: 60',
+        ])
+        self.assertEqual(open(subl_out).read().splitlines(), [
+            'workdir/file1.py:2',
+            'workdir/file2.scala:2',
+        ])
+
+        afind('def workdir --native --subl')
+        self.assertEqual(open(subl_out).read().splitlines()[2:], [
+            'workdir/file1.py:2 workdir/file2.scala:2',
+        ])
+
+        os.system('rm -rf ' + subl_out)
+
+class TestAfindRg(unittest.TestCase):
+    """
+    rg is faked by workdir/bin/rg: it saves its arguments to rg.args and prints events of rg.json
+    """
+
+    rg_args = path('workdir', 'bin', 'rg.args')
+    rg_json = path('workdir', 'bin', 'rg.json')
+
+    def tearDown(self):
+        os.system('rm -rf {} {}'.format(self.rg_args, self.rg_json))
+
+    def write_events(self, events):
+        with open(self.rg_json, 'w') as f:
+            f.write(''.join(json.dumps(event) + '\n' for event in events))
+
+    def test_01_events(self):
+        def match(path, line_num, lines, submatches, event_type='match'):
+            return {'type': event_type, 'data': {
+                'path': path, 'lines': lines, 'line_number': line_num,
+                'submatches': [{'match': {'text': 'foo'}, 'start': start, 'end': end} for start, end in submatches],
+            }}
+
+        a_path = {'text': 'workdir/a.txt'}
+        b_path = {'bytes': base64.b64encode(b'workdir/\xff.txt').decode('ascii')}
+        self.write_events([
+            {'type': 'begin', 'data': {'path': a_path}},
+            match(a_path, 2, {'text': 'one foo two foo\n'}, [(4, 7), (12, 15)]),
+            match(a_path, 3, {'text': 'after\n'}, [], 'context'),
+            match(a_path, 6, {'text': 'foo again\n'}, [(0, 3)]),
+            {'type': 'end', 'data': {'path': a_path}},
+            {'type': 'begin', 'data': {'path': b_path}},
+            match(b_path, 1, {'bytes': base64.b64encode(b'\xa9 foo\n').decode('ascii')}, [(2, 5)]),
+            {'type': 'end', 'data': {'path': b_path}},
+            {'type': 'summary', 'data': {}},
+        ])
+
+        self.assertEqual(afind('foo workdir --backend rg -A 1', get_raw=True), [
+            b'workdir/a.txt:2:one foo two foo',
+            b'workdir/a.txt:3-after',
+            b'--',
+            b'workdir/a.txt:6:foo again',
+            b'workdir/\xff.txt:1:\xa9 foo',
+        ])
+        self.assertEqual([json.loads(line) for line in afind('foo workdir --backend rg --json')][:3], [
+            {'type': 'begin', 'path': 'workdir/a.txt'},
+            {'type': 'match', 'path': 'workdir/a.txt', 'line_number': 2, 'text': 'one foo two foo',
+             'cols': [[4, 3], [12, 3]]},
+            {'type': 'context', 'path': 'workdir/a.txt', 'line_number': 3, 'text': 'after'},
+        ])
+
+        # rg can't filter files by regex, events of other files are skipped
+        self.assertEqual(afind('foo workdir --backend rg -G a.txt', get_raw=True), [
+            b'workdir/a.txt:2:one foo two foo',
+            b'workdir/a.txt:3-after',
+            b'workdir/a.txt:6:foo again',
+        ])
+
+    def test_02_options(self):
+        afind('foo workdir --backend rg -i -A 1 --context -f -U -u -p .myignore --ignore vendor -n')
+        self.assertEqual(open(self.rg_args).read().split(), [
+            '--json', '--ignore-case', '--after-context=1', '--context=2', '--follow', '--no-ignore-vcs', '-uuu',
+            '--ignore-file=.myignore', '--glob=!vendor', '--max-depth=1', '--', 'foo', 'workdir',
+        ])
+
+        afind('foo workdir --backend rg -Q')
+        self.assertEqual(open(self.rg_args).read().split(), [
+            '--json', '--smart-case', '--fixed-strings', '--', 'foo', 'workdir',
+        ])
+
+        os.remove(self.rg_args)
+        for option in ['-g', '-l', '--vimgrep']:
+            self.assertEqual(afind('foo workdir --backend rg ' + option, get_errors=True),
+                             b'@afind rg: unsupported option: ' + option.encode('utf-8') + b'\n')
+        self.assertFalse(os.path.exists(self.rg_args))
+
+    def test_03_probe_backend(self):
+        cache_dir = path('.afind-test-cache')
+        bin_dir = path('workdir', 'probe_bin')
+        os.system('rm -rf {} {}'.format(cache_dir, bin_dir))
+        os.makedirs(bin_dir)
+
+        env = dict(os.environ, PATH=bin_dir, AFIND_CACHE_DIR=cache_dir)
+        del env['AFIND_BACKEND']
+
+        def search():
+            proc = Popen([sys.executable, path('afind'), 'foo', 'workdir', '--afind-dbg'],
+                         stdout=PIPE, stderr=PIPE, env=env)
+            out, _ = proc.communicate()
+            return out.decode('utf-8').splitlines()[-1].split()[2]
+
+        try:
+            self.assertEqual(search(), 'native')
+            self.assertEqual(json.load(open(os.path.join(cache_dir, 'backend.json')))['backend'], 'native')
+
+            # installed executable changes mtime of its directory, so cached result isn't trusted
+            os.system('cp {} {}'.format(path('workdir', 'bin', 'rg'), bin_dir))
+            self.assertEqual(search(), 'rg')
+            self.assertEqual(json.load(open(os.path.join(cache_dir, 'backend.json')))['backend'], 'rg')
+        finally:
+            os.system('rm -rf {} {}'.format(cache_dir, bin_dir))
+
+
+
+class TestAfindAgOutput(unittest.TestCase):
+
+    bin_dir = path('workdir', 'ag_bin')
+
+    def tearDown(self):
+        os.system('rm -rf ' + self.bin_dir)
+
+    def write_ag(self, *commands):
+        """
+        Make fake ag, which runs shell commands instead of search
+        """
+        os.system('rm -rf ' + self.bin_dir)
+        os.makedirs(self.bin_dir)
+        ag_path = os.path.join(self.bin_dir, 'ag')
+        with open(ag_path, 'w') as f:
+            f.write('#!/bin/sh\n' + '\n'.join(commands) + '\n')
+        os.chmod(ag_path, 0o755)
+        return dict(os.environ, PATH=self.bin_dir + os.pathsep + os.environ['PATH'], AFIND_BACKEND='ag')
+
+    def test_01_chunk_split_mid_line(self):
+        # the second line comes in two reads
+        env = self.write_ag("printf ':workdir/a.txt\\n1;4 3:one foo'", 'sleep 0.2', "printf ' two\\n2;0 3:foo\\n'")
+        proc = Popen(['python', path('afind'), 'foo', 'workdir'], stdout=PIPE, stderr=PIPE, env=env)
+        out, err = proc.communicate()
+        self.assertEqual(out.splitlines(), [
+            b'workdir/a.txt:1:one foo two',
+            b'workdir/a.txt:2:foo',
+        ])
+        self.assertEqual(err, b'')
+
+    def test_02_tty_flush(self):
+        env = self.write_ag("printf ':workdir/a.txt\\n1;0 3:foo one\\n'", 'sleep 2', "printf '2;0 3:foo two\\n'")
+
+        # terminal gets every line at once, pipe only when file is finished
+        master, slave = pty.openpty()
+        time_started = time.time()
+        proc = Popen(['python', path('afind'), 'foo', 'workdir'], stdout=slave, stderr=PIPE, env=env)
+        os.close(slave)
+        try:
+            out = b''
+            while b' one' not in out:
+                try:
+                    out += os.read(master, 1024)
+                except OSError:
+                    # terminal is closed after the end of output
+                    break
+            self.assertLess(time.time() - time_started, 1.5)
+            self.assertIn(b' one', out)
+            proc.wait()
+        finally:
+            os.close(master)
+
+        time_started = time.time()
+        proc = Popen(['python', path('afind'), 'foo', 'workdir'], stdout=PIPE, stderr=PIPE, env=env)
+        self.assertEqual(proc.stdout.readline(), b'workdir/a.txt:1:foo one\n')
+        self.assertGreater(time.time() - time_started, 1.5)
+        proc.communicate()
+
+    def test_03_parse_results(self):
+        # every kind of result: title, match with several columns, context line, group delimiter, end of file
+        env = self.write_ag("printf ':workdir/a.txt\\n1;4 3,12 3:one foo two foo\\n2:after\\n--\\n5;0 3:foo again\\n'",
+                            "printf '\\n:workdir/b.txt\\n3;2 3:a foo\\n'")
+        proc = Popen(['python', path('afind'), 'foo', 'workdir', '--json'], stdout=PIPE, stderr=PIPE, env=env)
+        out, err = proc.communicate()
+        self.assertEqual([json.loads(line) for line in out.splitlines()], [
+            {'type': 'begin', 'path': 'workdir/a.txt'},
+            {'type': 'match', 'path': 'workdir/a.txt', 'line_number': 1, 'text': 'one foo two foo',
+             'cols': [[4, 3], [12, 3]]},
+            {'type': 'context', 'path': 'workdir/a.txt', 'line_number': 2, 'text': 'after'},
+            {'type': 'delimiter'},
+            {'type': 'match', 'path': 'workdir/a.txt', 'line_number': 5, 'text': 'foo again', 'cols': [[0, 3]]},
+            {'type': 'end', 'path': 'workdir/a.txt', 'matches': 2},
+            {'type': 'begin', 'path': 'workdir/b.txt'},
+            {'type': 'match', 'path': 'workdir/b.txt', 'line_number': 3, 'text': 'a foo', 'cols': [[2, 3]]},
+            {'type': 'end', 'path': 'workdir/b.txt', 'matches': 1},
+            {'type': 'summary', 'files': 2, 'matches': 3, 'lines': 4},
+        ])
+        self.assertEqual(err, b'')
 
 class TestAfindAg(unittest.TestCase):
 
@@ -243,6 +961,8 @@ class TestAfindAg(unittest.TestCase):
 
 if __name__ == '__main__':
     os.environ['PATH'] = path('workdir', 'bin') + os.pathsep + os.environ['PATH']
+    # expected outputs are ones of ag, it shouldn't depend on the preferred backend installed
+    os.environ['AFIND_BACKEND'] = 'ag'
     os.system('chmod +x ' + path('workdir', 'bin', 'subl'))
     os.system('chmod +x ' + path('workdir', 'bin', 'atom'))
 